@@ -9,20 +9,25 @@ FastAPI Web 入口：
 from __future__ import annotations
 
 import asyncio
-import json
+import hashlib
+import itertools
 import logging
+import logging.handlers
 import os
+import queue
+import re
 import sqlite3
 import sys
-import tempfile
 import threading
-import uuid
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Any, AsyncGenerator, Optional
 
-from fastapi import FastAPI, File, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, Field
 
 ROOT_DIR = Path(__file__).resolve().parent
@@ -32,94 +37,214 @@ sys.path.insert(0, str(ROOT_DIR / "src"))
 from ai_ops_assistant.config import AppConfig, AssetConfig, load_config  # noqa: E402
 from ai_ops_assistant.orchestrator import run_instruction  # noqa: E402
 from ai_ops_assistant import asset_db  # noqa: E402
+from ai_ops_assistant.jsonutil import dumps_bytes  # noqa: E402
 from ai_ops_assistant.session_db import (  # noqa: E402
     init_db as init_session_db,
+    session_append_turn,
+    session_create,
     session_delete,
     session_get,
     session_list,
-    session_save,
 )
-from ai_ops_assistant.ssh_executor import upload_file_to_asset  # noqa: E402
+from ai_ops_assistant.ssh_executor import upload_stream_to_asset  # noqa: E402
 
 
 app = FastAPI(title="Linux 智能运维助手")
 
-# 流式执行任务取消：trace_id -> threading.Event，收到停止请求时 set()
-_run_cancel_events: dict[str, threading.Event] = {}
+# trace_id / session_id 生成：进程内计数器代替 uuid4（每次都要 os.urandom 系统调用）。输出仍为 12 位十六进制，与原格式一致。
+# 高 24 位是进程启动时取的随机前缀，低 24 位是从随机起点开始、只在低位内回绕的计数器：重启或多个 worker 同时启动时
+# 仍有极小概率（前缀相同为 2^-24）与已落库的 session_id 重复，因此新建会话用 session_create（普通 INSERT），重复时保存失败而不会覆盖。
+# itertools.count 的 __next__ 在 GIL 下是原子的，无需加锁
+_ID_PREFIX = int.from_bytes(os.urandom(3), "big") << 24
+_ID_LOW_MASK = (1 << 24) - 1
+_id_counter = itertools.count(int.from_bytes(os.urandom(3), "big"))
+
+
+def _new_id() -> str:
+    return f"{_ID_PREFIX | (next(_id_counter) & _ID_LOW_MASK):012x}"
+
+# 流式执行任务状态与取消事件按 trace_id 分片加锁：各 SSE 任务只争用所在分片的锁，互不串行
+# 每个分片为有界 OrderedDict（按写入顺序淘汰最旧的已结束任务，运行中的任务不淘汰），避免状态常驻内存无限增长
+_STATE_SHARDS = 16  # 必须为 2 的幂，便于用位与取分片
+_STATE_SHARD_CAP = 1024
+_state_locks: list[threading.Lock] = [threading.Lock() for _ in range(_STATE_SHARDS)]
 # 流式执行任务状态：trace_id -> state（用于前端跨页面查看进度）
-_run_states_lock = threading.Lock()
-_run_states: dict[str, dict[str, Any]] = {}
+_state_maps: list[OrderedDict[str, dict[str, Any]]] = [OrderedDict() for _ in range(_STATE_SHARDS)]
+# 流式执行任务取消：trace_id -> threading.Event，收到停止请求时 set()
+_cancel_maps: list[dict[str, threading.Event]] = [{} for _ in range(_STATE_SHARDS)]
+
+
+# 当前时间 isoformat 缓存：(毫秒时间戳, 字符串)，同一毫秒内复用；整体替换元组，多线程读写无需加锁
+_iso_cache: tuple[int, str] = (0, "")
+
+
+def _now_iso() -> str:
+    """当前本地时间的 isoformat（精确到毫秒，会话列表按 updated_at 排序时同一秒内的先后也能区分）。"""
+    global _iso_cache
+    ms = time.time_ns() // 1_000_000
+    cached = _iso_cache
+    if cached[0] == ms:
+        return cached[1]
+    sec, frac = divmod(ms, 1000)
+    s = datetime.fromtimestamp(sec).replace(microsecond=frac * 1000).isoformat(timespec="milliseconds")
+    _iso_cache = (ms, s)
+    return s
+
+
+def _shard_index(trace_id: str) -> int:
+    return hash(trace_id) & (_STATE_SHARDS - 1)
+
+
+def _run_cancel_register(trace_id: str, ev: threading.Event) -> None:
+    i = _shard_index(trace_id)
+    with _state_locks[i]:
+        _cancel_maps[i][trace_id] = ev
+
+
+def _run_cancel_get(trace_id: str) -> Optional[threading.Event]:
+    i = _shard_index(trace_id)
+    with _state_locks[i]:
+        return _cancel_maps[i].get(trace_id)
+
+
+def _run_cancel_pop(trace_id: str) -> None:
+    i = _shard_index(trace_id)
+    with _state_locks[i]:
+        _cancel_maps[i].pop(trace_id, None)
 
 
 def _run_state_init(trace_id: str, session_id: str, instruction: str, asset_names: Optional[list[str]]) -> None:
-    with _run_states_lock:
-        _run_states[trace_id] = {
+    i = _shard_index(trace_id)
+    with _state_locks[i]:
+        states = _state_maps[i]
+        states[trace_id] = {
             "trace_id": trace_id,
             "session_id": session_id,
             "instruction": instruction,
             "asset_names": asset_names,
             "running": True,
-            "started_at": datetime.now().isoformat(),
+            "started_at": _now_iso(),
             "commands": [],
+            # (asset_name, command) -> 尚未完成的 commands 下标列表，完成时 O(1) 定位，避免倒序扫描
+            "_pending": {},
             "model_replies": [],
             "reply": "",
             "error": "",
+            "dropped_events": 0,
         }
+        states.move_to_end(trace_id)
+        if len(states) > _STATE_SHARD_CAP:
+            _evict_finished(states)
+
+
+def _evict_finished(states: OrderedDict[str, dict[str, Any]]) -> None:
+    """从最旧开始淘汰已结束的任务，直到分片不超过上限；仍在运行的任务一律保留（调用方持有分片锁）。"""
+    excess = len(states) - _STATE_SHARD_CAP
+    victims = []
+    for tid, st in states.items():
+        if excess <= 0:
+            break
+        if not st["running"]:
+            victims.append(tid)
+            excess -= 1
+    for tid in victims:
+        del states[tid]
+
+
+def _command_started(
+    cmds: list[dict[str, str]],
+    pending: dict[tuple[str, str], list[int]],
+    asset_name: str,
+    command: str,
+    asset_host: str | None = None,
+) -> None:
+    """追加一条未完成的命令记录，并在 pending 中登记其下标。"""
+    pending.setdefault((asset_name, command), []).append(len(cmds))
+    cmds.append({
+        "asset_name": asset_name,
+        "command": command,
+        "result": "",
+        "asset_host": asset_host or "",
+    })
+
+
+def _command_finished(
+    cmds: list[dict[str, str]],
+    pending: dict[tuple[str, str], list[int]],
+    asset_name: str,
+    command: str,
+    result: str,
+    asset_host: str | None = None,
+) -> None:
+    """把结果写回最近一条同 (资产, 命令) 的未完成记录（O(1)，不倒序扫描）；没有则追加新记录。"""
+    idxs = pending.get((asset_name, command))
+    if idxs:
+        j = idxs.pop()
+        if not idxs:
+            del pending[(asset_name, command)]
+        cmds[j]["result"] = result or ""
+        if asset_host is not None:
+            cmds[j]["asset_host"] = asset_host or ""
+        return
+    cmds.append({
+        "asset_name": asset_name,
+        "command": command,
+        "result": result or "",
+        "asset_host": asset_host or "",
+    })
 
 
 def _run_state_append_command_start(
     trace_id: str, asset_name: str, command: str, asset_host: str | None = None
 ) -> None:
-    with _run_states_lock:
-        st = _run_states.get(trace_id)
+    i = _shard_index(trace_id)
+    with _state_locks[i]:
+        st = _state_maps[i].get(trace_id)
         if not st:
             return
-        st["commands"].append({
-            "asset_name": asset_name,
-            "command": command,
-            "result": "",
-            "asset_host": asset_host or "",
-        })
+        _state_maps[i].move_to_end(trace_id)
+        _command_started(st["commands"], st["_pending"], asset_name, command, asset_host)
 
 
 def _run_state_update_command(
     trace_id: str, asset_name: str, command: str, result: str, asset_host: str | None = None
 ) -> None:
-    with _run_states_lock:
-        st = _run_states.get(trace_id)
+    i = _shard_index(trace_id)
+    with _state_locks[i]:
+        st = _state_maps[i].get(trace_id)
         if not st:
             return
-        cmds = st.get("commands") or []
-        for i in range(len(cmds) - 1, -1, -1):
-            if cmds[i].get("asset_name") == asset_name and cmds[i].get("command") == command and not cmds[i].get("result"):
-                cmds[i]["result"] = result or ""
-                if asset_host is not None:
-                    cmds[i]["asset_host"] = asset_host or ""
-                return
-        cmds.append({
-            "asset_name": asset_name,
-            "command": command,
-            "result": result or "",
-            "asset_host": asset_host or "",
-        })
-        st["commands"] = cmds
+        _state_maps[i].move_to_end(trace_id)
+        _command_finished(st["commands"], st["_pending"], asset_name, command, result, asset_host)
 
 
 def _run_state_append_model_reply(trace_id: str, round_index: int, content: str) -> None:
-    with _run_states_lock:
-        st = _run_states.get(trace_id)
+    i = _shard_index(trace_id)
+    with _state_locks[i]:
+        st = _state_maps[i].get(trace_id)
         if not st:
             return
+        _state_maps[i].move_to_end(trace_id)
         st["model_replies"].append({"round": round_index, "content": content or ""})
 
 
+def _run_state_add_dropped(trace_id: str) -> None:
+    i = _shard_index(trace_id)
+    with _state_locks[i]:
+        st = _state_maps[i].get(trace_id)
+        if st:
+            st["dropped_events"] += 1
+
+
 def _run_state_finish(trace_id: str, reply: Optional[str] = None, error: Optional[str] = None) -> None:
-    with _run_states_lock:
-        st = _run_states.get(trace_id)
+    i = _shard_index(trace_id)
+    with _state_locks[i]:
+        st = _state_maps[i].get(trace_id)
         if not st:
             return
+        _state_maps[i].move_to_end(trace_id)
         st["running"] = False
-        st["finished_at"] = datetime.now().isoformat()
+        st["finished_at"] = _now_iso()
         if reply is not None:
             st["reply"] = reply or ""
         if error is not None:
@@ -130,6 +255,12 @@ logging.basicConfig(
     level=getattr(logging, LOG_LEVEL, logging.INFO),
     format="%(asctime)s %(levelname)s %(name)s %(message)s",
 )
+# 根日志改为经队列交给后台线程输出：各请求/执行线程 emit 只需入队，不再在 handler 的流锁上互相等待
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_root_logger = logging.getLogger()
+_log_listener = logging.handlers.QueueListener(_log_queue, *_root_logger.handlers, respect_handler_level=True)
+_root_logger.handlers = [logging.handlers.QueueHandler(_log_queue)]
+_log_listener.start()
 logger = logging.getLogger("ai_ops_assistant.web")
 
 STATIC_DIR = ROOT_DIR / "static"
@@ -138,6 +269,25 @@ CONFIG_PATH = Path(os.environ.get("AI_OPS_CONFIG", "config.yaml"))
 # - 默认：<项目根目录>/logs/interaction
 # - 可通过环境变量 AI_OPS_INTERACTION_LOG_DIR 覆盖
 INTERACTION_LOG_DIR = os.environ.get("AI_OPS_INTERACTION_LOG_DIR") or str(ROOT_DIR / "logs" / "interaction")
+_INTERACTION_LOG_PATH = Path(INTERACTION_LOG_DIR) if INTERACTION_LOG_DIR else None
+
+
+def _interaction_log_path(trace_id: str) -> Optional[Path]:
+    """本次执行的交互日志文件路径：<trace_id>_<YYYYmmdd_HHMMSS>.txt；未配置目录时为 None。"""
+    if _INTERACTION_LOG_PATH is None:
+        return None
+    return _INTERACTION_LOG_PATH / f"{trace_id}_{time.strftime('%Y%m%d_%H%M%S')}.txt"
+
+
+# 指令执行（LLM 多轮 + SSH）耗时长，使用独立线程池，避免占满默认线程池拖慢其他接口；
+# 超出 AI_OPS_RUN_WORKERS 的执行任务在池内排队（SSE 流照常发送心跳）
+_RUN_WORKERS = int(os.environ.get("AI_OPS_RUN_WORKERS", "8"))
+_run_executor = ThreadPoolExecutor(max_workers=_RUN_WORKERS, thread_name_prefix="ai-ops-run")
+
+
+@app.on_event("shutdown")
+def _stop_run_executor() -> None:
+    _run_executor.shutdown(wait=False, cancel_futures=True)
 
 
 @app.on_event("startup")
@@ -148,23 +298,49 @@ def _startup() -> None:
     try:
         if not asset_db.asset_list() and CONFIG_PATH.exists():
             cfg = load_config(CONFIG_PATH)
-            for a in cfg.assets:
-                asset_db.asset_create(
-                    name=a.name,
-                    host=a.host,
-                    port=a.port,
-                    username=a.username,
-                    password=a.password,
-                    private_key_path=a.private_key_path,
-                )
+            # 一次事务批量写入，避免逐条提交；config 中重名资产以后者为准，不致整批迁移失败
+            asset_db.asset_upsert_many(a.model_dump() for a in cfg.assets)
             if cfg.assets:
                 logger.info("已从 config.yaml 迁移 %s 条资产到数据库", len(cfg.assets))
     except Exception as e:
         logger.warning("资产迁移检查失败: %s", e)
 
 
+# 已解析配置缓存：((config.yaml 的 mtime_ns, size), 资产库版本号, AppConfig)，两者均未变化时跳过 YAML 解析与资产查询
+_cfg_cache: Optional[tuple[tuple[int, int], int, AppConfig]] = None
+_cfg_lock = threading.Lock()
+
+
+@app.on_event("shutdown")
+def _stop_log_listener() -> None:
+    # 退出前把队列中剩余日志写完
+    _log_listener.stop()
+
+
+def _config_file_key() -> tuple[int, int]:
+    """config.yaml 的 (mtime_ns, size)，一次 stat；文件不存在时为 (0, 0)。
+    同时比较大小，避免粗粒度 mtime 的文件系统上同一时间片内的改写被漏判。"""
+    try:
+        st = CONFIG_PATH.stat()
+    except FileNotFoundError:
+        return (0, 0)
+    return (st.st_mtime_ns, st.st_size)
+
+
 def _load() -> AppConfig:
-    return load_config(CONFIG_PATH, get_assets=asset_db.asset_list)
+    global _cfg_cache
+    key = _config_file_key()
+    ver = asset_db.version()
+    cached = _cfg_cache
+    if cached is not None and cached[0] == key and cached[1] == ver:
+        return cached[2]
+    with _cfg_lock:
+        cached = _cfg_cache
+        if cached is not None and cached[0] == key and cached[1] == ver:
+            return cached[2]
+        config = load_config(CONFIG_PATH, get_assets=asset_db.asset_list)
+        _cfg_cache = (key, ver, config)
+        return config
 
 
 def _asset_public(a: AssetConfig, group_id: Optional[int] = None) -> dict[str, Any]:
@@ -181,9 +357,38 @@ def _asset_public(a: AssetConfig, group_id: Optional[int] = None) -> dict[str, A
     return out
 
 
-def _sse(event: str, data: Any) -> str:
-    # 前端以 "\n\n" 作为事件块分隔，并期望 data 为 JSON
-    return f"event: {event}\n" + "data: " + json.dumps(data, ensure_ascii=False) + "\n\n"
+# SSE 待发送事件积压上限：超过后只丢弃可丢弃的过程事件，防止慢客户端使队列无限增长
+_SSE_QUEUE_SOFT_MAX = 1024
+_SSE_DROPPABLE_EVENTS = frozenset({"model_reply"})
+# SSE 响应头：禁止中间缓存与改写（no-transform 阻止 CDN/代理压缩或合并），关闭 nginx 等反向代理的响应缓冲，
+# 并显式声明不压缩，避免压缩中间件把事件攒到流结束才一起发出
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache, no-transform",
+    "X-Accel-Buffering": "no",
+    "Content-Encoding": "identity",
+}
+# 被唤醒后再等待的合并窗口（秒）：窗口内陆续到达的事件与首个事件合并为一次写出，减少突发时的 send 次数
+_SSE_FLUSH_INTERVAL = 0.05
+# 固定内容的 SSE 注释帧预先构造为 bytes，每个流 / 每次心跳直接复用
+_SSE_START = b": stream start\n\n"
+_SSE_KEEPALIVE = b": keep-alive\n\n"
+
+
+# 事件名有限且固定，"event: xxx\ndata: " 前缀按事件名缓存为 bytes，避免每帧重复拼接与编码
+_sse_prefixes: dict[str, bytes] = {}
+
+
+def _sse(event: str, data: Any) -> bytes:
+    # 前端以 "\n\n" 作为事件块分隔，并期望 data 为 JSON；直接产出 bytes，StreamingResponse 原样写出不再二次编码
+    prefix = _sse_prefixes.get(event)
+    if prefix is None:
+        prefix = _sse_prefixes[event] = b"event: " + event.encode("ascii") + b"\ndata: "
+    return b"".join((prefix, dumps_bytes(data), b"\n\n"))
+
+
+# 指令含以下任一关键词时视为「所有服务器」意图；预编译为单个正则，一次扫描代替逐个子串查找
+_ALL_SERVERS_KEYWORDS = ("所有服务器", "全部服务器", "检查所有", "所有主机", "每台", "全部主机", "所有资产")
+_ALL_SERVERS_RE = re.compile("|".join(map(re.escape, _ALL_SERVERS_KEYWORDS)))
 
 
 def _build_effective_instruction(instruction: str, asset_names: Optional[list[str]]) -> str:
@@ -195,10 +400,7 @@ def _build_effective_instruction(instruction: str, asset_names: Optional[list[st
             "用户已在界面选定资产，请直接对上述资产调用 execute_command 执行用户指令，不要回复「请指定要操作的资产名称」，也不要仅用文字描述将要执行的操作而不调用 execute_command。】\n\n"
         )
         return prefix + instruction
-    if any(
-        k in (instruction or "")
-        for k in ("所有服务器", "全部服务器", "检查所有", "所有主机", "每台", "全部主机", "所有资产")
-    ):
+    if _ALL_SERVERS_RE.search(instruction):
         prefix = (
             "【用户要求检查/操作「所有」或「全部」服务器。请先 list_assets，然后对返回的**每一台**资产依次执行相应命令，不要遗漏任何一台，再输出 final 总结。】\n\n"
         )
@@ -215,6 +417,14 @@ def _session_title(instruction: str, max_len: int = 30) -> str:
     return (s[:max_len] + "…") if len(s) > max_len else s
 
 
+class BytesJSONResponse(JSONResponse):
+    """用 dumps_bytes（orjson 可用时走 C 实现）渲染的 JSON 响应。handler 直接返回该实例时，
+    FastAPI 不再按返回注解做响应模型校验与 jsonable_encoder 遍历，适合会话、资产列表等大体积只读接口。"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
+
+
 class RunRequest(BaseModel):
     instruction: str = Field(..., description="自然语言指令")
     asset_names: Optional[list[str]] = Field(default=None, description="可选：限制本次只可使用这些资产名")
@@ -264,43 +474,60 @@ class GroupUpdateRequest(BaseModel):
     parent_id: Optional[int] = None
 
 
+_INDEX_HTML = STATIC_DIR / "index.html"
+_ASSETS_HTML = STATIC_DIR / "assets.html"
+_ABOUT_HTML = STATIC_DIR / "about.html"
+
+# 静态页面缓存：页面路径 -> (mtime_ns, 内容, ETag)。命中时每次请求只做一次 stat，不再打开读取文件；
+# 页面文件被修改后按 mtime 自动重新读取
+_page_cache: dict[Path, tuple[int, bytes, str]] = {}
+
+
+def _html_page(request: Request, path: Path) -> Response:
+    mtime = path.stat().st_mtime_ns
+    cached = _page_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        data = path.read_bytes()
+        cached = (mtime, data, '"' + hashlib.blake2b(data, digest_size=8).hexdigest() + '"')
+        _page_cache[path] = cached
+    _, data, etag = cached
+    # no-cache：浏览器每次带 If-None-Match 协商，页面未变时只返回 304，更新后立即生效
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="text/html; charset=utf-8", headers=headers)
+
+
 @app.get("/", include_in_schema=False)
-def index() -> FileResponse:
-    return FileResponse(STATIC_DIR / "index.html")
+def index(request: Request) -> Response:
+    return _html_page(request, _INDEX_HTML)
 
 
 @app.get("/assets", include_in_schema=False)
-def assets_page() -> FileResponse:
-    return FileResponse(STATIC_DIR / "assets.html")
+def assets_page(request: Request) -> Response:
+    return _html_page(request, _ASSETS_HTML)
 
 
 @app.get("/about", include_in_schema=False)
-def about_page() -> FileResponse:
-    return FileResponse(STATIC_DIR / "about.html")
+def about_page(request: Request) -> Response:
+    return _html_page(request, _ABOUT_HTML)
 
 
 @app.get("/api/assets")
-def api_list_assets(group_id: Optional[int] = None) -> list[dict[str, Any]]:
+async def api_list_assets(group_id: Optional[int] = None) -> BytesJSONResponse:
     """若传 group_id，则只返回该组及其所有子组下的资产。"""
-    all_assets = asset_db.asset_list()
-    if group_id is not None:
-        ids = set(asset_db.get_descendant_ids(group_id))
-        all_assets = [a for a in all_assets if a.get("group_id") in ids]
-    return [
-        _asset_public(AssetConfig(**{k: v for k, v in a.items() if k != "group_id"}), a.get("group_id"))
-        for a in all_assets
-    ]
+    return BytesJSONResponse(await asyncio.to_thread(asset_db.asset_list_public, group_id))
 
 
 @app.get("/api/assets-tree")
-def api_assets_tree() -> dict[str, Any]:
+def api_assets_tree() -> BytesJSONResponse:
     """树形结构：groups（含各组及组内资产）、ungrouped（未分组资产）。避免与 /api/assets/{name} 冲突。"""
-    return asset_db.asset_list_tree()
+    return BytesJSONResponse(asset_db.asset_list_tree())
 
 
 @app.get("/api/assets/{name}")
-def api_get_asset(name: str) -> dict[str, Any]:
-    a = asset_db.asset_get(name)
+async def api_get_asset(name: str) -> dict[str, Any]:
+    a = await asyncio.to_thread(asset_db.asset_get, name)
     if not a:
         raise HTTPException(status_code=404, detail="未找到该资产")
     group_id = a.get("group_id")
@@ -309,20 +536,24 @@ def api_get_asset(name: str) -> dict[str, Any]:
 
 
 @app.post("/api/assets")
-def api_create_asset(body: AssetCreateRequest) -> dict[str, Any]:
-    if asset_db.asset_get(body.name):
-        raise HTTPException(status_code=400, detail="资产名称已存在")
-    if (body.password or "").strip() and (body.private_key_path or "").strip():
+async def api_create_asset(body: AssetCreateRequest) -> dict[str, Any]:
+    # 认证方式校验只依赖请求体，先于查库完成；只填空白的一项按未填处理，不写入数据库
+    has_password = bool((body.password or "").strip())
+    has_key = bool((body.private_key_path or "").strip())
+    if has_password and has_key:
         raise HTTPException(status_code=400, detail="password 与 private_key_path 二选一即可")
-    if not (body.password or "").strip() and not (body.private_key_path or "").strip():
+    if not has_password and not has_key:
         raise HTTPException(status_code=400, detail="请填写 password 或 private_key_path")
-    asset_db.asset_create(
+    if await asyncio.to_thread(asset_db.asset_get, body.name):
+        raise HTTPException(status_code=400, detail="资产名称已存在")
+    await asyncio.to_thread(
+        asset_db.asset_create,
         name=body.name,
         host=body.host,
         port=body.port,
         username=body.username,
-        password=body.password,
-        private_key_path=body.private_key_path,
+        password=body.password if has_password else None,
+        private_key_path=body.private_key_path if has_key else None,
         group_id=body.group_id,
     )
     return {"ok": True}
@@ -351,14 +582,14 @@ def api_update_asset(name: str, body: AssetUpdateRequest) -> dict[str, Any]:
 
 
 @app.get("/api/asset-groups")
-def api_list_groups() -> list[dict[str, Any]]:
-    return asset_db.group_list()
+async def api_list_groups() -> BytesJSONResponse:
+    return BytesJSONResponse(await asyncio.to_thread(asset_db.group_list))
 
 
 @app.get("/api/asset-groups/tree")
-def api_groups_tree() -> list[dict[str, Any]]:
+def api_groups_tree() -> BytesJSONResponse:
     """树形结构：每项含 id, name, sort_order, remark, parent_id, children（子组数组）。"""
-    return asset_db.group_list_tree()
+    return BytesJSONResponse(asset_db.group_list_tree())
 
 
 @app.post("/api/asset-groups")
@@ -412,7 +643,7 @@ async def api_upload(
     asset_name: str = Form(...),
     remote_path: Optional[str] = Form(default=None),
 ) -> JSONResponse:
-    a = asset_db.asset_get(asset_name)
+    a = await asyncio.to_thread(asset_db.asset_get, asset_name)
     if not a:
         raise HTTPException(status_code=404, detail="未找到该资产")
     asset = AssetConfig(**a)
@@ -421,64 +652,44 @@ async def api_upload(
     if not remote_path:
         remote_path = f"/tmp/{filename}"
 
-    # 保存到临时文件，再上传
+    # UploadFile 已由 Starlette 缓存在 SpooledTemporaryFile（小文件在内存），直接在线程中流式写入 SFTP，不再另存临时文件
     try:
-        suffix = Path(filename).suffix
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp_path = tmp.name
-            while True:
-                chunk = await file.read(1024 * 1024)
-                if not chunk:
-                    break
-                tmp.write(chunk)
-        msg = upload_file_to_asset(asset, tmp_path, remote_path)
-        ok = not msg.startswith("错误")
-        if ok:
-            return JSONResponse({"ok": True, "message": msg})
-        return JSONResponse({"ok": False, "detail": msg}, status_code=400)
+        await file.seek(0)
+        msg = await asyncio.to_thread(upload_stream_to_asset, asset, file.file, remote_path, 60, file.size)
     finally:
-        try:
-            if "tmp_path" in locals() and tmp_path and Path(tmp_path).exists():
-                Path(tmp_path).unlink(missing_ok=True)
-        except Exception:
-            pass
+        await file.close()
+    ok = not msg.startswith("错误")
+    if ok:
+        return JSONResponse({"ok": True, "message": msg})
+    return JSONResponse({"ok": False, "detail": msg}, status_code=400)
 
 
 @app.post("/api/run", response_model=RunResponse)
-def api_run(body: RunRequest) -> RunResponse:
-    trace_id = uuid.uuid4().hex[:12]
+async def api_run(body: RunRequest) -> RunResponse:
+    return await asyncio.get_running_loop().run_in_executor(_run_executor, _run_sync, body)
+
+
+def _run_sync(body: RunRequest) -> RunResponse:
+    trace_id = _new_id()
     logger.info("[%s] /api/run 收到指令 instruction=%r asset_names=%s", trace_id, body.instruction, body.asset_names)
     commands: list[dict[str, str]] = []
+    pending: dict[tuple[str, str], list[int]] = {}  # (asset_name, command) -> 未完成的 commands 下标
+    # 同一轮中不同资产上的命令会并发执行，回调可能来自多个线程
+    commands_lock = threading.Lock()
 
     def on_command_start(asset_name: str, command: str, asset_host: str | None = None) -> None:
         logger.info("[%s] 命令开始 asset=%s cmd=%r", trace_id, asset_name, command)
-        commands.append({
-            "asset_name": asset_name,
-            "command": command,
-            "result": "",
-            "asset_host": asset_host or "",
-        })
+        with commands_lock:
+            _command_started(commands, pending, asset_name, command, asset_host)
 
     def on_command(asset_name: str, command: str, result: str, asset_host: str | None = None) -> None:
         logger.info("[%s] 命令完成 asset=%s cmd=%r result_len=%s", trace_id, asset_name, command, len(result or ""))
-        for i in range(len(commands) - 1, -1, -1):
-            if commands[i]["asset_name"] == asset_name and commands[i]["command"] == command and not commands[i]["result"]:
-                commands[i]["result"] = result
-                if asset_host is not None:
-                    commands[i]["asset_host"] = asset_host or ""
-                break
-        else:
-            commands.append({
-                "asset_name": asset_name,
-                "command": command,
-                "result": result,
-                "asset_host": asset_host or "",
-            })
+        with commands_lock:
+            _command_finished(commands, pending, asset_name, command, result, asset_host)
 
     try:
         config = _load()
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        interaction_log_path = (Path(INTERACTION_LOG_DIR) / f"{trace_id}_{ts}.txt") if INTERACTION_LOG_DIR else None
+        interaction_log_path = _interaction_log_path(trace_id)
         reply, _ = run_instruction(
             body.instruction,
             config_path=CONFIG_PATH,
@@ -502,7 +713,7 @@ def api_run(body: RunRequest) -> RunResponse:
 @app.post("/api/run/stop")
 def api_run_stop(body: RunStopRequest) -> dict[str, Any]:
     """请求停止正在进行的流式执行任务（在下一轮命令前生效，当前正在执行的单条命令会跑完）。"""
-    ev = _run_cancel_events.get(body.trace_id)
+    ev = _run_cancel_get(body.trace_id)
     if not ev:
         raise HTTPException(status_code=404, detail="未找到该任务或任务已结束")
     ev.set()
@@ -511,14 +722,20 @@ def api_run_stop(body: RunStopRequest) -> dict[str, Any]:
 
 
 @app.get("/api/run/status/{trace_id}")
-def api_run_status(trace_id: str) -> dict[str, Any]:
+def api_run_status(trace_id: str) -> BytesJSONResponse:
     """查询某次流式执行的当前状态（用于前端跨页面恢复进度）。"""
-    with _run_states_lock:
-        st = _run_states.get(trace_id)
+    i = _shard_index(trace_id)
+    with _state_locks[i]:
+        st = _state_maps[i].get(trace_id)
         if not st:
             raise HTTPException(status_code=404, detail="未找到该任务或任务已结束")
-        # 返回浅拷贝，避免外部修改
-        return dict(st)
+        # 锁内只拷贝标量字段并记下列表长度（commands/model_replies 只追加不重排），大段 result 的序列化放到锁外
+        snap = {k: v for k, v in st.items() if not k.startswith("_") and k not in ("commands", "model_replies")}
+        cmds, n_cmds = st["commands"], len(st["commands"])
+        replies, n_replies = st["model_replies"], len(st["model_replies"])
+    snap["commands"] = cmds[:n_cmds]
+    snap["model_replies"] = replies[:n_replies]
+    return BytesJSONResponse(snap)
 
 
 @app.post("/api/run/stream")
@@ -532,62 +749,89 @@ async def api_run_stream(body: RunRequest) -> StreamingResponse:
     - error: {detail}
     """
 
-    trace_id = uuid.uuid4().hex[:12]
+    trace_id = _new_id()
     logger.info(
         "[%s] /api/run/stream 收到指令 instruction=%r asset_names=%s session_id=%s",
         trace_id, body.instruction, body.asset_names, body.session_id,
     )
+    # threading.Event.is_set() 只读取内部布尔标志、不加锁，工作线程每轮轮询无锁开销；只有 set() 会获取内部条件锁，且仅在停止请求时调用一次
     cancel_event = threading.Event()
-    _run_cancel_events[trace_id] = cancel_event
-    q: asyncio.Queue[tuple[str, Any]] = asyncio.Queue()
+    # 待发送的 SSE 帧（已编码）：执行器线程在 buf_lock 下追加，event_gen 每次被唤醒时整批取走。
+    # 只有缓冲区由空变非空时才经 call_soon_threadsafe 唤醒事件循环，突发事件只触发一次唤醒
+    buf: deque[bytes] = deque()
+    buf_lock = threading.Lock()
+    wake = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    def _push(event: str, data: Any) -> None:
+        # 回调在执行器线程中触发：就地编码为 SSE 帧。客户端读取过慢导致积压时丢弃过程性的 model_reply
+        # （计入 dropped_events，完整内容仍可经 /api/run/status 查看）；command/reply/error 等关键事件始终保留
+        frame = _sse(event, data)
+        with buf_lock:
+            if event in _SSE_DROPPABLE_EVENTS and len(buf) >= _SSE_QUEUE_SOFT_MAX:
+                dropped = True
+            else:
+                dropped = False
+                need_wake = not buf
+                buf.append(frame)
+        if dropped:
+            _run_state_add_dropped(trace_id)
+        elif need_wake:
+            loop.call_soon_threadsafe(wake.set)
     run_commands: list[dict[str, str]] = []  # 本轮执行的命令列表，用于写入会话 turns
 
     # 会话：延续已有或新建
     effective_content = _build_effective_instruction(body.instruction, body.asset_names)
-    existing = session_get(body.session_id) if body.session_id else None
+    existing = await asyncio.to_thread(session_get, body.session_id) if body.session_id else None
     if existing:
         session_id = body.session_id
         initial_messages = list(existing["messages"]) + [
             {"role": "user", "content": effective_content},
         ]
     else:
-        session_id = uuid.uuid4().hex[:12]
+        session_id = _new_id()
         initial_messages = None
 
     def on_command_start(asset_name: str, command: str, asset_host: str | None = None) -> None:
         logger.info("[%s] SSE 推送 command_start asset=%s cmd=%r", trace_id, asset_name, command)
         _run_state_append_command_start(trace_id, asset_name, command, asset_host)
-        q.put_nowait(("command_start", {"asset_name": asset_name, "command": command, "asset_host": asset_host or ""}))
+        _push("command_start", {"asset_name": asset_name, "command": command, "asset_host": asset_host or ""})
 
     def on_command(asset_name: str, command: str, result: str, asset_host: str | None = None) -> None:
-        run_commands.append({
+        # 同一份命令记录既写入会话 turns，也作为 SSE command 事件的数据，不再分别构造
+        cmd = {
             "asset_name": asset_name,
             "command": command,
             "result": result or "",
             "asset_host": asset_host or "",
-        })
-        logger.info("[%s] SSE 推送 command asset=%s cmd=%r result_len=%s", trace_id, asset_name, command, len(result or ""))
-        _run_state_update_command(trace_id, asset_name, command, result or "", asset_host)
-        q.put_nowait(("command", {"asset_name": asset_name, "command": command, "result": result, "asset_host": asset_host or ""}))
+        }
+        run_commands.append(cmd)
+        logger.info("[%s] SSE 推送 command asset=%s cmd=%r result_len=%s", trace_id, asset_name, command, len(cmd["result"]))
+        _run_state_update_command(trace_id, asset_name, command, cmd["result"], asset_host)
+        _push("command", cmd)
 
     def on_model_reply(round_index: int, content: str) -> None:
         logger.info("[%s] SSE 推送 model_reply round=%s len=%s", trace_id, round_index, len(content or ""))
         _run_state_append_model_reply(trace_id, round_index, content or "")
-        q.put_nowait(("model_reply", {"round": round_index, "content": content or ""}))
+        _push("model_reply", {"round": round_index, "content": content or ""})
 
-    async def event_gen() -> AsyncGenerator[str, None]:
-        yield ": stream start\n\n"
-        yield _sse("start", {"trace_id": trace_id, "session_id": session_id})
+    async def event_gen() -> AsyncGenerator[bytes, None]:
+        # 取消事件在生成器开始执行时才登记，并在第一次 yield 之前启动执行线程：客户端在流开始前断开时
+        # 不会留下无人清理的登记项；执行线程一旦启动，无论客户端是否还在读取，都会在结束时自行注销
         _run_state_init(trace_id, session_id, body.instruction.strip(), body.asset_names)
+        _run_cancel_register(trace_id, cancel_event)
 
         done = asyncio.Event()
 
-        config = _load()
+        def _finish() -> None:
+            done.set()
+            wake.set()
 
         def _runner() -> None:
             try:
-                ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-                interaction_log_path = (Path(INTERACTION_LOG_DIR) / f"{trace_id}_{ts}.txt") if INTERACTION_LOG_DIR else None
+                # 配置在执行线程中加载：缺少 config.yaml 时以 error 事件告知前端，而不是中断 SSE 流
+                config = _load()
+                interaction_log_path = _interaction_log_path(trace_id)
                 reply, updated_messages = run_instruction(
                     body.instruction,
                     config_path=CONFIG_PATH,
@@ -603,83 +847,93 @@ async def api_run_stream(body: RunRequest) -> StreamingResponse:
                 )
                 logger.info("[%s] SSE 助手回复长度=%s", trace_id, len(reply or ""))
                 _run_state_finish(trace_id, reply=reply or "", error=None)
-                q.put_nowait(("reply", {"reply": reply}))
+                _push("reply", {"reply": reply})
                 if updated_messages is not None:
-                    now = datetime.now().isoformat()
+                    now = _now_iso()
                     new_turn = {
                         "user": body.instruction.strip(),
                         "commands": list(run_commands),
                         "reply": reply or "",
                         "asset_select": body.asset_select,
                     }
-                    existing_s = session_get(session_id)
-                    if existing_s:
-                        session_save(
-                            session_id,
-                            title=existing_s["title"],
-                            created_at=existing_s["created_at"],
-                            updated_at=now,
-                            messages=updated_messages,
-                            new_turn=new_turn,
-                        )
-                    else:
-                        session_save(
-                            session_id,
-                            title=_session_title(body.instruction),
-                            created_at=now,
-                            updated_at=now,
-                            messages=updated_messages,
-                            new_turn=new_turn,
-                        )
+                    # 延续会话时只追加本轮（不再整段读出会话）；会话不存在或已被删除时新建
+                    # base_len 为本轮读到的历史条数：期间另一轮已写入同一会话时由 session_append_turn 改为整体替换
+                    appended = existing and session_append_turn(
+                        session_id, now, updated_messages, new_turn, base_len=len(existing["messages"])
+                    )
+                    if not appended and not session_create(
+                        session_id,
+                        title=_session_title(body.instruction),
+                        created_at=now,
+                        updated_at=now,
+                        messages=updated_messages,
+                        new_turn=new_turn,
+                    ):
+                        logger.error("[%s] 会话 ID 已存在，本轮未保存 session_id=%s", trace_id, session_id)
             except FileNotFoundError as e:
                 logger.warning("[%s] SSE 配置文件未找到: %s", trace_id, e)
                 _run_state_finish(trace_id, reply=None, error=str(e))
-                q.put_nowait(("error", {"detail": str(e)}))
+                _push("error", {"detail": str(e)})
             except Exception as e:
                 logger.exception("[%s] SSE 执行出错", trace_id)
                 _run_state_finish(trace_id, reply=None, error=f"执行出错: {e}")
-                q.put_nowait(("error", {"detail": f"执行出错: {e}"}))
+                _push("error", {"detail": f"执行出错: {e}"})
             finally:
-                done.set()
-                _run_cancel_events.pop(trace_id, None)
+                loop.call_soon_threadsafe(_finish)
+                _run_cancel_pop(trace_id)
 
-        asyncio.get_running_loop().run_in_executor(None, _runner)
+        loop.run_in_executor(_run_executor, _runner)
+
+        yield _SSE_START
+        yield _sse("start", {"trace_id": trace_id, "session_id": session_id})
 
         while True:
             try:
-                event, data = await asyncio.wait_for(q.get(), timeout=15)
-                logger.debug("[%s] SSE 发送事件 event=%s", trace_id, event)
-                yield _sse(event, data)
+                await asyncio.wait_for(wake.wait(), timeout=15)
             except asyncio.TimeoutError:
-                yield ": keep-alive\n\n"
-
-            if done.is_set() and q.empty():
+                yield _SSE_KEEPALIVE
+                continue
+            if not done.is_set():
+                await asyncio.sleep(_SSE_FLUSH_INTERVAL)
+            wake.clear()
+            # 须在取帧之前读取 done：_finish 晚于最后一帧入缓冲区执行，此时已结束则本次取出的就是全部剩余帧
+            finished = done.is_set()
+            # 一次唤醒把缓冲区中已积压的帧全部取出，拼成一次写出，减少小包与循环唤醒次数
+            with buf_lock:
+                frames = list(buf)
+                buf.clear()
+            if frames:
+                logger.debug("[%s] SSE 发送事件 %s 条", trace_id, len(frames))
+                yield b"".join(frames)
+            if finished:
                 logger.info("[%s] /api/run/stream 流结束", trace_id)
                 break
 
-    return StreamingResponse(event_gen(), media_type="text/event-stream")
+    return StreamingResponse(event_gen(), media_type="text/event-stream", headers=_SSE_HEADERS)
 
 
 @app.get("/api/sessions")
-def api_list_sessions() -> list[dict[str, Any]]:
-    """列出所有会话（按更新时间倒序）。"""
-    return session_list()
+async def api_list_sessions(limit: Optional[int] = None) -> BytesJSONResponse:
+    """列出会话（按更新时间倒序）；可选 ?limit=N 只取最近 N 条，不传则返回全部。"""
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit 须为正整数")
+    return BytesJSONResponse(await asyncio.to_thread(session_list, limit))
 
 
 @app.get("/api/sessions/{session_id}")
-def api_get_session(session_id: str) -> dict[str, Any]:
+async def api_get_session(session_id: str) -> BytesJSONResponse:
     """获取单个会话详情。turns 为聊天式轮次：每项含 user（用户原始指令）、commands（执行过程）、reply（助手回复）。"""
-    s = session_get(session_id)
+    s = await asyncio.to_thread(session_get, session_id)
     if not s:
         raise HTTPException(status_code=404, detail="会话不存在")
     turns = s.get("turns") or []
-    return {
+    return BytesJSONResponse({
         "id": s["id"],
         "title": s["title"],
         "created_at": s["created_at"],
         "updated_at": s["updated_at"],
         "turns": turns,
-    }
+    })
 
 
 @app.delete("/api/sessions/{session_id}")
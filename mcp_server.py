@@ -19,10 +19,10 @@
 """
 from __future__ import annotations
 
-import json
 import os
 import sys
 from pathlib import Path
+from typing import Callable
 
 # 项目根目录，保证可 import ai_ops_assistant
 ROOT = Path(__file__).resolve().parent
@@ -32,6 +32,7 @@ if str(ROOT / "src") not in sys.path:
     sys.path.insert(0, str(ROOT / "src"))
 
 from ai_ops_assistant.config import load_config
+from ai_ops_assistant.jsonutil import dumps_bytes, loads as json_loads
 from ai_ops_assistant.ssh_executor import execute_on_asset, get_asset_by_name, list_assets_display
 
 
@@ -70,49 +71,79 @@ def execute_command(asset_name: str, command: str) -> str:
     return execute_on_asset(asset, command)
 
 
+def _unescape(s: str) -> str:
+    """把模型输出中字面的 \\n、\\t 还原为换行与制表符；不含反斜杠时原样返回。"""
+    if "\\" not in s:
+        return s
+    return s.replace("\\n", "\n").replace("\\t", "\t")
+
+
+# 工具名 -> 执行函数（参数为请求中的 arguments 字典）
+_TOOLS: dict[str, Callable[[dict], str]] = {
+    "list_assets": lambda _args: list_assets(),
+    "execute_command": lambda args: execute_command(
+        args.get("asset_name") or args.get("asset") or "",
+        _unescape(args.get("command") or ""),
+    ),
+}
+
+
 def _run_tool(name: str, arguments: dict) -> str:
     """供 REST /tool 与 MCP 共用的工具执行。"""
-    if name == "list_assets":
-        return list_assets()
-    if name == "execute_command":
-        cmd = (arguments.get("command") or "").replace("\\n", "\n").replace("\\t", "\t")
-        return execute_command(
-            arguments.get("asset_name") or arguments.get("asset") or "",
-            cmd,
-        )
-    return f"未知工具: {name}"
+    fn = _TOOLS.get(name)
+    if fn is None:
+        return f"未知工具: {name}"
+    return fn(arguments)
 
 
 # ---------- REST /tool：供 Orchestrator 通过 HTTP 调用（实现「通过 MCP 做 func call」） ----------
 # 使用 /api/tool 避免与 MCP streamable HTTP 对 query.request 的校验冲突；仍保留 /tool 兼容旧配置
 _TOOL_PATH = "/api/tool"
 _TOOL_PATH_LEGACY = "/tool"
+# 工具调用请求体上限：正常请求仅含工具名与一条命令，超出即拒绝，避免异常客户端把大请求体整个读入内存
+MAX_TOOL_BODY = 1 * 1024 * 1024
 
 
 def _create_tool_app():
     import logging as _log
     from starlette.applications import Starlette
     from starlette.requests import Request
-    from starlette.responses import JSONResponse
+    from starlette.responses import Response
     from starlette.routing import Route
 
     _logger = _log.getLogger("mcp_server.tool")
 
-    async def _handle_tool(req: Request) -> JSONResponse:
+    def _result(text: str, status_code: int = 200) -> Response:
+        # 命令输出可能很长且含中文：dumps_bytes 直接产出 UTF-8 bytes（orjson 可用时走 C 实现）
+        return Response(dumps_bytes({"result": text}), status_code=status_code, media_type="application/json")
+
+    async def _handle_tool(req: Request) -> Response:
         """纯 Starlette 处理，不经过 FastAPI，避免任何 query/body 校验。"""
         try:
-            body = await req.body()
+            if int(req.headers.get("content-length") or 0) > MAX_TOOL_BODY:
+                return _result(f"请求体过大（上限 {MAX_TOOL_BODY} 字节）", status_code=413)
+        except ValueError:
+            pass
+        # 分块读取并累计长度，超过上限立即拒绝（不依赖 Content-Length，chunked 请求同样受限）
+        buf = bytearray()
+        try:
+            async for chunk in req.stream():
+                buf += chunk
+                if len(buf) > MAX_TOOL_BODY:
+                    _logger.warning("POST (tool) 请求体超过上限 %s 字节，已拒绝", MAX_TOOL_BODY)
+                    return _result(f"请求体过大（上限 {MAX_TOOL_BODY} 字节）", status_code=413)
         except Exception as e:
             _logger.warning("POST (tool) 读取 body 失败: %s", e)
-            return JSONResponse(status_code=200, content={"result": f"读取请求体失败: {e}"})
+            return _result(f"读取请求体失败: {e}")
+        body = bytes(buf)
         _logger.info("POST (tool) 收到 body 长度=%s", len(body))
         try:
-            body_decoded = json.loads(body.decode("utf-8")) if body else {}
+            body_decoded = json_loads(body) if body else {}
         except Exception as e:
             _logger.warning("POST (tool) JSON 解析失败 raw_len=%s: %s", len(body), e)
-            return JSONResponse(status_code=200, content={"result": f"请求体不是合法 JSON: {e}"})
+            return _result(f"请求体不是合法 JSON: {e}")
         if not isinstance(body_decoded, dict):
-            return JSONResponse(status_code=200, content={"result": "请求体必须为 JSON 对象"})
+            return _result("请求体必须为 JSON 对象")
         name = (body_decoded.get("name") or "").strip() if isinstance(body_decoded.get("name"), str) else ""
         arguments = body_decoded.get("arguments")
         if arguments is None:
@@ -120,13 +151,13 @@ def _create_tool_app():
         if not isinstance(arguments, dict):
             arguments = {}
         if not name:
-            return JSONResponse(status_code=200, content={"result": "缺少或无效的 name 参数（应为 list_assets 或 execute_command）"})
+            return _result("缺少或无效的 name 参数（应为 list_assets 或 execute_command）")
         try:
             out = _run_tool(name, arguments)
-            return JSONResponse(status_code=200, content={"result": out})
+            return _result(out)
         except Exception as e:
             _logger.exception("执行工具 %s 失败", name)
-            return JSONResponse(status_code=200, content={"result": f"执行失败: {type(e).__name__}: {e}"})
+            return _result(f"执行失败: {type(e).__name__}: {e}")
 
     routes = [
         Route(_TOOL_PATH, _handle_tool, methods=["POST"]),
@@ -5,13 +5,20 @@ import logging
 import os
 import sqlite3
 import threading
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Iterable, Iterator, Optional
+
+from .sqlite_util import open_connection
 
 logger = logging.getLogger("ai_ops_assistant.asset_db")
 
 _DB_PATH: Optional[str] = None
 _lock = threading.Lock()
+_local = threading.local()
+_version = 0
 
 
 def _get_db_path() -> str:
@@ -23,96 +30,187 @@ def _get_db_path() -> str:
     return _DB_PATH
 
 
+_dir_ready = False
+
+
 def _ensure_dir() -> None:
+    """确保数据库所在目录存在；成功一次后不再重复 mkdir。"""
+    global _dir_ready
+    if _dir_ready:
+        return
     Path(_get_db_path()).parent.mkdir(parents=True, exist_ok=True)
+    _dir_ready = True
+
+
+_ASSET_COLUMNS = "name, host, port, username, password, private_key_path, group_id"
+_SQL_ASSET_LIST = f"SELECT {_ASSET_COLUMNS} FROM assets ORDER BY name"
+_SQL_ASSET_GET = f"SELECT {_ASSET_COLUMNS} FROM assets WHERE name = ?"
+# 认证方式在 SQL 内由密码列算出，对外接口的查询不再把密码取进 Python
+_AUTH_TYPE_SQL = "CASE WHEN TRIM(COALESCE({0}, ''), char(32, 9, 10, 11, 12, 13)) <> '' THEN 'password' ELSE 'key' END"
+_PUBLIC_COLUMNS = (
+    "name, host, port, username, " + _AUTH_TYPE_SQL.format("password") + ", private_key_path, group_id"
+)
+_SQL_ASSET_LIST_PUBLIC = f"SELECT {_PUBLIC_COLUMNS} FROM assets ORDER BY name"
+_GROUP_COLUMNS = "id, name, sort_order, remark, parent_id"
+_SQL_GROUP_LIST = f"SELECT {_GROUP_COLUMNS} FROM asset_groups ORDER BY sort_order, name"
+_SQL_GROUP_GET = f"SELECT {_GROUP_COLUMNS} FROM asset_groups WHERE id = ?"
+
+
+def _conn() -> sqlite3.Connection:
+    """返回当前线程复用的连接；首次创建时设置 PRAGMA。读不加锁（WAL 下读写互不阻塞），写仍由 _lock 串行。"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        _ensure_dir()
+        # 不设 row_factory：各查询按 _ASSET_COLUMNS / _GROUP_COLUMNS 的列顺序按下标取值，免去 sqlite3.Row 的分配与按名查找
+        conn = open_connection(_get_db_path())
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def _write() -> Iterator[sqlite3.Connection]:
+    """写事务：持 _lock 串行执行，以 BEGIN IMMEDIATE 开始（事务内先查后改的多条语句对其他进程也是原子的，
+    且只提交一次），退出时提交（异常则回滚）；成功后数据版本号自增。"""
+    global _version
+    with _lock:
+        conn = _conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+        _version += 1
+
 
+def version() -> int:
+    """资产/资产组数据版本号：每次写入后自增，供调用方判断缓存是否失效（仅在本进程内有效）。"""
+    return _version
 
-def _row_to_asset(r: sqlite3.Row) -> dict[str, Any]:
+
+def _row_to_asset(r: tuple) -> dict[str, Any]:
+    """按 _ASSET_COLUMNS 列顺序的一行转为资产 dict。"""
     return {
-        "name": r["name"],
-        "host": r["host"],
-        "port": int(r["port"]),
-        "username": r["username"],
-        "password": r["password"] if r["password"] else None,
-        "private_key_path": r["private_key_path"] if r["private_key_path"] else None,
-        "group_id": r["group_id"] if r["group_id"] is not None else None,
+        "name": r[0],
+        "host": r[1],
+        "port": int(r[2]),
+        "username": r[3],
+        "password": r[4] or None,
+        "private_key_path": r[5] or None,
+        "group_id": r[6],
+    }
+
+
+def _row_to_group(r: tuple) -> dict[str, Any]:
+    """按 _GROUP_COLUMNS 列顺序的一行转为组 dict。"""
+    return {
+        "id": r[0],
+        "name": r[1],
+        "sort_order": int(r[2]),
+        "remark": r[3] or "",
+        "parent_id": r[4],
     }
 
 
 def init_db() -> None:
     """创建 asset_groups、assets 表（若不存在），并为 assets 添加 group_id 列（兼容旧库）。"""
     _ensure_dir()
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        try:
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS asset_groups (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL UNIQUE,
-                    sort_order INTEGER NOT NULL DEFAULT 0
-                )
-                """
+    # 切换日志模式不能在事务内进行，先于建表事务执行
+    _conn().execute("PRAGMA journal_mode=WAL")
+    # _write 显式开启事务：sqlite3 模块不会为 DDL 自动开启事务，否则每条 CREATE/ALTER 各自提交一次
+    with _write() as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS asset_groups (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                sort_order INTEGER NOT NULL DEFAULT 0,
+                remark TEXT,
+                parent_id INTEGER REFERENCES asset_groups(id) ON DELETE SET NULL
             )
-            conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS assets (
-                    name TEXT PRIMARY KEY,
-                    host TEXT NOT NULL,
-                    port INTEGER NOT NULL DEFAULT 22,
-                    username TEXT NOT NULL,
-                    password TEXT,
-                    private_key_path TEXT
-                )
-                """
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS assets (
+                name TEXT PRIMARY KEY,
+                host TEXT NOT NULL,
+                port INTEGER NOT NULL DEFAULT 22,
+                username TEXT NOT NULL,
+                password TEXT,
+                private_key_path TEXT,
+                group_id INTEGER REFERENCES asset_groups(id) ON DELETE SET NULL
             )
-            # 兼容旧库：若无 group_id 列则添加
-            cur = conn.execute("PRAGMA table_info(assets)")
-            cols = [row[1] for row in cur.fetchall()]
-            if "group_id" not in cols:
-                conn.execute("ALTER TABLE assets ADD COLUMN group_id INTEGER REFERENCES asset_groups(id) ON DELETE SET NULL")
-            # 兼容旧库：asset_groups 若无 remark 列则添加
-            cur = conn.execute("PRAGMA table_info(asset_groups)")
-            gcols = [row[1] for row in cur.fetchall()]
-            if "remark" not in gcols:
-                conn.execute("ALTER TABLE asset_groups ADD COLUMN remark TEXT")
-            if "parent_id" not in gcols:
-                conn.execute("ALTER TABLE asset_groups ADD COLUMN parent_id INTEGER REFERENCES asset_groups(id) ON DELETE SET NULL")
-            conn.commit()
-        finally:
-            conn.close()
+            """
+        )
+        # 兼容旧库：一次查询取出两表现有列，缺列时补齐（新建库已含全部列，不会执行 ALTER）
+        cols = {
+            (r[0], r[1])
+            for r in conn.execute(
+                "SELECT m.name, p.name FROM sqlite_master m JOIN pragma_table_info(m.name) p"
+                " WHERE m.type = 'table' AND m.name IN ('assets', 'asset_groups')"
+            )
+        }
+        if ("assets", "group_id") not in cols:
+            conn.execute("ALTER TABLE assets ADD COLUMN group_id INTEGER REFERENCES asset_groups(id) ON DELETE SET NULL")
+        if ("asset_groups", "remark") not in cols:
+            conn.execute("ALTER TABLE asset_groups ADD COLUMN remark TEXT")
+        if ("asset_groups", "parent_id") not in cols:
+            conn.execute("ALTER TABLE asset_groups ADD COLUMN parent_id INTEGER REFERENCES asset_groups(id) ON DELETE SET NULL")
+        # 按组取资产、按父组取子组（组树展开、删除组）走索引；组列表的 ORDER BY sort_order, name 直接按索引顺序读取
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_assets_group_id ON assets(group_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_groups_parent_id ON asset_groups(parent_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_groups_sort ON asset_groups(sort_order, name)")
     logger.info("资产数据库已初始化 path=%s", _get_db_path())
 
 
 def asset_list() -> list[dict[str, Any]]:
     """返回所有资产（按 name 排序）。"""
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        conn.row_factory = sqlite3.Row
-        try:
-            rows = conn.execute(
-                "SELECT name, host, port, username, password, private_key_path, group_id FROM assets ORDER BY name"
-            ).fetchall()
-            return [_row_to_asset(r) for r in rows]
-        finally:
-            conn.close()
+    conn = _conn()
+    rows = conn.execute(_SQL_ASSET_LIST).fetchall()
+    return [_row_to_asset(r) for r in rows]
+
+
+# 某组（参数 ?）及其全部后代组的 id；UNION 去重，即使 parent_id 数据成环也能终止
+_DESCENDANTS_CTE = """
+WITH RECURSIVE descendants(id) AS (
+    SELECT ?
+    UNION
+    SELECT g.id FROM asset_groups g JOIN descendants d ON g.parent_id = d.id
+)
+"""
+_SQL_DESCENDANT_IDS = _DESCENDANTS_CTE + "SELECT id FROM descendants"
+_SQL_ASSET_LIST_IN_GROUP = (
+    _DESCENDANTS_CTE
+    + f"SELECT {_ASSET_COLUMNS} FROM assets WHERE group_id IN (SELECT id FROM descendants) ORDER BY name"
+)
+_SQL_ASSET_LIST_PUBLIC_IN_GROUP = (
+    _DESCENDANTS_CTE
+    + f"SELECT {_PUBLIC_COLUMNS} FROM assets WHERE group_id IN (SELECT id FROM descendants) ORDER BY name"
+)
+
+
+def asset_list_in_group(gid: int) -> list[dict[str, Any]]:
+    """返回某组及其所有后代组下的资产（按 name 排序），在一条 SQL 内完成组树展开与过滤。"""
+    conn = _conn()
+    rows = conn.execute(_SQL_ASSET_LIST_IN_GROUP, (gid,)).fetchall()
+    return [_row_to_asset(r) for r in rows]
+
+
+def asset_list_public(group_id: Optional[int] = None) -> list[dict[str, Any]]:
+    """返回对外暴露的资产列表（不含密码，带 auth_type）；传 group_id 时只含该组及其后代组下的资产。"""
+    conn = _conn()
+    if group_id is None:
+        rows = conn.execute(_SQL_ASSET_LIST_PUBLIC)
+    else:
+        rows = conn.execute(_SQL_ASSET_LIST_PUBLIC_IN_GROUP, (group_id,))
+    return [_asset_public_row(r) for r in rows]
 
 
 def asset_get(name: str) -> Optional[dict[str, Any]]:
     """按 name 获取一条资产，不存在返回 None。"""
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        conn.row_factory = sqlite3.Row
-        try:
-            row = conn.execute(
-                "SELECT name, host, port, username, password, private_key_path, group_id FROM assets WHERE name = ?",
-                (name,),
-            ).fetchone()
-            if row is None:
-                return None
-            return _row_to_asset(row)
-        finally:
-            conn.close()
+    conn = _conn()
+    row = conn.execute(_SQL_ASSET_GET, (name,)).fetchone()
+    if row is None:
+        return None
+    return _row_to_asset(row)
 
 
 def asset_create(
@@ -126,16 +224,59 @@ def asset_create(
 ) -> None:
     """插入一条资产。"""
     _ensure_dir()
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        try:
-            conn.execute(
-                "INSERT INTO assets (name, host, port, username, password, private_key_path, group_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (name, host, port, username, password or None, private_key_path or None, group_id),
-            )
-            conn.commit()
-        finally:
-            conn.close()
+    with _write() as conn:
+        conn.execute(
+            _SQL_ASSET_INSERT,
+            (name, host, port, username, password or None, private_key_path or None, group_id),
+        )
+
+
+_SQL_ASSET_INSERT = (
+    "INSERT INTO assets (name, host, port, username, password, private_key_path, group_id) VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+# 同名覆盖连接信息；未给 group_id 时保留原有分组（配置文件里的资产不带分组）
+_SQL_ASSET_UPSERT = _SQL_ASSET_INSERT + (
+    " ON CONFLICT(name) DO UPDATE SET host = excluded.host, port = excluded.port, username = excluded.username,"
+    " password = excluded.password, private_key_path = excluded.private_key_path,"
+    " group_id = COALESCE(excluded.group_id, assets.group_id)"
+)
+
+
+def _asset_params(rows: Iterable[dict[str, Any]]) -> list[tuple]:
+    """资产 dict（字段同 asset_create 的参数）转为 _SQL_ASSET_INSERT 的参数元组。"""
+    return [
+        (
+            r["name"],
+            r["host"],
+            r.get("port", 22),
+            r.get("username", ""),
+            r.get("password") or None,
+            r.get("private_key_path") or None,
+            r.get("group_id"),
+        )
+        for r in rows
+    ]
+
+
+def _execute_many(sql: str, rows: Iterable[dict[str, Any]]) -> int:
+    """在同一写事务内对资产行 executemany，返回行数。"""
+    params = _asset_params(rows)
+    if not params:
+        return 0
+    _ensure_dir()
+    with _write() as conn:
+        conn.executemany(sql, params)
+    return len(params)
+
+
+def asset_create_many(rows: Iterable[dict[str, Any]]) -> int:
+    """批量插入资产（每项字段同 asset_create 的参数），在同一事务内 executemany，返回插入条数。"""
+    return _execute_many(_SQL_ASSET_INSERT, rows)
+
+
+def asset_upsert_many(rows: Iterable[dict[str, Any]]) -> int:
+    """批量插入或按 name 覆盖资产，在同一事务内 executemany，返回处理条数。"""
+    return _execute_many(_SQL_ASSET_UPSERT, rows)
 
 
 def asset_update(
@@ -147,134 +288,83 @@ def asset_update(
     private_key_path: Optional[str] = None,
     group_id: Optional[int] = None,
 ) -> bool:
-    """更新一条资产，返回是否更新了记录。"""
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        try:
-            cur = conn.execute("SELECT name FROM assets WHERE name = ?", (name,))
-            if cur.fetchone() is None:
-                return False
-            updates = []
-            params = []
-            if host is not None:
-                updates.append("host = ?")
-                params.append(host)
-            if port is not None:
-                updates.append("port = ?")
-                params.append(port)
-            if username is not None:
-                updates.append("username = ?")
-                params.append(username)
-            if password is not None:
-                updates.append("password = ?")
-                params.append(password if (password or "").strip() else None)
-            if private_key_path is not None:
-                updates.append("private_key_path = ?")
-                params.append(private_key_path if (private_key_path or "").strip() else None)
-            if group_id is not None:
-                updates.append("group_id = ?")
-                params.append(group_id)
-            if not updates:
-                return True
-            params.append(name)
-            conn.execute("UPDATE assets SET " + ", ".join(updates) + " WHERE name = ?", params)
-            conn.commit()
-            return True
-        finally:
-            conn.close()
+    """更新一条资产，返回记录是否存在。直接 UPDATE 并以 rowcount 判断存在与否，不再先 SELECT。"""
+    updates = []
+    params = []
+    if host is not None:
+        updates.append("host = ?")
+        params.append(host)
+    if port is not None:
+        updates.append("port = ?")
+        params.append(port)
+    if username is not None:
+        updates.append("username = ?")
+        params.append(username)
+    if password is not None:
+        updates.append("password = ?")
+        params.append(password if (password or "").strip() else None)
+    if private_key_path is not None:
+        updates.append("private_key_path = ?")
+        params.append(private_key_path if (private_key_path or "").strip() else None)
+    if group_id is not None:
+        updates.append("group_id = ?")
+        params.append(group_id)
+    if not updates:
+        # 无字段可改：只读判断存在，不占写锁
+        return _conn().execute("SELECT 1 FROM assets WHERE name = ?", (name,)).fetchone() is not None
+    params.append(name)
+    with _write() as conn:
+        cur = conn.execute("UPDATE assets SET " + ", ".join(updates) + " WHERE name = ?", params)
+        return cur.rowcount > 0
 
 
 def asset_delete(name: str) -> bool:
     """删除一条资产，返回是否删除了记录。"""
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        try:
-            cur = conn.execute("DELETE FROM assets WHERE name = ?", (name,))
-            conn.commit()
-            return cur.rowcount > 0
-        finally:
-            conn.close()
+    with _write() as conn:
+        cur = conn.execute("DELETE FROM assets WHERE name = ?", (name,))
+        return cur.rowcount > 0
 
 
 # ---------- 资产组 ----------
 
 def group_list() -> list[dict[str, Any]]:
     """返回所有组（扁平，按 sort_order, name 排序），含 parent_id。"""
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        conn.row_factory = sqlite3.Row
-        try:
-            rows = conn.execute(
-                "SELECT id, name, sort_order, remark, parent_id FROM asset_groups ORDER BY sort_order, name"
-            ).fetchall()
-            return [
-                {
-                    "id": r["id"],
-                    "name": r["name"],
-                    "sort_order": int(r["sort_order"]),
-                    "remark": r["remark"] if r["remark"] else "",
-                    "parent_id": r["parent_id"] if r["parent_id"] is not None else None,
-                }
-                for r in rows
-            ]
-        finally:
-            conn.close()
+    conn = _conn()
+    return [_row_to_group(r) for r in conn.execute(_SQL_GROUP_LIST)]
 
 
 def group_list_tree() -> list[dict[str, Any]]:
-    """返回树形结构：每项含 id, name, sort_order, remark, parent_id, children（子组列表）。"""
-    flat = group_list()
-    by_parent: dict[Optional[int], list[dict[str, Any]]] = {}
-    for g in flat:
-        pid = g.get("parent_id")
-        by_parent.setdefault(pid, []).append({
-            **g,
-            "children": [],
-        })
-    def build(pid: Optional[int]) -> list[dict[str, Any]]:
-        nodes = by_parent.get(pid, [])
-        for n in nodes:
-            n["children"] = build(n["id"])
-        return sorted(nodes, key=lambda x: (x["sort_order"], x["name"]))
-    return build(None)
+    """返回树形结构：每项含 id, name, sort_order, remark, parent_id, children（子组列表）。
+    行已按 sort_order, name 有序，挂到父节点时保持该顺序，各层 children 无需再排序；
+    父组不存在的组与环上的组不可从根到达，不出现在结果中。"""
+    conn = _conn()
+    nodes = [{**_row_to_group(r), "children": []} for r in conn.execute(_SQL_GROUP_LIST)]
+    by_id = {n["id"]: n for n in nodes}
+    roots: list[dict[str, Any]] = []
+    for n in nodes:
+        pid = n["parent_id"]
+        if pid is None:
+            roots.append(n)
+        else:
+            parent = by_id.get(pid)
+            if parent is not None:
+                parent["children"].append(n)
+    return roots
 
 
 def get_descendant_ids(gid: int) -> list[int]:
-    """返回某组及其所有后代组的 id 列表（含自身）。"""
-    flat = group_list()
-    children_map: dict[Optional[int], list[int]] = {}
-    for g in flat:
-        pid = g.get("parent_id")
-        children_map.setdefault(pid, []).append(g["id"])
-    result: list[int] = []
-    def collect(uid: int) -> None:
-        result.append(uid)
-        for cid in children_map.get(uid, []):
-            collect(cid)
-    collect(gid)
-    return result
+    """返回某组及其所有后代组的 id 列表（含自身）；在 SQLite 内递归展开，不再读出整张组表。"""
+    conn = _conn()
+    return [r[0] for r in conn.execute(_SQL_DESCENDANT_IDS, (gid,))]
 
 
 def group_get(gid: int) -> Optional[dict[str, Any]]:
     """按 id 获取一个组。"""
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        conn.row_factory = sqlite3.Row
-        try:
-            row = conn.execute(
-                "SELECT id, name, sort_order, remark, parent_id FROM asset_groups WHERE id = ?", (gid,)
-            ).fetchone()
-            if row is None:
-                return None
-            return {
-                "id": row["id"],
-                "name": row["name"],
-                "sort_order": int(row["sort_order"]),
-                "remark": row["remark"] if row["remark"] else "",
-                "parent_id": row["parent_id"] if row["parent_id"] is not None else None,
-            }
-        finally:
-            conn.close()
+    conn = _conn()
+    row = conn.execute(_SQL_GROUP_GET, (gid,)).fetchone()
+    if row is None:
+        return None
+    return _row_to_group(row)
 
 
 def group_create(
@@ -285,17 +375,12 @@ def group_create(
 ) -> int:
     """创建组，返回 id。"""
     _ensure_dir()
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        try:
-            cur = conn.execute(
-                "INSERT INTO asset_groups (name, sort_order, remark, parent_id) VALUES (?, ?, ?, ?)",
-                (name, sort_order, remark or "", parent_id),
-            )
-            conn.commit()
-            return cur.lastrowid
-        finally:
-            conn.close()
+    with _write() as conn:
+        cur = conn.execute(
+            "INSERT INTO asset_groups (name, sort_order, remark, parent_id) VALUES (?, ?, ?, ?)",
+            (name, sort_order, remark or "", parent_id),
+        )
+        return cur.lastrowid
 
 
 def group_update(
@@ -310,91 +395,87 @@ def group_update(
         return False
     if parent_id is not None and gid in get_descendant_ids(parent_id):
         return False  # 不能以后代为父（会成环）
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        try:
-            cur = conn.execute("SELECT id FROM asset_groups WHERE id = ?", (gid,))
-            if cur.fetchone() is None:
-                return False
-            updates = []
-            params = []
-            if name is not None:
-                updates.append("name = ?")
-                params.append(name)
-            if sort_order is not None:
-                updates.append("sort_order = ?")
-                params.append(sort_order)
-            if remark is not None:
-                updates.append("remark = ?")
-                params.append(remark)
-            if parent_id is not None:
-                updates.append("parent_id = ?")
-                params.append(parent_id)
-            elif parent_id is None:
-                updates.append("parent_id = ?")
-                params.append(None)
-            if not updates:
-                return True
-            params.append(gid)
-            conn.execute("UPDATE asset_groups SET " + ", ".join(updates) + " WHERE id = ?", params)
-            conn.commit()
-            return True
-        finally:
-            conn.close()
+    updates = []
+    params = []
+    if name is not None:
+        updates.append("name = ?")
+        params.append(name)
+    if sort_order is not None:
+        updates.append("sort_order = ?")
+        params.append(sort_order)
+    if remark is not None:
+        updates.append("remark = ?")
+        params.append(remark)
+    # parent_id 总会写入（None 即移到根），因此 updates 不会为空
+    updates.append("parent_id = ?")
+    params.append(parent_id)
+    params.append(gid)
+    with _write() as conn:
+        cur = conn.execute("UPDATE asset_groups SET " + ", ".join(updates) + " WHERE id = ?", params)
+        return cur.rowcount > 0
 
 
 def group_delete(gid: int) -> bool:
     """删除组：子组的 parent_id 改为本组的 parent_id（上移一层），本组资产 group_id 置为 NULL，再删除本组。"""
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        try:
-            cur = conn.execute("SELECT parent_id FROM asset_groups WHERE id = ?", (gid,))
-            row = cur.fetchone()
-            if row is None:
-                return False
-            parent_id = row[0]
-            conn.execute("UPDATE asset_groups SET parent_id = ? WHERE parent_id = ?", (parent_id, gid))
-            conn.execute("UPDATE assets SET group_id = NULL WHERE group_id = ?", (gid,))
-            cur = conn.execute("DELETE FROM asset_groups WHERE id = ?", (gid,))
-            conn.commit()
-            return cur.rowcount > 0
-        finally:
-            conn.close()
-
-
-def _asset_public_row(r: sqlite3.Row) -> dict[str, Any]:
-    """单行转对外暴露的资产信息（不含密码）。"""
+    with _write() as conn:
+        cur = conn.execute("SELECT parent_id FROM asset_groups WHERE id = ?", (gid,))
+        row = cur.fetchone()
+        if row is None:
+            return False
+        parent_id = row[0]
+        conn.execute("UPDATE asset_groups SET parent_id = ? WHERE parent_id = ?", (parent_id, gid))
+        conn.execute("UPDATE assets SET group_id = NULL WHERE group_id = ?", (gid,))
+        cur = conn.execute("DELETE FROM asset_groups WHERE id = ?", (gid,))
+        return cur.rowcount > 0
+
+
+def _asset_public_row(r: tuple) -> dict[str, Any]:
+    """按 _PUBLIC_COLUMNS 列顺序的一行转对外暴露的资产信息；未分组时不带 group_id 字段。"""
+    out = _tree_asset(r, 0)
+    if r[6] is not None:
+        out["group_id"] = r[6]
+    return out
+
+
+def _tree_asset(r: tuple, i: int) -> dict[str, Any]:
+    """从第 i 列起依次为 name, host, port, username, auth_type, private_key_path，转为树形接口中的资产项。"""
     return {
-        "name": r["name"],
-        "host": r["host"],
-        "port": int(r["port"]),
-        "username": r["username"],
-        "auth_type": "password" if (r["password"] or "").strip() else "key",
-        "private_key_path": r["private_key_path"] if r["private_key_path"] else None,
-        "group_id": r["group_id"] if r["group_id"] is not None else None,
+        "name": r[i],
+        "host": r[i + 1],
+        "port": int(r[i + 2]),
+        "username": r[i + 3],
+        "auth_type": r[i + 4],
+        "private_key_path": r[i + 5] if r[i + 5] else None,
     }
 
 
+_SQL_TREE_GROUPED = (
+    "SELECT g.id, g.name, g.sort_order, a.name, a.host, a.port, a.username, "
+    + _AUTH_TYPE_SQL.format("a.password")
+    + ", a.private_key_path FROM asset_groups g LEFT JOIN assets a ON a.group_id = g.id"
+    " ORDER BY g.sort_order, g.name, a.name"
+)
+_SQL_TREE_UNGROUPED = (
+    "SELECT name, host, port, username, " + _AUTH_TYPE_SQL.format("password") + ", private_key_path"
+    " FROM assets WHERE group_id IS NULL ORDER BY name"
+)
+
+
 def asset_list_tree() -> dict[str, Any]:
-    """返回树形结构：groups（含各组及其 assets）、ungrouped（未分组资产）。"""
-    groups = group_list()
-    all_assets = asset_list()
-    by_group: dict[Optional[int], list[dict[str, Any]]] = {g["id"]: [] for g in groups}
-    by_group[None] = []
-    for a in all_assets:
-        gid = a.get("group_id")
-        by_group.setdefault(gid, []).append({
-            "name": a["name"],
-            "host": a["host"],
-            "port": a["port"],
-            "username": a["username"],
-            "auth_type": "password" if (a.get("password") or "").strip() else "key",
-            "private_key_path": a.get("private_key_path"),
+    """返回树形结构：groups（含各组及其 assets）、ungrouped（未分组资产）。
+    组与组内资产由一条 LEFT JOIN 按 (组排序, 资产名) 取出，按组 id 顺序切分，无需在 Python 中分桶。"""
+    conn = _conn()
+    rows = conn.execute(_SQL_TREE_GROUPED).fetchall()
+    groups = []
+    for gid, grows in groupby(rows, key=itemgetter(0)):
+        grows = list(grows)
+        first = grows[0]
+        groups.append({
+            "id": gid,
+            "name": first[1],
+            "sort_order": int(first[2]),
+            # LEFT JOIN：没有资产的组只有一行且资产列为 NULL
+            "assets": [_tree_asset(r, 3) for r in grows if r[3] is not None],
         })
-    return {
-        "groups": [
-            {"id": g["id"], "name": g["name"], "sort_order": g["sort_order"], "assets": by_group.get(g["id"], [])}
-            for g in groups
-        ],
-        "ungrouped": by_group.get(None, []),
-    }
+    ungrouped = [_tree_asset(r, 0) for r in conn.execute(_SQL_TREE_UNGROUPED)]
+    return {"groups": groups, "ungrouped": ungrouped}
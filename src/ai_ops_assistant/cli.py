@@ -4,16 +4,20 @@ from pathlib import Path
 
 from rich.console import Console
 from rich.panel import Panel
-from rich.markdown import Markdown
-from rich.prompt import Prompt
 
-from .orchestrator import run_instruction
+_INTERACTIVE_FLAGS = frozenset(("--interactive", "-i"))
 
 
 def main() -> None:
     console = Console()
-    interactive = "--interactive" in sys.argv or "-i" in sys.argv
-    args = [a for a in sys.argv[1:] if a not in ("--interactive", "-i")]
+    # 单次遍历拆出交互开关与指令词；不用 argparse，避免把指令里的 "-h" 等词当成选项
+    interactive = False
+    args = []
+    for a in sys.argv[1:]:
+        if a in _INTERACTIVE_FLAGS:
+            interactive = True
+        else:
+            args.append(a)
 
     if len(args) < 1 and not interactive:
         console.print(
@@ -43,6 +47,11 @@ def main() -> None:
         user_instruction = user_instruction.strip()
         if not user_instruction:
             return True
+        # Markdown / orchestrator（openai、paramiko）较重，仅在真正执行指令时导入，使用说明路径秒开
+        from rich.markdown import Markdown
+
+        from .orchestrator import run_instruction
+
         try:
             console.print("[dim]正在执行，AI 将自动规划并调用 SSH...[/dim]\n")
             reply, _ = run_instruction(
@@ -60,6 +69,8 @@ def main() -> None:
             return False
 
     if interactive:
+        from rich.prompt import Prompt
+
         console.print("[bold]Linux 智能运维助手[/bold] 交互模式，输入指令后回车执行，输入 [cyan]exit[/cyan] 或 [cyan]quit[/cyan] 退出。\n")
         while True:
             user_instruction = Prompt.ask("[bold cyan]指令[/bold cyan]")
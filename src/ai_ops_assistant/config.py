@@ -1,10 +1,17 @@
 """配置加载：DeepSeek、资产列表。资产可来自 YAML 或由调用方注入（如从数据库）。"""
 import os
+import tempfile
 from pathlib import Path
 from typing import Callable, Optional
 
 import yaml
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, TypeAdapter
+
+try:
+    # PyYAML 编译了 libyaml 时使用 C 实现的加载/输出，解析与序列化快数倍
+    from yaml import CSafeDumper as _YamlDumper, CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeDumper as _YamlDumper, SafeLoader as _YamlLoader
 
 
 class DeepSeekConfig(BaseModel):
@@ -18,6 +25,8 @@ class DeepSeekConfig(BaseModel):
     # 为 true 时，自研 Agent 的工具执行通过 MCP Tool HTTP 完成（需先启动 mcp_server.py --tool-http），实现「通过 MCP 做 func call」
     use_mcp_for_tools: bool = False
     mcp_tool_url: str = "http://127.0.0.1:8002/api/tool"  # use_mcp_for_tools 时 POST 地址；用 /api/tool 避免与 MCP streamable HTTP 校验冲突
+    # 为 true 时无工具模式请求附带 response_format（JSON Schema），由服务端约束只输出合法的计划 JSON；接口不支持时自动退回普通请求
+    no_tools_json_schema: bool = False
 
 
 class AssetConfig(BaseModel):
@@ -47,6 +56,27 @@ class AppConfig(BaseModel):
     deepseek: DeepSeekConfig = Field(default_factory=DeepSeekConfig)
     assets: list[AssetConfig] = Field(default_factory=list)
     dingtalk: DingTalkConfig = Field(default_factory=DingTalkConfig)
+    # (建索引时的 assets 列表, 其长度, 按名称索引, 按 host 索引)：首次查找时构建，assets 被整体替换或增删后自动重建。
+    # 保存列表本身而非 id()，避免旧列表释放后新列表复用同一地址导致误用旧索引
+    _asset_index: Optional[tuple[list, int, dict[str, AssetConfig], dict[str, AssetConfig]]] = PrivateAttr(default=None)
+
+    def asset_index(self) -> tuple[dict[str, AssetConfig], dict[str, AssetConfig]]:
+        """返回 (名称 -> 资产, host -> 资产) 两个查找字典；重名时保留列表中靠前的一项，与线性查找结果一致。"""
+        assets = self.assets
+        idx = self._asset_index
+        if idx is None or idx[0] is not assets or idx[1] != len(assets):
+            by_name: dict[str, AssetConfig] = {}
+            by_host: dict[str, AssetConfig] = {}
+            for a in assets:
+                by_name.setdefault((a.name or "").strip(), a)
+                by_host.setdefault((a.host or "").strip(), a)
+            idx = (assets, len(assets), by_name, by_host)
+            self._asset_index = idx
+        return idx[2], idx[3]
+
+
+# 资产列表整体校验：一次进入 pydantic-core 完成整张列表，代替逐条 AssetConfig(**a)
+_assets_adapter = TypeAdapter(list[AssetConfig])
 
 
 def _config_path(path: Optional[Path] = None) -> Path:
@@ -55,6 +85,22 @@ def _config_path(path: Optional[Path] = None) -> Path:
     return path
 
 
+# YAML 解析结果缓存：路径 -> ((mtime_ns, size), 解析出的 dict)。文件未变化时跳过读取与解析；
+# 每次仍基于该 dict 新建 AppConfig，调用方修改返回的配置不会影响缓存
+_raw_cache: dict[str, tuple[tuple[int, int], dict]] = {}
+
+
+def _read_raw(p: Path) -> dict:
+    st = p.stat()
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _raw_cache.get(str(p))
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    raw = yaml.load(p.read_text(encoding="utf-8"), Loader=_YamlLoader) or {}
+    _raw_cache[str(p)] = (key, raw)
+    return raw
+
+
 def load_config(
     path: Optional[Path] = None,
     get_assets: Optional[Callable[[], list]] = None,
@@ -67,27 +113,49 @@ def load_config(
         raise FileNotFoundError(
             f"未找到配置文件 {p}，请复制 config.example.yaml 为 config.yaml 并填写。"
         )
-    raw = yaml.safe_load(p.read_text(encoding="utf-8")) or {}
-    config = AppConfig(**raw)
+    config = AppConfig(**_read_raw(p))
     if not config.deepseek.api_key and os.environ.get("DEEPSEEK_API_KEY"):
         config.deepseek.api_key = os.environ["DEEPSEEK_API_KEY"]
     if get_assets is not None:
         try:
-            config.assets = [AssetConfig(**a) for a in get_assets()]
+            config.assets = _assets_adapter.validate_python(get_assets())
         except Exception:
             pass
     return config
 
 
 def save_config(config: AppConfig, path: Optional[Path] = None) -> None:
-    """将配置写回 YAML 文件（用于资产管理增删改）。"""
+    """将配置写回 YAML 文件（用于资产管理增删改）。内容未变化时不写；写入先落临时文件再原子替换，
+    避免并发读取到写了一半的文件。"""
     p = _config_path(path)
     data = config.model_dump()
-    with open(p, "w", encoding="utf-8") as f:
-        yaml.safe_dump(
-            data,
-            f,
-            allow_unicode=True,
-            default_flow_style=False,
-            sort_keys=False,
-        )
+    new_bytes = yaml.dump(
+        data,
+        Dumper=_YamlDumper,
+        allow_unicode=True,
+        default_flow_style=False,
+        sort_keys=False,
+    ).encode("utf-8")
+    try:
+        if p.read_bytes() == new_bytes:
+            return
+    except FileNotFoundError:
+        pass
+    # 同目录下的唯一临时文件（并发保存互不覆盖），fsync 后再替换，崩溃时旧文件或新文件二者必居其一
+    fd, tmp = tempfile.mkstemp(dir=p.parent, prefix=p.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            try:
+                os.fchmod(f.fileno(), p.stat().st_mode & 0o777)  # mkstemp 默认 0600，沿用原文件权限
+            except (FileNotFoundError, AttributeError):
+                pass
+            f.write(new_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, p)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,32 @@
+"""JSON 编解码：优先使用 orjson（C 实现，直接产出 UTF-8 bytes），未安装时回退到标准库 json。"""
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Optional
+
+_orjson = None
+
+try:
+    import orjson as _orjson
+except ImportError:
+    # 可选依赖：pip install orjson
+    pass
+
+
+def dumps_bytes(obj: Any, default: Optional[Callable[[Any], Any]] = None) -> bytes:
+    """序列化为 UTF-8 编码的 JSON bytes，非 ASCII 字符原样输出（等价于 ensure_ascii=False）。
+    default 同 json.dumps：遇到无法序列化的对象时调用。"""
+    if _orjson is not None:
+        try:
+            return _orjson.dumps(obj, default=default)
+        except TypeError:
+            # orjson 不支持的类型（如超出 64 位的整数、非 str 键）交给标准库处理
+            pass
+    return json.dumps(obj, ensure_ascii=False, default=default).encode("utf-8")
+
+
+def loads(data: bytes | str) -> Any:
+    """解析 JSON（bytes 或 str）；orjson 可用时直接解析 UTF-8 bytes，无需先解码为 str。"""
+    if _orjson is not None:
+        return _orjson.loads(data)
+    return json.loads(data)
@@ -4,15 +4,33 @@ from __future__ import annotations
 import json
 import logging
 import re
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
 from typing import Callable
 from urllib.parse import urlparse
 
 from openai import OpenAI
 
 from .config import DeepSeekConfig
+from .jsonutil import loads as json_loads
 
 logger = logging.getLogger("ai_ops_assistant.llm")
 
+
+class _Preview:
+    """日志用的文本预览（前 n 字的 repr）：仅在日志真正输出、格式化 %s 时才截取并转义，级别被过滤时不产生开销。"""
+
+    __slots__ = ("text", "n")
+
+    def __init__(self, text: str, n: int) -> None:
+        self.text = text
+        self.n = n
+
+    def __str__(self) -> str:
+        t = self.text
+        return repr(t[: self.n] + ("..." if len(t) > self.n else ""))
+
+
 # 模型多次「说要执行但未调工具」时，最多提醒几轮（避免无限提醒）
 MAX_NUDGES = 2
 
@@ -33,6 +51,9 @@ def _strip_think_blocks(text: str) -> str:
  块，便于从推理模型回复中解析 action/tool_call。"""
     if not (text or "").strip():
         return text
+    # 没有闭合标签（"</"）就不可能有 <think>...</think>，非推理模型的回复不必跑正则；此判断与大小写无关
+    if "</" not in text:
+        return text.strip()
     return _THINK_BLOCK_RE.sub("", text).strip()
 
 
@@ -43,19 +64,30 @@ def _strip_json_comments(text: str) -> str:
     return _JSON_LINE_COMMENT_RE.sub("", text)
 
 
+def _loads_allow_comments(text: str):
+    """解析 JSON；常见的无注释文本一次严格解析即成功，失败时才去掉 // 行内注释再解析。"""
+    try:
+        return json_loads(text)
+    except Exception:
+        return json.loads(_strip_json_comments(text.strip()))
+
+
 def _parse_tool_calls_from_content(content: str) -> list[dict]:
     """从助手回复正文中解析 Qwen 等模型的 <tool_call>{"name":"...","arguments":...}</tool_call>。"""
     if not (content or "").strip():
         return []
+    # 两种格式都要求 JSON 中有 "name" 键；没有则不必跑正则
+    if '"name"' not in content:
+        return []
     out = []
     # 1) 标准 <tool_call>...</tool_call> 块
     for m in _TOOL_CALL_BLOCK_RE.finditer(content):
         try:
-            obj = json.loads(_strip_json_comments(m.group(1).strip()))
+            obj = _loads_allow_comments(m.group(1))
             name = obj.get("name")
             args = obj.get("arguments")
             if isinstance(args, str):
-                args = json.loads(args) if args.strip() else {}
+                args = json_loads(args) if args.strip() else {}
             if not isinstance(args, dict):
                 args = {}
             if name:
@@ -68,8 +100,8 @@ def _parse_tool_calls_from_content(content: str) -> list[dict]:
     for m in _JSON_TOOL_RE.finditer(content):
         try:
             name = m.group(1).strip()
-            args_str = _strip_json_comments((m.group(2) or "").strip())
-            args = json.loads(args_str) if args_str else {}
+            args_str = (m.group(2) or "").strip()
+            args = _loads_allow_comments(args_str) if args_str else {}
             if not isinstance(args, dict):
                 args = {}
             if name:
@@ -96,7 +128,7 @@ def _parse_command_only_json(content: str, default_asset_name: str) -> list[dict
             raw = (m.group(1) or "").strip()
             if not raw:
                 continue
-            obj = json.loads(raw)
+            obj = json_loads(raw)
             if not isinstance(obj, dict):
                 continue
             cmd = obj.get("command")
@@ -111,7 +143,7 @@ def _parse_command_only_json(content: str, default_asset_name: str) -> list[dict
     if not out:
         try:
             raw_all = content.strip()
-            obj_all = json.loads(raw_all)
+            obj_all = json_loads(raw_all)
             if isinstance(obj_all, dict):
                 cmd_all = obj_all.get("command")
                 if isinstance(cmd_all, str) and cmd_all.strip():
@@ -149,16 +181,22 @@ def _normalize_base_url(base_url: str) -> str:
     return base_url.rstrip("/")
 
 
-def create_client(config: DeepSeekConfig) -> OpenAI:
-    base_url = _normalize_base_url(config.base_url)
-    # 本地服务（如 Ollama）常不校验 key，但 SDK 需要一个字符串
-    api_key = (config.api_key or "").strip() or "ollama"
+@lru_cache(maxsize=8)
+def _cached_client(base_url: str, api_key: str) -> OpenAI:
     return OpenAI(
         api_key=api_key,
         base_url=base_url,
     )
 
 
+def create_client(config: DeepSeekConfig) -> OpenAI:
+    """按 (base_url, api_key) 复用同一个客户端：其内部连接池跨多次 run_instruction 保持，避免每条指令重新建连与 TLS 握手。"""
+    base_url = _normalize_base_url(config.base_url)
+    # 本地服务（如 Ollama）常不校验 key，但 SDK 需要一个字符串
+    api_key = (config.api_key or "").strip() or "ollama"
+    return _cached_client(base_url, api_key)
+
+
 def chat_once(
     client: OpenAI,
     model: str,
@@ -167,7 +205,8 @@ def chat_once(
     max_tokens: int | None = None,
     temperature: float | None = None,
 ) -> str:
-    """不使用 tools 的普通对话。max_tokens/temperature 可选，自研 Agent 建议限长+低 temperature 以加速且稳定 JSON。"""
+    """不使用 tools 的普通对话，返回去掉首尾空白的回复正文（可能为空串）。
+    max_tokens/temperature 可选，自研 Agent 建议限长+低 temperature 以加速且稳定 JSON。"""
     logger.info("chat_once 请求 model=%s messages条数=%s", model, len(messages))
     kwargs: dict = {"model": model, "messages": messages}
     if max_tokens is not None:
@@ -176,27 +215,93 @@ def chat_once(
         kwargs["temperature"] = temperature
     response = client.chat.completions.create(**kwargs)
     msg = response.choices[0].message
-    content = getattr(msg, "content", None) or (msg.model_dump().get("content") if hasattr(msg, "model_dump") else None) or ""
+    # 常见情况 content 属性即有正文，不必 model_dump；需要时只 dump 一次，后续字段复用
+    dump: dict | None = None
+    content = getattr(msg, "content", None)
+    if not content and hasattr(msg, "model_dump"):
+        dump = msg.model_dump()
+        content = dump.get("content")
     content = (content or "").strip()
     # DeepSeek R1 等推理模型常把正文放在 reasoning，content 为空
     if not content:
-        reasoning = getattr(msg, "reasoning", None) or (msg.model_dump().get("reasoning") if hasattr(msg, "model_dump") else None)
-        if reasoning and (str(reasoning) or "").strip():
-            content = (str(reasoning) or "").strip()
+        reasoning = getattr(msg, "reasoning", None)
+        if not reasoning and hasattr(msg, "model_dump"):
+            if dump is None:
+                dump = msg.model_dump()
+            reasoning = dump.get("reasoning")
+        content = str(reasoning).strip() if reasoning else ""
+        if content:
             logger.info("chat_once content 为空，使用 reasoning 作为回复 len=%s", len(content))
     if not content:
         try:
-            raw = msg.model_dump() if hasattr(msg, "model_dump") else dict(msg)
+            raw = dump if dump is not None else (msg.model_dump() if hasattr(msg, "model_dump") else dict(msg))
         except Exception:
             raw = {"content": getattr(msg, "content", None)}
         logger.warning(
             "chat_once 收到空 content，message 键=%s 前300字=%s",
             list(raw.keys()),
-            repr(str(raw.get("content", raw.get("reasoning", "")))[:300]),
+            _Preview(str(raw.get("content", raw.get("reasoning", ""))), 300),
         )
     return content
 
 
+def chat_once_stream(
+    client: OpenAI,
+    model: str,
+    messages: list[dict],
+    *,
+    max_tokens: int | None = None,
+    temperature: float | None = None,
+    stop_when: Callable[[str], bool] | None = None,
+    response_format: dict | None = None,
+) -> str:
+    """与 chat_once 相同，但以 stream=True 边收边判：一旦收到完整且非空话的 {"action": "final", ...} 即断开，
+    不再等模型在 max_tokens 内把 JSON 之后的解释生成完。用于自研 Agent 的总结补发轮。
+    stop_when 可选，替换默认的判断：传入已收到的正文，返回 True 即停止接收。
+    response_format 可选，原样传给接口（如 JSON Schema 约束输出）。"""
+    if stop_when is None:
+        stop_when = _has_complete_final_action
+    logger.info("chat_once_stream 请求 model=%s messages条数=%s", model, len(messages))
+    kwargs: dict = {"model": model, "messages": messages, "stream": True}
+    if max_tokens is not None:
+        kwargs["max_tokens"] = max_tokens
+    if temperature is not None:
+        kwargs["temperature"] = temperature
+    if response_format is not None:
+        kwargs["response_format"] = response_format
+    parts: list[str] = []
+    reasoning_parts: list[str] = []
+    stream = client.chat.completions.create(**kwargs)
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            piece = getattr(delta, "content", None)
+            if piece:
+                parts.append(piece)
+                # 只有本片带 "}" 时 JSON 才可能刚闭合，其余分片不必重复拼接与解析
+                if "}" in piece and stop_when("".join(parts)):
+                    logger.info("chat_once_stream 已收到完整 JSON，提前结束接收")
+                    break
+                continue
+            reasoning = getattr(delta, "reasoning", None)
+            if reasoning:
+                reasoning_parts.append(reasoning)
+    finally:
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+    content = "".join(parts).strip()
+    # 与 chat_once 一致：正文为空时退回 reasoning
+    if not content:
+        content = "".join(reasoning_parts).strip()
+        if content:
+            logger.info("chat_once_stream content 为空，使用 reasoning 作为回复 len=%s", len(content))
+        else:
+            logger.warning("chat_once_stream 收到空 content")
+    return content
+
 # 供 AI 调用的“在指定资产上执行命令”工具
 EXECUTE_COMMAND_SCHEMA = {
     "type": "function",
@@ -286,6 +391,10 @@ PROMPT_TOOLS_INSTRUCTION = """
    示例：<tool_call>{"name":"execute_command","arguments":{"asset_name":"web-server-01","command":"df -h"}}</tool_call>
 """
 
+# 「提示词工具」模式的完整 system：模块加载时拼好一次。各 system 提示均为常量，每轮请求的消息前缀逐字相同，
+# DeepSeek 等支持前缀缓存的服务端会自动命中缓存
+PROMPT_TOOLS_SYSTEM = SYSTEM_PROMPT + PROMPT_TOOLS_INSTRUCTION
+
 # 自研 Agent：模型只输出约定格式，程序解析并调度（无任何 API tool_calls）
 SELF_CODED_SYSTEM = """你是一个 Linux 运维助手。用户会给出自然语言指令，你需要通过输出「仅一条」约定格式来驱动程序执行，不要输出任何其他文字、markdown 或解释。
 必须直接输出一个 JSON 或 <tool_call>，不要先输出 <think> 或思考过程，不要返回空内容。
@@ -296,6 +405,7 @@ SELF_CODED_SYSTEM = """你是一个 Linux 运维助手。用户会给出自然
 1) 执行命令：{"action": "execute_command", "asset": "实际资产名（如 linux_222）", "command": "实际命令（如 getent passwd）"}
 2) 查询资产：{"action": "list_assets"}
 3) 结束总结：{"action": "final", "message": "中文总结"}
+4) 同一检查需在多台资产上执行（如用户要求「所有资产」）：{"action": "execute_command_batch", "items": [{"asset": "linux_111", "command": "df -h"}, {"asset": "linux_222", "command": "df -h"}]}，程序会并发执行，并在下一条消息中一次返回各资产的 <tool_result>。
 **禁止**在 asset 中写「资产名称」、在 command 中写「shell 命令」等占位符，必须用用户指定的资产名和具体命令。
 
 【final 的 message 要求】必须先理解用户问题的意图并直接作答，再视需要附上表格或数据；禁止只贴表格或数据而不回答用户问的是什么。例如：用户问「两台机哪个磁盘大」时，应先一句话答出谁更大、容量多少，再附表格；用户问「看看磁盘」时再给表格即可。其他场景：针对用户指令和命令输出做 1～2 句专业总结（如：服务是否正常、有无异常、建议操作），禁止只回复「任务已完成」「已执行」等空话。**当命令输出为列表/表格类数据**（如 getent passwd、df、docker ps 等）时，请用 **Markdown 表格** 汇总，**且表格中的每一行必须严格来自 <tool_result> 中的实际输出，禁止添加或臆造未在输出中出现的用户、容器、进程等条目**。示例：
@@ -309,7 +419,7 @@ SELF_CODED_SYSTEM = """你是一个 Linux 运维助手。用户会给出自然
 2) 查询资产：<tool_call>{"name":"list_assets","arguments":{}}</tool_call>
 3) 结束总结：仅用 JSON {"action": "final", "message": "中文总结"}（无 tool_call）
 
-【严禁】禁止输出 initial_request、details、simulated_server_interaction、simulated、scenario 等任何非上述三种格式的 JSON。禁止输出多段或嵌套的“模拟对话”类结构。若需要执行操作，必须直接输出 action 为 execute_command 的 JSON；若需要先查资产，必须只输出 {"action": "list_assets"}。
+【严禁】禁止输出 initial_request、details、simulated_server_interaction、simulated、scenario 等任何非上述格式的 JSON。禁止输出多段或嵌套的“模拟对话”类结构。若需要执行操作，必须直接输出 action 为 execute_command 的 JSON；若需要先查资产，必须只输出 {"action": "list_assets"}。
 
 【规则】asset 和 command 必须为具体可执行值；面向用户的 message 必须用简体中文。一次只输出一个 action。action 为 final 时，message 必须根据用户指令和**仅根据 <tool_result> 中的实际内容**给出结论或表格，禁止添加未在命令输出中出现的条目（如臆造的用户名、容器名等）。禁止只回复「任务已完成」「已执行」「将遵守格式」等空话。
 
@@ -320,47 +430,98 @@ SELF_CODED_SYSTEM = """你是一个 Linux 运维助手。用户会给出自然
 【非交互式执行】命令通过 SSH 非交互执行，**禁止使用会等待 stdin 输入的交互式命令**，否则会超时。例如：修改用户密码时不要用 `passwd 用户名`（会等待输入新密码），应使用 `echo "用户名:新密码" | chpasswd`（需 root）；其他需输入的地方用管道、heredoc 或脚本替代。"""
 
 
+# JSON 字符串字面量（未闭合时一直到文本末尾）；串内的转义对与真实换行
+_JSON_STRING_RE = re.compile(r'"(?:[^"\\]|\\[\s\S])*"?')
+_ESCAPE_OR_NEWLINE_RE = re.compile(r"\\[\s\S]|\r\n?|\n")
+
+
+def _escape_newline(m: re.Match) -> str:
+    t = m.group()
+    return t if t[0] == "\\" else "\\n"
+
+
+def _escape_string_newlines(m: re.Match) -> str:
+    t = m.group()
+    if "\n" not in t and "\r" not in t:
+        return t
+    return _ESCAPE_OR_NEWLINE_RE.sub(_escape_newline, t)
+
+
 def _fix_newlines_in_json_strings(s: str) -> str:
-    """把 JSON 字符串值内的真实换行替换为 \\n，便于 json.loads 解析（模型常在 command 里写多行）。"""
-    out: list[str] = []
-    i = 0
-    in_string = False
-    escape_next = False
-    while i < len(s):
-        c = s[i]
-        if escape_next:
-            out.append(c)
-            escape_next = False
-            i += 1
-            continue
-        if in_string:
-            if c == "\\":
-                out.append(c)
-                escape_next = True
-                i += 1
-                continue
-            if c == '"':
-                in_string = False
-                out.append(c)
-                i += 1
-                continue
-            if c in "\n\r":
-                out.append("\\n")
-                if c == "\r" and i + 1 < len(s) and s[i + 1] == "\n":
-                    i += 1
-                i += 1
-                continue
-            out.append(c)
-            i += 1
-            continue
-        if c == '"':
-            in_string = True
-            out.append(c)
-            i += 1
-            continue
-        out.append(c)
-        i += 1
-    return "".join(out)
+    """把 JSON 字符串值内的真实换行替换为 \\n，便于 json.loads 解析（模型常在 command 里写多行）。
+    字符串外的换行原样保留；由正则在 C 层定位字符串，不再逐字符遍历。"""
+    if "\n" not in s and "\r" not in s:
+        return s
+    return _JSON_STRING_RE.sub(_escape_string_newlines, s)
+
+
+# _parse_self_coded_action 每轮都会用到的模式，模块级编译一次
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_MESSAGE_KEY_RE = re.compile(r'"message"\s*:\s*"')
+_ACTION_FINAL_RE = re.compile(r'\{\s*"action"\s*:\s*"final"')
+# "message": " 之后到下一个未转义的 "（或文本末尾）为止的内容；其中的 \n \t \" \\ 还原，其他转义原样保留
+_MSG_BODY_RE = re.compile(r'[^"\\]*(?:\\[\s\S][^"\\]*)*\\?')
+_MSG_ESCAPE_RE = re.compile(r"\\([\s\S])")
+_MSG_ESCAPES = {"n": "\n", "t": "\t", '"': '"', "\\": "\\"}
+
+
+def _unescape_msg(m: re.Match) -> str:
+    return _MSG_ESCAPES.get(m.group(1), m.group())
+
+
+_BRACE_RE = re.compile(r"[{}]")
+
+
+def _balanced_brace_end(s: str, start: int) -> int:
+    """s[start] 为 "{"，返回与之配对的 "}" 之后的下标，未闭合返回 -1。
+    只按花括号计数（不区分是否在字符串内）；由正则跳到下一个花括号，不逐字符遍历。"""
+    depth = 0
+    for m in _BRACE_RE.finditer(s, start):
+        if m.group() == "{":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return m.end()
+    return -1
+
+
+def _clean(x) -> str:
+    """字符串去首尾空白；None 或非字符串（模型偶尔给出数字等）返回空串。"""
+    return x.strip() if isinstance(x, str) else ""
+
+
+def _action_from_tool_call(tc: dict) -> dict | None:
+    """<tool_call> 解析结果转为自研 Agent 的 action；不是可执行的调用时返回 None。"""
+    name = _clean(tc.get("name"))
+    if name == "list_assets":
+        return {"action": "list_assets"}
+    if name == "execute_command":
+        args = tc.get("arguments") or {}
+        asset = _clean(args.get("asset_name") or args.get("asset"))
+        cmd = _clean(args.get("command"))
+        if asset or cmd:
+            return {"action": "execute_command", "asset": asset, "command": cmd}
+    return None
+
+
+def _action_from_obj(obj) -> dict | None:
+    """解析出的 JSON 对象转为 action；不是 action 时返回 None。"""
+    if not isinstance(obj, dict):
+        return None
+    if obj.get("action"):
+        return obj
+    # 兼容模型返回 {"response": "总结内容"} 而非 {"action": "final", "message": "..."}
+    if obj.get("response") is not None:
+        return {"action": "final", "message": str(obj.get("response", "")).strip()}
+    return None
+
+
+def _tolerant_variants(s: str):
+    """依次产出原文、字符串内换行转义后、去尾部逗号后的文本；按需生成，前一种解析成功则不再构造后面的。"""
+    yield s
+    yield _fix_newlines_in_json_strings(s)
+    yield _TRAILING_COMMA_RE.sub(r"\1", s)
 
 
 def _parse_self_coded_action(content: str) -> dict | None:
@@ -370,58 +531,59 @@ def _parse_self_coded_action(content: str) -> dict | None:
     raw = _strip_think_blocks(content).strip()
     if not raw:
         return None
-    # 1) 先尝试 <tool_call> 格式（本地模型常出此格式，比纯 JSON 更稳）
+    # 既无 JSON 也无 "message" 键的纯文本不可能解析出 action，跳过后续各轮正则与 json.loads（调用方会记录未解析日志）
+    if "{" not in raw and '"message"' not in raw:
+        return None
+    # 0) 提示词要求直接输出 JSON，最常见的是整段即合法 action：严格解析成功则直接返回，不跑后面的正则与修补
+    strict_tried = raw[0] == "{"
+    if strict_tried:
+        try:
+            o = _action_from_obj(json_loads(raw))
+            if o:
+                return o
+        except Exception:
+            pass
+    # 1) 再尝试 <tool_call> 格式（本地模型常出此格式，比纯 JSON 更稳）
     tool_calls = _parse_tool_calls_from_content(raw)
     if len(tool_calls) == 1:
-        tc = tool_calls[0]
-        name = (tc.get("name") or "").strip()
-        args = tc.get("arguments") or {}
-        if name == "list_assets":
-            return {"action": "list_assets"}
-        if name == "execute_command":
-            asset = (args.get("asset_name") or args.get("asset") or "").strip()
-            cmd = (args.get("command") or "").strip()
-            if asset or cmd:
-                return {"action": "execute_command", "asset": asset, "command": cmd}
+        o = _action_from_tool_call(tool_calls[0])
+        if o:
+            return o
     # 2) 再尝试整段 JSON（含对换行、尾部逗号的容错）
     _parse_error: list[str] = []  # 记录首次解析失败原因，便于诊断
 
     def _try_load_action(s: str) -> dict | None:
-        for t in (s, _fix_newlines_in_json_strings(s), re.sub(r",\s*([}\]])", r"\1", s)):
+        # 多数回复本就是合法 JSON：先严格解析（orjson 可用时走 C 实现），失败才逐个尝试修补后的文本。
+        # 整段 raw（含从 0 开始覆盖全文的切片，CPython 中即同一对象）在第 0 步已严格解析过，不再重复
+        if not (strict_tried and s is raw):
             try:
-                obj = json.loads(_strip_json_comments(t))
-                if not isinstance(obj, dict):
-                    continue
-                if obj.get("action"):
-                    return obj
-                # 兼容模型返回 {"response": "总结内容"} 而非 {"action": "final", "message": "..."}
-                if obj.get("response") is not None:
-                    return {"action": "final", "message": str(obj.get("response", "")).strip()}
+                o = _action_from_obj(json_loads(s))
+                if o:
+                    return o
+            except Exception:
+                pass
+        for t in _tolerant_variants(s):
+            try:
+                o = _action_from_obj(json.loads(_strip_json_comments(t)))
+                if o:
+                    return o
             except Exception as e:
                 if not _parse_error:
                     _parse_error.append(f"{type(e).__name__}: {e}")
                 continue
         return None
 
-    for block in (raw,):
-        o = _try_load_action(block)
-        if o:
-            return o
+    o = _try_load_action(raw)
+    if o:
+        return o
     # 先尝试「第一个完整 {...}」再按整段试，便于模型在 JSON 后追加说明时仍能解析
     start = raw.find("{")
     if start >= 0 and '"action"' in raw:
-        depth = 0
-        for i in range(start, len(raw)):
-            if raw[i] == "{":
-                depth += 1
-            elif raw[i] == "}":
-                depth -= 1
-                if depth == 0:
-                    seg = raw[start : i + 1]
-                    o = _try_load_action(seg)
-                    if o:
-                        return o
-                    break
+        end = _balanced_brace_end(raw, start)
+        if end > 0:
+            o = _try_load_action(raw[start:end])
+            if o:
+                return o
     # 再尝试从 ```json ... ``` 中取；若失败则把字符串值内换行转为 \n 再解析
     for m in _JSON_CODE_BLOCK_RE.finditer(raw):
         inner = (m.group(1) or "").strip()
@@ -434,66 +596,39 @@ def _parse_self_coded_action(content: str) -> dict | None:
         if o:
             return o
     # 推理模型（如 DeepSeek R1）常把 JSON/<tool_call> 放在回复末尾，尝试从尾部截取再解析
+    # 尾部不足 n 字时即整段，上面已试过；同一起点的 {...} 也只试一次
     if len(raw) > 400:
-        for tail in (raw[-2000:], raw[-1200:], raw[-800:], raw[-500:]):
+        tried_brace = raw.find("{")
+        for n in (2000, 1200, 800, 500):
+            off = len(raw) - n
+            if off <= 0:
+                continue
+            tail = raw[off:]
             if "{" in tail and '"action"' in tail:
-                o = _try_load_action(tail[tail.find("{"):])
-                if o:
-                    return o
+                brace = off + tail.find("{")
+                if brace != tried_brace:
+                    tried_brace = brace
+                    o = _try_load_action(raw[brace:])
+                    if o:
+                        return o
             tool_calls = _parse_tool_calls_from_content(tail)
             if len(tool_calls) == 1:
-                tc = tool_calls[0]
-                name = (tc.get("name") or "").strip()
-                args = tc.get("arguments") or {}
-                if name == "list_assets":
-                    return {"action": "list_assets"}
-                if name == "execute_command":
-                    asset = (args.get("asset_name") or args.get("asset") or "").strip()
-                    cmd = (args.get("command") or "").strip()
-                    if asset or cmd:
-                        return {"action": "execute_command", "asset": asset, "command": cmd}
+                o = _action_from_tool_call(tool_calls[0])
+                if o:
+                    return o
     # 推理模型有时把 final JSON 写在 reasoning 正文中间/末尾，整段搜索 "action":"final" 或 "action": "final" 后取完整 {...}
-    for _m in re.finditer(r'\{\s*"action"\s*:\s*"final"', raw):
+    for _m in _ACTION_FINAL_RE.finditer(raw):
         _start = _m.start()
-        _depth = 0
-        for _i in range(_start, len(raw)):
-            if raw[_i] == "{":
-                _depth += 1
-            elif raw[_i] == "}":
-                _depth -= 1
-                if _depth == 0:
-                    _seg = raw[_start : _i + 1]
-                    o = _try_load_action(_seg)
-                    if o:
-                        return o
-                    break
+        _end = _balanced_brace_end(raw, _start)
+        if _end > 0:
+            o = _try_load_action(raw[_start:_end])
+            if o:
+                return o
     # 模型常把 message 写成多行或截断导致 Unterminated string，尝试从 "message": " 后提取到结尾或下一个未转义的 "
-    _msg_prefix = re.search(r'"message"\s*:\s*"', raw)
+    _msg_prefix = _MESSAGE_KEY_RE.search(raw)
     if _msg_prefix and ("final" in raw[:_msg_prefix.start()] or '"action"' in raw[:_msg_prefix.start()]):
-        _start = _msg_prefix.end()
-        _buf = []
-        _i = _start
-        while _i < len(raw):
-            if raw[_i] == "\\" and _i + 1 < len(raw):
-                _c = raw[_i + 1]
-                if _c == "n":
-                    _buf.append("\n")
-                elif _c == "t":
-                    _buf.append("\t")
-                elif _c == '"':
-                    _buf.append('"')
-                elif _c == "\\":
-                    _buf.append("\\")
-                else:
-                    _buf.append(raw[_i])
-                    _buf.append(_c)
-                _i += 2
-                continue
-            if raw[_i] == '"':
-                break
-            _buf.append(raw[_i])
-            _i += 1
-        _msg = "".join(_buf).strip()
+        _body = _MSG_BODY_RE.match(raw, _msg_prefix.end()).group()
+        _msg = _MSG_ESCAPE_RE.sub(_unescape_msg, _body).strip()
         if _msg and len(_msg) > 5 and not _is_final_message_fluff(_msg):
             return {"action": "final", "message": _msg}
     # 诊断：解析失败时打印关键信息，便于排查「未解析到有效 action」
@@ -501,43 +636,89 @@ def _parse_self_coded_action(content: str) -> dict | None:
         "_parse_self_coded_action 未匹配 raw_len=%s 首条 json 报错=%s 前400字 repr=%s",
         len(raw),
         (_parse_error[0] if _parse_error else "-"),
-        repr((raw[:400] + ("..." if len(raw) > 400 else ""))),
+        _Preview(raw, 400),
     )
     return None
 
 
+# 「遵守格式」类空话短语；实质内容关键词。各编译为一个交替模式，一次扫描判断是否含任一短语
+_FLUFF_RE = re.compile(
+    "|".join(
+        map(
+            re.escape,
+            (
+                "根据用户指示",
+                "仅输出三种",
+                "严格遵守",
+                "以符合规则",
+                "符合规则",
+                "指定格式",
+                "都将严格遵守",
+                "任务已完成",
+                "已执行。",
+                "已执行完毕",
+            ),
+        )
+    )
+)
+_SUBSTANTIVE_RE = re.compile("巡检|结果|正常|异常|状态|运行|建议|docker|服务|容器|用户|权限")
+
+
 def _is_final_message_fluff(message: str) -> bool:
     """判断 final 的 message 是否为「遵守格式」类空话而非真实总结。"""
-    if not (message or "").strip():
-        return True
     s = (message or "").strip()
+    if not s:
+        return True
     # 含 Markdown 表格（多列 | 或分隔行 ---）的视为有效总结，不判为空话
     if "|" in s and ("\n" in s or "---" in s or s.count("|") >= 3) and len(s) > 30:
         return False
-    fluff_phrases = (
-        "根据用户指示",
-        "仅输出三种",
-        "严格遵守",
-        "以符合规则",
-        "符合规则",
-        "指定格式",
-        "都将严格遵守",
-        "任务已完成",
-        "任务已完成。",
-        "已执行。",
-        "已执行完毕",
-    )
-    if any(p in s for p in fluff_phrases):
+    if _FLUFF_RE.search(s):
         return True
     # 过短且无实质内容（无巡检/结果/状态/用户/权限等关键词）
-    if len(s) < 25 and not any(
-        k in s
-        for k in ("巡检", "结果", "正常", "异常", "状态", "运行", "建议", "docker", "服务", "容器", "用户", "权限")
-    ):
+    if len(s) < 25 and not _SUBSTANTIVE_RE.search(s):
         return True
     return False
 
 
+# 总结补发轮允许模型不写 JSON，而在此分隔行之后直接给出纯文本总结
+_SUMMARY_MARKER = "===SUMMARY==="
+
+
+def _summary_after_marker(text: str) -> str | None:
+    """取 _SUMMARY_MARKER 之后的总结正文；无分隔行或正文为空话时返回 None。"""
+    _, sep, rest = text.partition(_SUMMARY_MARKER)
+    if not sep:
+        return None
+    rest = rest.strip()
+    if not rest or _is_final_message_fluff(rest):
+        return None
+    return rest
+
+
+def _has_complete_final_action(text: str) -> bool:
+    """流式接收中判断是否已有完整可解析的 {"action": "final", "message": ...} 且 message 非空话。
+    只认严格 JSON：容错解析会把未闭合的 message 也当作结果，流式中途用它会截断总结。"""
+    m = _ACTION_FINAL_RE.search(text)
+    if not m:
+        return False
+    end = _balanced_brace_end(text, m.start())
+    if end < 0:
+        return False
+    try:
+        obj = json_loads(text[m.start():end])
+    except Exception:
+        return False
+    if not isinstance(obj, dict):
+        return False
+    message = obj.get("message")
+    return isinstance(message, str) and not _is_final_message_fluff(message)
+
+
+# getent passwd 格式：username:password:uid:gid:gecos:home:shell，严格 7 段（避免匹配含大量冒号的其他输出），取用户名、uid、gid、shell
+_PASSWD_LINE_RE = re.compile(r"^([^:\n]*):[^:\n]*:([^:\n]*):([^:\n]*):[^:\n]*:[^:\n]*:([^:\n]*)$", re.MULTILINE)
+_PASSWD_INVALID_PREFIXES = ("link", "inet", "valid", "brd", "scope", "altname", "state ", "group ")
+
+
 def _parse_getent_passwd_to_table(tool_result: str) -> str | None:
     """从 getent passwd 命令输出解析并生成 Markdown 表格。若无法解析则返回 None。
     规则严格，避免把 ip addr、link/ether 等输出误判为 passwd 行。"""
@@ -546,23 +727,16 @@ def _parse_getent_passwd_to_table(tool_result: str) -> str | None:
     # 明显不是 passwd 输出：含 ip/网络接口特征则直接不解析
     if "link/ether" in tool_result or "scope global" in tool_result or "inet " in tool_result and "mtu" in tool_result:
         return None
-    lines = tool_result.strip().split("\n")
     users = []
-    invalid_prefixes = ("link", "inet", "valid", "brd", "scope", "altname", "state ", "group ")
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith("#") or line.startswith("<"):
+    # 由正则一次取出恰好 7 段的行，其余行（绝大多数非 passwd 输出）不进入 Python 循环
+    for username, uid, gid, shell in _PASSWD_LINE_RE.findall(tool_result):
+        username, uid, gid, shell = username.strip(), uid.strip(), gid.strip(), shell.strip()
+        if not username or username[0] in "#<":
             continue
-        # getent passwd 格式：username:password:uid:gid:gecos:home:shell（严格 7 段）
-        parts = line.split(":")
-        if len(parts) != 7:  # passwd 行恰好 7 段，避免匹配含大量冒号的其他输出
-            continue
-        username, uid, gid = parts[0].strip(), parts[2].strip(), parts[3].strip()
-        shell = (parts[6] or "").strip()
         # 用户名：仅字母数字、下划线、减号，且不以 link/inet 等开头；shell 必须是路径（含 /）
-        if not username or not uid.isdigit() or not gid.isdigit():
+        if not uid.isdigit() or not gid.isdigit():
             continue
-        if any(username.lower().startswith(p) for p in invalid_prefixes):
+        if username.lower().startswith(_PASSWD_INVALID_PREFIXES):
             continue
         if "/" not in shell or " " in username:
             continue
@@ -590,23 +764,30 @@ def _parse_df_h_line(line: str) -> dict | None:
     return {"size": size, "used": used, "avail": avail, "use_pct": use_pct, "mount": mount}
 
 
+_DF_DEV_LINE_RE = re.compile(r"^[^\S\n]*/dev[^\n]*", re.MULTILINE)
+_TOOL_RESULT_ASSET_RE = re.compile(r'<tool_result\s+asset="([^"]+)"[^>]*>([\s\S]*?)</tool_result>', re.IGNORECASE)
+
+
 def _build_df_table_from_messages(messages: list[dict]) -> tuple[str | None, list[tuple[str, dict]]]:
     """从 messages 中提取带 asset 的 <tool_result>，解析 df -h 输出，按资产生成汇总表。
     同一资产只保留一行（首次出现），避免多轮或重复 tool_result 导致表格重复。"""
     seen: dict[str, tuple[str, dict]] = {}  # asset -> (asset, row)，按首次出现顺序
-    pattern = re.compile(r'<tool_result\s+asset="([^"]+)"[^>]*>([\s\S]*?)</tool_result>', re.IGNORECASE)
     for msg in messages:
         if msg.get("role") != "user":
             continue
         content = msg.get("content") or ""
-        for m in pattern.finditer(content):
+        # <tool_result> 由 orchestrator 以小写生成；普通对话消息直接跳过，不跑正则
+        if "<tool_result" not in content:
+            continue
+        for m in _TOOL_RESULT_ASSET_RE.finditer(content):
             asset, body = m.group(1).strip(), m.group(2)
             if asset in seen:
                 continue
             if "df" not in body.lower() and "Filesystem" not in body and "文件系统" not in body:
                 continue
-            for line in body.split("\n"):
-                row = _parse_df_h_line(line)
+            # 只看以 /dev 开头的行，不再逐行切分整段输出
+            for line_m in _DF_DEV_LINE_RE.finditer(body):
+                row = _parse_df_h_line(line_m.group())
                 if row:
                     seen[asset] = (asset, row)
                     break
@@ -630,6 +811,10 @@ def _message_has_table(text: str) -> bool:
     return len(lines) >= 2
 
 
+# 像「我将执行」或向用户提问的短语，出现即不当作总结
+_NOT_SUMMARY_RE = re.compile(r"我将|我会执行|请指定|请告知|\? |？")
+
+
 def _looks_like_final_summary(content: str) -> bool:
     """模型未按 JSON 输出但给了一段自然语言总结时，视为可用的最终回复（如 ## Summarize\\n...）。"""
     if not (content or "").strip() or len(content) < 50 or len(content) > 8000:
@@ -639,47 +824,51 @@ def _looks_like_final_summary(content: str) -> bool:
     if c.startswith("{") or c.startswith("<tool_call") or '"action"' in c[:100]:
         return False
     # 像「我将执行」或提问，不当作总结
-    if any(p in c for p in ("我将", "我会执行", "请指定", "请告知", "? ", "？")):
+    if _NOT_SUMMARY_RE.search(c):
         return False
+    cl = c.lower()  # 只做一次小写化，下面不区分大小写的判断共用
     # 像总结：含 Summarize/summary/总结，或 服务/容器/状态 + running/active/Up/运行
-    if "Summarize" in c or "summary" in c.lower() or "总结" in c:
+    if "Summarize" in c or "summary" in cl or "总结" in c:
         return True
     if ("Docker" in c or "docker" in c or "服务" in c or "容器" in c) and (
         "running" in c or "active" in c or "Up" in c or "状态" in c or "运行" in c
     ):
         return True
-    if "command" in c.lower() and ("result" in c.lower() or "output" in c.lower() or "执行" in c):
+    if "command" in cl and ("result" in cl or "output" in cl or "执行" in c):
         return True
     return False
 
 
+# 内部推理/格式说明类短语（均按字面匹配）编译成一个交替正则，长文只扫一遍
+_REASONING_PHRASE_RE = re.compile("|".join(map(re.escape, (
+    "严格遵守",
+    "指定格式",
+    "符合规则",
+    "只输出三种",
+    "禁止输出",
+    "tool_result",
+    "请替换示例数据",
+    "请替换示例",
+    "最终答案",
+    "action.*execute",
+    "action\": \"final\"",
+    '"action": "final"',
+    "表格中的每一行必须",
+    "禁止添加或臆造",
+    "必须严格来自",
+    "无 tool_call",
+    "只能提供一个 JSON",
+    "根据规则",
+    "根据上述规则",
+))))
+
+
 def _looks_like_internal_reasoning(content: str) -> bool:
     """检测内容是否为模型内部推理（规则、格式说明、示例数据等），不应作为最终回复展示给用户。"""
     if not (content or "").strip() or len(content) < 200:
         return False
     c = content.strip()
-    reasoning_phrases = (
-        "严格遵守",
-        "指定格式",
-        "符合规则",
-        "只输出三种",
-        "禁止输出",
-        "tool_result",
-        "请替换示例数据",
-        "请替换示例",
-        "最终答案",
-        "action.*execute",
-        "action\": \"final\"",
-        '"action": "final"',
-        "表格中的每一行必须",
-        "禁止添加或臆造",
-        "必须严格来自",
-        "无 tool_call",
-        "只能提供一个 JSON",
-        "根据规则",
-        "根据上述规则",
-    )
-    if any(p in c for p in reasoning_phrases):
+    if _REASONING_PHRASE_RE.search(c):
         return True
     # 长段中反复出现 JSON 结构说明或「步骤」类推理
     if c.count("execute_command") >= 2 and c.count("final") >= 2 and len(c) > 800:
@@ -689,6 +878,19 @@ def _looks_like_internal_reasoning(content: str) -> bool:
     return False
 
 
+# 同一段提醒在最近几条消息里已发过时，改发这句短提示，避免重复整段占用上下文
+_NUDGE_REPEAT = "（同上一条提醒：请严格按其中要求输出，不要重复之前的回复。）"
+_NUDGE_LOOKBACK = 6
+
+
+def _dedupe_nudge(messages: list, nudge: str) -> str:
+    """返回本次应追加的提醒文本：最近 _NUDGE_LOOKBACK 条消息中已有相同提醒时返回 _NUDGE_REPEAT，否则原样返回。"""
+    for m in messages[-_NUDGE_LOOKBACK:]:
+        if isinstance(m, dict) and m.get("content") == nudge:
+            return _NUDGE_REPEAT
+    return nudge
+
+
 def chat_with_self_coded_fc(
     client: OpenAI,
     model: str,
@@ -705,12 +907,15 @@ def chat_with_self_coded_fc(
     """
     prefix = f"[{trace_id}] " if trace_id else ""
     nudge_count = 0
+    # 循环中 messages 只追加不修改，首条 user 消息（用户指令）在进入循环前取一次即可
+    first_user_content = next(
+        ((m.get("content") or "")[:500] for m in messages if m.get("role") == "user"), ""
+    )
     # 自研 Agent：本地模型不限制 token，避免总结/表格被截断；首轮略高 temperature
     for r in range(max_rounds):
         chat_kw = {"max_tokens": 8192, "temperature": 0.5 if r == 0 else 0.3}
         logger.info("%schat_with_self_coded_fc 第 %s 轮请求 model=%s", prefix, r + 1, model)
         content = chat_once(client, model, messages, **chat_kw)
-        content = (content or "").strip()
         # 空回复时重试一次：首轮用略高 temperature；第 2 轮起用略高 max_tokens（R1 在 tool_result 后常返空）
         if not content:
             if r == 0:
@@ -719,20 +924,19 @@ def chat_with_self_coded_fc(
             else:
                 logger.info("%schat_with_self_coded_fc 第 %s 轮空回复，重试一次（max_tokens=8192）", prefix, r + 1)
                 content = chat_once(client, model, messages, max_tokens=8192, temperature=0.3)
-            content = (content or "").strip()
         action = _parse_self_coded_action(content)
         if not action:
             # 再试一次：去掉首条非 JSON 前缀（从第一个 { 开始）后解析
-            if (content or "").strip() and "{" in content and '"action"' in content:
+            if "{" in content and '"action"' in content:
                 idx = content.find("{")
                 action = _parse_self_coded_action(content[idx:])
             if not action:
-                c = (content or "").strip()
+                c = content
                 logger.warning(
                     "%schat_with_self_coded_fc 未解析到有效 action reply_len=%s 前600字=%s",
                     prefix,
                     len(c),
-                    repr(c[:600] + ("..." if len(c) > 600 else "")),
+                    _Preview(c, 600),
                 )
                 # 模型有时直接给自然语言总结（如 ## Summarize\\n...），视为最终回复；若是规则/推理长文则不当作总结
                 if r >= 1 and c and _looks_like_final_summary(c) and not _looks_like_internal_reasoning(c):
@@ -756,6 +960,7 @@ def chat_with_self_coded_fc(
                         '2) {"action": "execute_command", "asset": "资产名", "command": "具体命令"} 或 <tool_call>{"name":"execute_command","arguments":{"asset_name":"资产名","command":"具体命令"}}</tool_call>\n'
                         '3) {"action": "final", "message": "本次任务的一两句话中文总结"}（message 必须是真实结论，不要空话）'
                     )
+                    nudge_content = _dedupe_nudge(messages, nudge_content)
                     messages.append({"role": "user", "content": nudge_content})
                     if on_turn:
                         on_turn("assistant", content)
@@ -765,7 +970,7 @@ def chat_with_self_coded_fc(
                     "%schat_with_self_coded_fc 未解析到有效 action，当作最终回复 reply_len=%s 前600字=%s",
                     prefix,
                     len(c),
-                    repr(c[:600] + ("..." if len(c) > 600 else "")),
+                    _Preview(c, 600),
                 )
                 # 若内容实为内部推理（规则、格式、示例等），不暴露给用户，返回简短提示
                 if _looks_like_internal_reasoning(content or ""):
@@ -781,11 +986,6 @@ def chat_with_self_coded_fc(
             logger.info("%schat_with_self_coded_fc 收到 final，结束", prefix)
             final_msg = (user_msg or "").strip() or (action.get("message") or "").strip()
             # 仅当用户指令与「用户/权限」相关时，才用代码解析 getent passwd 生成表格（避免 IP 配置等场景被误替换）
-            first_user_content = ""
-            for m in messages:
-                if m.get("role") == "user":
-                    first_user_content = (m.get("content") or "")[:500]
-                    break
             is_user_list_query = any(
                 k in first_user_content for k in ("用户", "权限", "passwd", "getent", "账号", "账户")
             )
@@ -820,40 +1020,46 @@ def chat_with_self_coded_fc(
             # 当本轮 content 实为长 reasoning（如 R1 只给 reasoning 无 content），且含表格/用户列表，而解析出的 message 很短时，优先采用长内容作为最终回复
             if (
                 len(content) > 2000
-                and "|" in content
                 and content.count("|") >= 3
                 and (("用户" in content or "UID" in content) or _looks_like_final_summary(content))
                 and len(final_msg) < 500
             ):
-                final_msg = content.strip()[:12000]
+                # content 已是去掉首尾空白的回复（chat_once 返回值），超长时切片与截断提示一次拼出
                 if len(content) > 12000:
-                    final_msg += "\n\n(以上为摘要，内容已截断。)"
+                    final_msg = content[:12000] + "\n\n(以上为摘要，内容已截断。)"
+                else:
+                    final_msg = content
                 logger.info("%schat_with_self_coded_fc 采用本轮长 reasoning/总结作为最终回复 len=%s", prefix, len(final_msg))
             if _is_final_message_fluff(final_msg):
                 # 补发一轮：要求根据命令输出和用户意图给出专业总结，避免只回复「任务已完成」
                 summary_nudge = (
                     "请根据上述 <tool_result> 和用户指令，先理解用户问的是什么并直接回答（例如问「哪个大」就先答谁大、再附数据），再视需要附表格；不要只贴表格不回答问题。message 中表格的每一行必须来自 <tool_result> 实际输出。只输出 {\"action\": \"final\", \"message\": \"你的总结\"}。"
+                    "若确实无法输出 JSON，可改为先单独输出一行 " + _SUMMARY_MARKER + "，再在其后直接写总结正文。"
                 )
                 messages.append({"role": "user", "content": summary_nudge})
                 if on_turn:
                     on_turn("user", summary_nudge)
                 # 给足 max_tokens，避免总结或表格在 message 中被截断（本地模型不限制）
-                extra = chat_once(client, model, messages, max_tokens=8192, temperature=0.2)
-                extra = (extra or "").strip()
+                extra = chat_once_stream(client, model, messages, max_tokens=8192, temperature=0.2)
+                # 每个回复只解析一次，截断判断与后续取 message 共用同一结果
+                extra_action = _parse_self_coded_action(extra) if extra else None
                 # 若像截断的 JSON（以 {"action 开头但解析失败且很短），再试一次
-                if extra and extra.startswith('{"action') and len(extra) < 80:
-                    extra_action = _parse_self_coded_action(extra)
-                    if not extra_action:
-                        logger.info("%schat_with_self_coded_fc 总结轮回复似截断 len=%s，重试一次", prefix, len(extra))
-                        extra = chat_once(client, model, messages, max_tokens=8192, temperature=0.2)
-                        extra = (extra or "").strip()
+                if not extra_action and extra.startswith('{"action') and len(extra) < 80:
+                    logger.info("%schat_with_self_coded_fc 总结轮回复似截断 len=%s，重试一次", prefix, len(extra))
+                    extra = chat_once_stream(client, model, messages, max_tokens=8192, temperature=0.2)
+                    extra_action = _parse_self_coded_action(extra) if extra else None
                 if extra:
-                    extra_action = _parse_self_coded_action(extra)
                     if extra_action and (extra_action.get("action") or "").strip() == "final":
                         extra_msg = (extra_action.get("message") or "").strip()
                         if extra_msg and not _is_final_message_fluff(extra_msg):
                             final_msg = extra_msg
                             logger.info("%schat_with_self_coded_fc 补发一轮后得到有效总结", prefix)
+                    # 未给 JSON 但按约定用分隔行给出了纯文本总结：直接采用，省去第二轮补发
+                    if _is_final_message_fluff(final_msg):
+                        marked = _summary_after_marker(extra)
+                        if marked:
+                            final_msg = marked
+                            logger.info("%schat_with_self_coded_fc 补发一轮后采用 %s 分隔的文本总结", prefix, _SUMMARY_MARKER)
                     # 未解析出 JSON 但返回了长推理/总结（如 R1 只给 reasoning 无 content），若像总结或含表格则直接采用
                     if _is_final_message_fluff(final_msg) and len(extra) > 400 and not extra.strip().startswith("{"):
                         if _looks_like_final_summary(extra) or ("|" in extra and extra.count("|") >= 3 and len(extra) > 100):
@@ -865,8 +1071,7 @@ def chat_with_self_coded_fc(
                     messages.append({"role": "user", "content": short_nudge})
                     if on_turn:
                         on_turn("user", short_nudge)
-                    extra2 = chat_once(client, model, messages, max_tokens=8192, temperature=0.1)
-                    extra2 = (extra2 or "").strip()
+                    extra2 = chat_once_stream(client, model, messages, max_tokens=8192, temperature=0.1)
                     if extra2:
                         extra_action2 = _parse_self_coded_action(extra2)
                         if extra_action2 and (extra_action2.get("action") or "").strip() == "final":
@@ -889,14 +1094,37 @@ def chat_with_self_coded_fc(
     return "已达到最大轮数，任务未完成。"
 
 
+# 意图/索要资产的短语各编译成一个交替正则，长回复（R1 reasoning 常 >10KB）只扫一遍，而非逐个短语 in
+_INTENT_PHRASE_RE = re.compile("|".join(map(re.escape, (
+    "我将", "我们将", "请执行", "我会执行", "接下来执行", "将执行", "让我执行",
+    "执行的下一步命令", "现在，让我执行", "下一步，我们将", "接下来",
+))))
+_INTENT_VERB_RE = re.compile("执行|命令|检查")
+# _looks_intent_to_execute_without_tool 各分支短语的首字（英文分支都要求含反引号），用作一次性预筛
+_INTENT_PREFILTER_RE = re.compile("[`我请接将让执现下建错违未正]")
+_ASSET_SELECTION_RE = re.compile("|".join(map(re.escape, (
+    "指定操作资产",
+    "指定操作对象",
+    "请指定操作资产",
+    "请仔细检查并指定操作资产",
+    "请指定要操作的资产",
+    "请先指定资产",
+    "没有任何指定",
+    "无法继续执行操作",
+    "我无法继续执行操作",
+))))
+
+
 def _looks_intent_to_execute_without_tool(content: str) -> bool:
     """检测是否为「说要执行命令但未调用工具」或「只给建议未执行」的回复，用于触发一次提醒。"""
     if not (content or "").strip():
         return False
     c = content.strip()
+    # 下面每条判断都要求出现反引号或某个中文短语；一个都不含（如不带命令的纯英文回复）时一次扫描即返回
+    if not _INTENT_PREFILTER_RE.search(c):
+        return False
     # 中文：我将/我们将/请执行/我会执行/接下来执行/将执行/让我执行/执行的下一步命令/下一步我们将/接下来 + 执行/命令/检查
-    intent_phrases = ("我将", "我们将", "请执行", "我会执行", "接下来执行", "将执行", "让我执行", "执行的下一步命令", "现在，让我执行", "下一步，我们将", "接下来")
-    if any(p in c for p in intent_phrases) and ("执行" in c or "命令" in c or "检查" in c):
+    if _INTENT_PHRASE_RE.search(c) and _INTENT_VERB_RE.search(c):
         return True
     # 误以为由程序返回 <tool_result>：如「请回复 <tool_result> 后续执行结果」——必须先输出 <tool_call> 才会得到 tool_result
     if "请回复" in c and ("<tool_result>" in c or "tool_result" in c):
@@ -922,19 +1150,57 @@ def _looks_asset_selection_request(content: str) -> bool:
     """检测模型是否在让用户重新「指定操作资产」，用于自动回击并继续执行。"""
     if not (content or "").strip():
         return False
-    c = content.strip()
-    phrases = (
-        "指定操作资产",
-        "指定操作对象",
-        "请指定操作资产",
-        "请仔细检查并指定操作资产",
-        "请指定要操作的资产",
-        "请先指定资产",
-        "没有任何指定",
-        "无法继续执行操作",
-        "我无法继续执行操作",
-    )
-    return any(p in c for p in phrases)
+    return _ASSET_SELECTION_RE.search(content) is not None
+
+
+def _format_tool_results(results: list[tuple[str, str]]) -> str:
+    """把 [(工具名, 结果文本)] 拼成 <tool_result> 块。各片段平铺进一个列表只 join 一次，
+    大输出（df、journalctl 等）只被复制一次，不再先经 f-string 复制一遍。"""
+    parts = ["<tool_result>\n"]
+    for i, (name, result) in enumerate(results):
+        if i:
+            parts.append("\n\n")
+        parts.extend(("【", name, "】\n", result))
+    parts.append("\n</tool_result>")
+    return "".join(parts)
+
+
+# 同一轮多个工具调用的执行线程池：各调用多为数秒级的 SSH 往返，不同资产之间互不依赖
+_TOOL_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ai-ops-tool")
+
+
+def _run_tool_calls(calls: list, catch_errors: bool) -> list[str]:
+    """执行一轮中的工具调用，按原顺序返回结果文本。calls 每项为已得出的结果文本，或待执行的 (handler, args)。
+    不同 asset_name 的调用并发执行；同一资产上的调用在同一线程内按原顺序串行，避免「先改配置再重启」类命令乱序。
+    只涉及一台资产时直接在当前线程执行。catch_errors 为 True 时 handler 异常记为「执行失败: ...」，否则抛出。"""
+    results: list = [c if isinstance(c, str) else None for c in calls]
+    groups: dict = {}
+    for i, c in enumerate(calls):
+        if not isinstance(c, str):
+            args = c[1]
+            groups.setdefault(args.get("asset_name") if isinstance(args, dict) else None, []).append(i)
+
+    def run_group(idxs: list[int]) -> None:
+        for i in idxs:
+            handler, args = calls[i]
+            if not catch_errors:
+                results[i] = str(handler(**args))
+                continue
+            try:
+                results[i] = str(handler(**args))
+            except Exception as e:
+                results[i] = f"执行失败: {e}"
+
+    if len(groups) <= 1:
+        for idxs in groups.values():
+            run_group(idxs)
+        return results
+    futures = [_TOOL_POOL.submit(run_group, idxs) for idxs in groups.values()]
+    # 等全部结束再取结果，某组抛异常时不留下仍在执行的其他组
+    wait(futures)
+    for f in futures:
+        f.result()
+    return results
 
 
 def chat_with_tools(
@@ -949,6 +1215,13 @@ def chat_with_tools(
     """带 function calling 的对话：若 AI 返回 tool_calls 则执行并继续，否则返回最终回复。on_turn 用于记录交互。"""
     prefix = f"[{trace_id}] " if trace_id else ""
     nudge_count = 0  # 已因「只说执行未调工具」提醒的轮数，最多 MAX_NUDGES 次
+
+    def _push(role: str, content: str) -> None:
+        """追加一条普通消息并同步回调 on_turn。"""
+        messages.append({"role": role, "content": content})
+        if on_turn:
+            on_turn(role, content)
+
     while True:
         logger.info("%schat_with_tools 请求 model=%s messages条数=%s", prefix, model, len(messages))
         response = client.chat.completions.create(
@@ -962,59 +1235,72 @@ def chat_with_tools(
 
         # 1) API 原生返回了 tool_calls：按 OpenAI 规范执行并继续
         if msg.tool_calls:
-            messages.append(msg)
+            # 以普通 dict 写回历史：下一轮请求与会话落库都直接序列化，不再经 SDK 模型对象转换，
+            # 也不会把 SDK 对象上的额外字段（如 reasoning_content）带回请求
+            messages.append(
+                {
+                    "role": "assistant",
+                    "content": msg.content,
+                    "tool_calls": [
+                        {
+                            "id": t.id,
+                            "type": "function",
+                            "function": {"name": t.function.name, "arguments": t.function.arguments},
+                        }
+                        for t in msg.tool_calls
+                    ],
+                }
+            )
             if on_turn:
                 on_turn("assistant", content or ("[API tool_calls: " + ", ".join(t.function.name for t in msg.tool_calls) + "]"))
             logger.info("%schat_with_tools 工具调用数=%s（API 原生）", prefix, len(msg.tool_calls))
-            results_parts = []
+            calls: list = []
             for tc in msg.tool_calls:
                 name = tc.function.name
                 logger.info("%s工具调用 name=%s", prefix, name)
                 if name not in tool_handlers:
-                    result = f"未知工具: {name}"
+                    calls.append(f"未知工具: {name}")
+                    continue
+                try:
+                    args = json_loads(tc.function.arguments)
+                except Exception as e:
+                    calls.append(f"参数解析失败: {e}")
                 else:
-                    try:
-                        args = json.loads(tc.function.arguments)
-                    except Exception as e:
-                        result = f"参数解析失败: {e}"
-                    else:
-                        logger.info("%s工具调用参数 args=%s", prefix, args)
-                        result = tool_handlers[name](**args)
+                    logger.info("%s工具调用参数 args=%s", prefix, args)
+                    calls.append((tool_handlers[name], args))
+            results = _run_tool_calls(calls, catch_errors=False)
+            results_parts: list[tuple[str, str]] = []
+            for tc, result in zip(msg.tool_calls, results):
                 messages.append(
                     {
                         "role": "tool",
                         "tool_call_id": tc.id,
-                        "content": str(result),
+                        "content": result,
                     }
                 )
-                results_parts.append(f"【{name}】\n{result}")
+                results_parts.append((tc.function.name, result))
             if on_turn:
-                on_turn("user", "<tool_result>\n" + "\n\n".join(results_parts) + "\n</tool_result>")
+                on_turn("user", _format_tool_results(results_parts))
             continue
 
         # 2) 无 tool_calls：检查是否为 Qwen 等“正文内 <tool_call>”格式
         text_tool_calls = _parse_tool_calls_from_content(content)
         if text_tool_calls:
             logger.info("%schat_with_tools 从正文解析到工具调用数=%s（Qwen 等文本格式）", prefix, len(text_tool_calls))
-            messages.append({"role": "assistant", "content": content})
-            results_parts = []
+            _push("assistant", content)
+            calls: list = []
+            names: list[str] = []
             for tc in text_tool_calls:
                 name = tc.get("name") or ""
                 args = tc.get("arguments") or {}
                 logger.info("%s工具调用 name=%s args=%s", prefix, name, args)
+                names.append(name)
                 if name not in tool_handlers:
-                    result = f"未知工具: {name}"
+                    calls.append(f"未知工具: {name}")
                 else:
-                    try:
-                        result = tool_handlers[name](**args)
-                    except Exception as e:
-                        result = f"执行失败: {e}"
-                results_parts.append(f"【{name}】\n{result}")
-            tool_result_content = "<tool_result>\n" + "\n\n".join(results_parts) + "\n</tool_result>"
-            messages.append({"role": "user", "content": tool_result_content})
-            if on_turn:
-                on_turn("assistant", content)
-                on_turn("user", tool_result_content)
+                    calls.append((tool_handlers[name], args))
+            results_parts = list(zip(names, _run_tool_calls(calls, catch_errors=True)))
+            _push("user", _format_tool_results(results_parts))
             continue
 
         # 3) 既无 API tool_calls 也无正文 tool_call：视为最终回复
@@ -1022,26 +1308,19 @@ def chat_with_tools(
         if nudge_count < MAX_NUDGES and _looks_intent_to_execute_without_tool(content):
             nudge_count += 1
             logger.info("%schat_with_tools 检测到「将执行」但未调工具，补发提醒（第%s次）再请求一轮", prefix, nudge_count)
-            messages.append({"role": "assistant", "content": content})
+            _push("assistant", content)
             nudge_msg = "你刚才表示要执行命令、只给出了建议、或承认了未调用工具但未在本轮调用 execute_command。不要只认错或请用户「告知具体目标」——请立即在本轮调用 execute_command 执行后续巡检/排查命令，再根据结果给出结论。"
-            messages.append({"role": "user", "content": nudge_msg})
-            if on_turn:
-                on_turn("assistant", content)
-                on_turn("user", nudge_msg)
+            _push("user", _dedupe_nudge(messages, nudge_msg))
             continue
         if nudge_count < MAX_NUDGES and _looks_asset_selection_request(content):
             nudge_count += 1
             logger.info("%schat_with_tools 检测到「请求指定资产」，补发提醒（第%s次）再请求一轮", prefix, nudge_count)
-            messages.append({"role": "assistant", "content": content})
+            _push("assistant", content)
             nudge_msg = "资产已经在本次会话中由系统选定并通过前缀提示给出，你无需也不能再次要求用户「指定操作资产」或声称「无法继续执行操作」。请直接使用 execute_command 针对已选资产继续执行巡检/排查命令，不要再回复类似「请指定操作资产」「无法继续执行操作」之类的内容。"
-            messages.append({"role": "user", "content": nudge_msg})
-            if on_turn:
-                on_turn("assistant", content)
-                on_turn("user", nudge_msg)
+            _push("user", _dedupe_nudge(messages, nudge_msg))
             continue
         logger.info("%schat_with_tools 最终回复长度=%s", prefix, len(content))
         return content, messages
-    return "", messages
 
 
 def chat_with_prompt_tools(
@@ -1062,10 +1341,16 @@ def chat_with_prompt_tools(
     """
     prefix = f"[{trace_id}] " if trace_id else ""
     nudge_count = 0
+
+    def _push(role: str, content: str) -> None:
+        """追加一条普通消息并同步回调 on_turn。"""
+        messages.append({"role": role, "content": content})
+        if on_turn:
+            on_turn(role, content)
+
     while True:
         logger.info("%schat_with_prompt_tools 请求 model=%s messages条数=%s", prefix, model, len(messages))
         content = chat_once(client, model, messages)
-        content = (content or "").strip()
 
         text_tool_calls = _parse_tool_calls_from_content(content)
         if not text_tool_calls and default_asset_name:
@@ -1074,46 +1359,35 @@ def chat_with_prompt_tools(
                 logger.info("%schat_with_prompt_tools 从「仅含 command 的 JSON」解析到工具调用数=%s", prefix, len(text_tool_calls))
         if text_tool_calls:
             logger.info("%schat_with_prompt_tools 解析到工具调用数=%s", prefix, len(text_tool_calls))
-            messages.append({"role": "assistant", "content": content})
-            results_parts = []
+            _push("assistant", content)
+            calls: list = []
+            names: list[str] = []
             for tc in text_tool_calls:
                 name = tc.get("name") or ""
                 args = tc.get("arguments") or {}
                 logger.info("%schat_with_prompt_tools 工具 name=%s args=%s", prefix, name, args)
+                names.append(name)
                 if name not in tool_handlers:
-                    result = f"未知工具: {name}"
+                    calls.append(f"未知工具: {name}")
                 else:
-                    try:
-                        result = tool_handlers[name](**args)
-                    except Exception as e:
-                        result = f"执行失败: {e}"
-                results_parts.append(f"【{name}】\n{result}")
-            tool_result_content = "<tool_result>\n" + "\n\n".join(results_parts) + "\n</tool_result>"
-            messages.append({"role": "user", "content": tool_result_content})
-            if on_turn:
-                on_turn("assistant", content)
-                on_turn("user", tool_result_content)
+                    calls.append((tool_handlers[name], args))
+            results_parts = list(zip(names, _run_tool_calls(calls, catch_errors=True)))
+            _push("user", _format_tool_results(results_parts))
             continue
 
         if nudge_count < MAX_NUDGES and _looks_intent_to_execute_without_tool(content):
             nudge_count += 1
             logger.info("%schat_with_prompt_tools 检测到「将执行」但未调工具，补发提醒（第%s次）再请求一轮", prefix, nudge_count)
-            messages.append({"role": "assistant", "content": content})
+            _push("assistant", content)
             nudge_msg = "你刚才表示要执行命令、给出了建议、或承认了未调用工具但未在本轮输出 <tool_call>。不要只认错或请用户「告知具体目标」——请立即在本轮输出 <tool_call>{\"name\":\"execute_command\",\"arguments\":{\"asset_name\":\"...\",\"command\":\"...\"}}</tool_call> 执行后续巡检/排查命令（如 journalctl -p err -b 等），再根据结果给出结论。"
-            messages.append({"role": "user", "content": nudge_msg})
-            if on_turn:
-                on_turn("assistant", content)
-                on_turn("user", nudge_msg)
+            _push("user", _dedupe_nudge(messages, nudge_msg))
             continue
         if nudge_count < MAX_NUDGES and _looks_asset_selection_request(content):
             nudge_count += 1
             logger.info("%schat_with_prompt_tools 检测到「请求指定资产」，补发提醒（第%s次）再请求一轮", prefix, nudge_count)
-            messages.append({"role": "assistant", "content": content})
+            _push("assistant", content)
             nudge_msg = "资产已经在本次会话中由系统选定并通过前缀提示给出，你无需也不能再次要求用户「指定操作资产」或声称「无法继续执行操作」。请直接输出 <tool_call>{\"name\":\"execute_command\",\"arguments\":{\"asset_name\":\"...\",\"command\":\"...\"}}</tool_call> 针对已选资产继续执行巡检/排查命令，不要再回复类似「请指定操作资产」「无法继续执行操作」之类的内容。"
-            messages.append({"role": "user", "content": nudge_msg})
-            if on_turn:
-                on_turn("assistant", content)
-                on_turn("user", nudge_msg)
+            _push("user", _dedupe_nudge(messages, nudge_msg))
             continue
         logger.info("%schat_with_prompt_tools 最终回复长度=%s", prefix, len(content))
         return content, messages
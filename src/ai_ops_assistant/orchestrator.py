@@ -1,23 +1,27 @@
 """任务编排：用户指令 → AI 规划 → 执行（SSH）→ 反馈 AI → 循环直到完成。"""
 from __future__ import annotations
 
-import json
 import logging
 import re
 import threading
-import urllib.request
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from typing import Callable, Optional
 
+import httpx
+
 from .config import AppConfig, load_config
+from .jsonutil import dumps_bytes, loads as json_loads
 from .llm import (
     EXECUTE_COMMAND_SCHEMA,
     LIST_ASSETS_SCHEMA,
-    PROMPT_TOOLS_INSTRUCTION,
+    PROMPT_TOOLS_SYSTEM,
     SELF_CODED_SYSTEM,
     SYSTEM_PROMPT,
     create_client,
-    chat_once,
+    chat_once_stream,
     chat_with_prompt_tools,
     chat_with_self_coded_fc,
     chat_with_tools,
@@ -27,19 +31,22 @@ from .ssh_executor import execute_on_asset, get_asset_by_name, list_assets_displ
 logger = logging.getLogger("ai_ops_assistant.orchestrator")
 
 
+# MCP Tool HTTP 调用共用一个连接池：同一 MCP 服务的多轮调用复用 keep-alive 连接，不再每次重新建连
+_MCP_HTTP = httpx.Client(limits=httpx.Limits(max_connections=16, max_keepalive_connections=4))
+
+
 def _call_mcp_tool(url: str, name: str, arguments: dict, timeout: int = 120) -> str:
     """通过 MCP Tool HTTP 调用工具（POST /tool），返回 result 文本。"""
     try:
-        data = json.dumps({"name": name, "arguments": arguments}).encode("utf-8")
-        req = urllib.request.Request(
+        resp = _MCP_HTTP.post(
             url,
-            data=data,
+            content=dumps_bytes({"name": name, "arguments": arguments}),
             headers={"Content-Type": "application/json"},
-            method="POST",
+            timeout=timeout,
         )
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
-            out = json.loads(resp.read().decode("utf-8"))
-            return (out.get("result") or "").strip() or "(无输出)"
+        resp.raise_for_status()
+        out = json_loads(resp.content)
+        return (out.get("result") or "").strip() or "(无输出)"
     except Exception as e:
         return f"MCP 工具调用失败: {type(e).__name__}: {e}"
 
@@ -49,18 +56,35 @@ def _extract_json(text: str) -> dict:
     text = (text or "").strip()
     if not text:
         raise ValueError("空响应")
-    try:
-        return json.loads(text)
-    except Exception:
-        pass
-    # 容错：截取第一个 { 到最后一个 }
+    # 只有以 { / [ 开头时才整体尝试解析；被 markdown 或说明文字包裹的输出直接走下面的截取
+    whole_err: Optional[ValueError] = None
+    if text[0] in "{[":
+        try:
+            return json_loads(text)
+        except ValueError as e:
+            whole_err = e
+    # 容错：截取第一个 { 到最后一个 }；若恰为整段则上面已经试过，直接抛出那次的错误
     start = text.find("{")
     end = text.rfind("}")
     if start >= 0 and end > start:
-        return json.loads(text[start : end + 1])
+        if whole_err is not None and start == 0 and end == len(text) - 1:
+            raise whole_err
+        return json_loads(text[start : end + 1])
     raise ValueError("无法解析 JSON")
 
 
+def _has_complete_plan(text: str) -> bool:
+    """流式接收中判断无工具模式的 JSON 是否已完整：与 _extract_json 同样取第一个 { 到最后一个 }，严格解析为对象即可。"""
+    start = text.find("{")
+    end = text.rfind("}")
+    if start < 0 or end < start:
+        return False
+    try:
+        return isinstance(json_loads(text[start : end + 1]), dict)
+    except ValueError:
+        return False
+
+
 _DANGEROUS_PATTERNS = [
     r"\brm\b.*\s-rf\b",
     r"\bmkfs(\.|)\b",
@@ -72,16 +96,19 @@ _DANGEROUS_PATTERNS = [
     r">\s*/dev/sd[a-z]\b",
     r"\b:\s*>\s*/\b",
 ]
+# 各模式合成一个不区分大小写的交替正则，模块加载时编译一次，每条命令只扫一遍
+_DANGEROUS_RE = re.compile("|".join(f"(?:{p})" for p in _DANGEROUS_PATTERNS), re.IGNORECASE)
 
 
 def _looks_dangerous_command(cmd: str) -> bool:
-    s = (cmd or "").strip().lower()
+    s = (cmd or "").strip()
     if not s:
         return True
-    for pat in _DANGEROUS_PATTERNS:
-        if re.search(pat, s):
-            return True
-    return False
+    # 纯 ASCII 命令（绝大多数）由 IGNORECASE 处理大小写，不必 lower() 复制一份；
+    # 含非 ASCII 字符时仍先 lower()，如 "İ" 小写后会多出组合符，影响 \b 判定，须与原先逐条匹配的结果一致
+    if not s.isascii():
+        s = s.lower()
+    return _DANGEROUS_RE.search(s) is not None
 
 
 # 模型在会话延续时有时会反复执行「echo "你上一条指令是：..."」等复述类命令，拦截后直接返回提示，避免多轮无效执行
@@ -106,6 +133,24 @@ def _is_echo_restate_command(cmd: str) -> bool:
     return False
 
 
+# 「全部/所有」类与部署类关键词各合成一个交替正则，模块加载时编译一次，每条指令只扫一遍
+_ALL_ASSETS_RE = re.compile("全部|所有|每台")
+_ALL_SERVERS_RE = re.compile("所有服务器|全部服务器|检查所有|所有主机|每台|全部主机|所有资产")
+_DEPLOY_INTENT_RE = re.compile("部署|安装|upgrade|install|nginx")
+_ALL_SERVERS_PREFIX = (
+    "【用户要求检查/操作「所有」或「全部」服务器。请先 list_assets，然后对返回的**每一台**资产依次执行相应命令，不要遗漏任何一台，再输出 final 总结。】\n\n"
+)
+
+
+@lru_cache(maxsize=64)
+def _asset_scope_prefix(asset_names: tuple[str, ...]) -> str:
+    """界面选定资产时加在用户指令前的说明；同一组资产反复下发指令时直接复用。"""
+    return (
+        "【本次指定运维对象：仅限以下资产：" + "、".join(asset_names) + "。"
+        "用户已在界面选定资产，请直接对上述资产调用 execute_command 执行用户指令，不要回复「请指定要操作的资产名称」，也不要仅用文字描述将要执行的操作而不调用 execute_command。】\n\n"
+    )
+
+
 def _resolve_target_assets(config: AppConfig, instruction: str) -> tuple[Optional[list[str]], bool]:
     """
     返回 (资产列表 or None, 是否明确指定)：
@@ -117,7 +162,7 @@ def _resolve_target_assets(config: AppConfig, instruction: str) -> tuple[Optiona
     if not asset_names:
         return [], True
 
-    if any(k in instruction for k in ("全部", "所有", "每台")):
+    if _ALL_ASSETS_RE.search(instruction):
         return asset_names, True
 
     mentioned = [name for name in asset_names if name in instruction]
@@ -128,8 +173,91 @@ def _resolve_target_assets(config: AppConfig, instruction: str) -> tuple[Optiona
     return None, False
 
 
+# 可短时复用结果的只读探测命令：整条命令为下列之一（可带参数），且不含管道、重定向、命令拼接或替换。
+# 分隔只认行内空白（[^\S\r\n]），换行会让 shell 接着执行下一条命令，见 _is_readonly_probe
+_READONLY_PROBE_RE = re.compile(
+    r"(?:df|free|uptime|uname|getent|id|lsblk|nproc|systemctl[^\S\r\n]+status"
+    r"|cat[^\S\r\n]+/proc/[^\s|;&<>`$()\\]+)"
+    r"(?:[^\S\r\n]+[^|;&<>`$()\\\r\n]*)?"
+)
+# 只读探测结果的缓存有效期（秒）
+_PROBE_CACHE_TTL = 5.0
+
+
+def _is_readonly_probe(command: str) -> bool:
+    """command（已 strip）是否为可缓存结果的单行只读探测；多行命令一律不算。"""
+    if "\n" in command or "\r" in command:
+        return False
+    return _READONLY_PROBE_RE.fullmatch(command) is not None
+
+
+# 自研 Agent 的 execute_command_batch：多台资产上的命令在此线程池中并发执行
+_BATCH_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ai-ops-batch")
+
 # 无工具模式多轮对话最大轮数，防止死循环
 _NO_TOOLS_MAX_ROUNDS = 30
+# 无工具模式逐轮记录最多保留 2 * _NO_TOOLS_KEEP_LAST 条，超出时把较早的折叠进一条历史摘要，只保留最近 _NO_TOOLS_KEEP_LAST 条原文
+_NO_TOOLS_KEEP_LAST = 6
+_HISTORY_SUMMARY_HEAD = "【历史摘要】以下为较早轮次的执行记录（每条已截断）：\n\n"
+_HISTORY_ITEM_MAX_CHARS = 500
+# 无工具模式计划 JSON 的 Schema（no_tools_json_schema 开启时作为 response_format 发送）：一条命令，或 done + 结论
+_NO_TOOLS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "NoToolsPlan",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "commands": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"command": {"type": "string"}, "purpose": {"type": "string"}},
+                        "required": ["command"],
+                    },
+                },
+                "done": {"type": "boolean"},
+                "conclusion": {"type": "string"},
+            },
+            "anyOf": [{"required": ["commands"]}, {"required": ["done", "conclusion"]}],
+        },
+    },
+}
+
+# 无工具模式的 system 只有两种（部署/只读），模块加载时拼好；资产与指令等动态内容只放在其后的 user 消息里，
+# 同一模式下每次请求的 system 前缀逐字相同，便于服务端前缀缓存命中
+_NO_TOOLS_SYSTEM_BASE = (
+    "你是一个专业的 Linux 运维助手。你只能输出 JSON，不要输出 markdown 或其它文字。\n"
+    "根据用户指令和已执行命令的结果，每次只做以下两种之一：\n"
+    "1) 需要继续执行：输出 {\"commands\":[{\"command\":\"<一条 shell 命令>\",\"purpose\":\"<目的>\"}]}，每次只给一条命令。\n"
+    "2) 可以结束：输出 {\"done\":true,\"conclusion\":\"<用中文给出最终结论与建议>\"}。\n"
+    "禁止危险命令：rm -rf、mkfs、dd、shutdown、覆盖磁盘等。命令必须非交互式。\n"
+)
+_NO_TOOLS_SYSTEM_DEPLOY = (
+    _NO_TOOLS_SYSTEM_BASE
+    + "本次是【部署/安装】意图：允许 apt/yum/dnf、systemctl 等，并根据结果继续排查直到成功或明确失败。\n"
+)
+_NO_TOOLS_SYSTEM_READONLY = (
+    _NO_TOOLS_SYSTEM_BASE
+    + "本次是【巡检/只读】意图：尽量只用只读命令（df、free、ps、journalctl 等）。\n"
+)
+
+
+def _compact_no_tools_history(messages: list[dict], keep_last: int = _NO_TOOLS_KEEP_LAST) -> None:
+    """
+    原地压缩无工具模式的 messages，使每轮请求的长度不随轮数无限增长：
+    messages[0] 为 system、[1] 为首条 user（目标资产与指令）原样保留；其后的逐轮记录超过 2 * keep_last 条时，
+    把除最近 keep_last 条以外的各条截断后并入 [2] 处的历史摘要。成批折叠，两次折叠之间请求前缀保持不变。
+    """
+    head = 3 if len(messages) > 2 and messages[2]["content"].startswith(_HISTORY_SUMMARY_HEAD) else 2
+    if len(messages) - head <= keep_last * 2:
+        return
+    folded = "\n\n".join(
+        c if len(c) <= _HISTORY_ITEM_MAX_CHARS else c[:_HISTORY_ITEM_MAX_CHARS] + "…(已截断)"
+        for c in (m["content"] for m in messages[head:-keep_last])
+    )
+    prev = messages[2]["content"] + "\n\n" if head == 3 else _HISTORY_SUMMARY_HEAD
+    messages[2:-keep_last] = [{"role": "user", "content": prev + folded}]
 
 
 def _run_no_tools_mode(
@@ -170,20 +298,9 @@ def _run_no_tools_mode(
         logger.warning("无工具模式: 未找到资产 %s", asset_name)
         return f"未找到资产 '{asset_name}'。可用资产：\n{list_assets_display(config)}"
 
-    is_deploy_intent = any(k in (user_instruction or "") for k in ("部署", "安装", "upgrade", "install", "nginx"))
-
-    system_content = (
-        "你是一个专业的 Linux 运维助手。你只能输出 JSON，不要输出 markdown 或其它文字。\n"
-        "根据用户指令和已执行命令的结果，每次只做以下两种之一：\n"
-        "1) 需要继续执行：输出 {\"commands\":[{\"command\":\"<一条 shell 命令>\",\"purpose\":\"<目的>\"}]}，每次只给一条命令。\n"
-        "2) 可以结束：输出 {\"done\":true,\"conclusion\":\"<用中文给出最终结论与建议>\"}。\n"
-        "禁止危险命令：rm -rf、mkfs、dd、shutdown、覆盖磁盘等。命令必须非交互式。\n"
-        + (
-            "本次是【部署/安装】意图：允许 apt/yum/dnf、systemctl 等，并根据结果继续排查直到成功或明确失败。\n"
-            if is_deploy_intent
-            else "本次是【巡检/只读】意图：尽量只用只读命令（df、free、ps、journalctl 等）。\n"
-        )
-    )
+    is_deploy_intent = _DEPLOY_INTENT_RE.search(user_instruction or "") is not None
+
+    system_content = _NO_TOOLS_SYSTEM_DEPLOY if is_deploy_intent else _NO_TOOLS_SYSTEM_READONLY
 
     first_user = (
         f"目标资产：{asset.get_display()}\n"
@@ -197,14 +314,35 @@ def _run_no_tools_mode(
         {"role": "user", "content": first_user},
     ]
 
+    response_format = _NO_TOOLS_RESPONSE_FORMAT if getattr(config.deepseek, "no_tools_json_schema", False) else None
+
+    def _ask_plan() -> str:
+        # 流式接收，计划 JSON 一闭合即停止并执行命令，不等模型把 JSON 之后的多余文字生成完
+        nonlocal response_format
+        try:
+            return chat_once_stream(
+                client, model, messages, max_tokens=1024, stop_when=_has_complete_plan, response_format=response_format
+            )
+        except Exception as e:
+            err_str = str(e)
+            # 接口不认识 response_format / json_schema 时（常见为 400 或 “Extra inputs are not permitted”），本次运行改回普通请求
+            if response_format is None or not (
+                "response_format" in err_str or "json_schema" in err_str or "Extra inputs are not permitted" in err_str
+            ):
+                raise
+            logger.warning("无工具模式: 接口不支持 response_format，改用普通请求 err=%s", err_str[:200])
+            response_format = None
+            return chat_once_stream(client, model, messages, max_tokens=1024, stop_when=_has_complete_plan)
+
     for round_index in range(_NO_TOOLS_MAX_ROUNDS):
         if cancel_event and cancel_event.is_set():
             return "已按用户请求停止。"
         logger.info("无工具模式: 第 %s 轮请求模型", round_index + 1)
-        plan_text = chat_once(client, model, messages, max_tokens=1024)
+        _compact_no_tools_history(messages)
+        plan_text = _ask_plan()
         if not (plan_text or "").strip():
             logger.warning("无工具模式: 第 %s 轮模型返回空，重试一次", round_index + 1)
-            plan_text = chat_once(client, model, messages, max_tokens=1024)
+            plan_text = _ask_plan()
         logger.info("无工具模式: 第 %s 轮回复长度=%s", round_index + 1, len(plan_text or ""))
         if plan_text:
             logger.info("无工具模式: 第 %s 轮模型输出: %s", round_index + 1, (plan_text.strip()[:500] + ("..." if len(plan_text) > 500 else "")))
@@ -319,6 +457,31 @@ def run_instruction(
         {"type": "function", "function": EXECUTE_COMMAND_SCHEMA["function"]},
     ]
 
+    # 只读探测命令（df、free、uname 等）的短时结果缓存，仅本次 run 内有效，各模式的 execute_command 共用：
+    # 模型常在相邻几轮或重试时重复同一探测，命中时不再走 SSH。同一资产上执行了其他命令（可能改变状态）时丢弃该资产的缓存
+    probe_cache: dict[tuple[str, str], tuple[float, str]] = {}
+    probe_lock = threading.Lock()
+
+    def _probe_lookup(asset_name: str, command: str) -> str | None:
+        """返回未过期的缓存结果；非只读命令则清掉该资产的缓存并返回 None。查找与写入都以 strip 后的命令为键。"""
+        command = command.strip()
+        with probe_lock:
+            if not _is_readonly_probe(command):
+                for k in [k for k in probe_cache if k[0] == asset_name]:
+                    del probe_cache[k]
+                return None
+            hit = probe_cache.get((asset_name, command))
+            if hit and time.monotonic() - hit[0] < _PROBE_CACHE_TTL:
+                return hit[1]
+            return None
+
+    def _probe_store(asset_name: str, command: str, result: str) -> None:
+        command = command.strip()
+        if not _is_readonly_probe(command):
+            return
+        with probe_lock:
+            probe_cache[(asset_name, command)] = (time.monotonic(), result)
+
     def list_assets() -> str:
         logger.info("%s调用 list_assets()", (f"[{trace_id}] " if trace_id else ""))
         return list_assets_display(config)
@@ -334,9 +497,15 @@ def run_instruction(
         asset = get_asset_by_name(config, asset_name)
         if not asset:
             return f"未找到资产 '{asset_name}'。可用资产：\n{list_assets_display(config)}"
+        cached = _probe_lookup(asset_name, command)
         if on_command_start:
             on_command_start(asset_name, command, getattr(asset, "host", None))
-        result = execute_on_asset(asset, command)
+        if cached is not None:
+            logger.info("%s只读探测命中缓存 asset=%s cmd=%r", (f"[{trace_id}] " if trace_id else ""), asset_name, command)
+            result = cached
+        else:
+            result = execute_on_asset(asset, command)
+            _probe_store(asset_name, command, result)
         if on_command:
             on_command(asset_name, command, result, getattr(asset, "host", None))
         logger.info("%sexecute_command 完成 asset=%s cmd=%r result_len=%s", (f"[{trace_id}] " if trace_id else ""), asset_name, command, len(result or ""))
@@ -349,27 +518,18 @@ def run_instruction(
 
     effective_instruction = user_instruction
     if asset_names:
-        prefix = (
-            "【本次指定运维对象：仅限以下资产：" + "、".join(asset_names) + "。"
-            "用户已在界面选定资产，请直接对上述资产调用 execute_command 执行用户指令，不要回复「请指定要操作的资产名称」，也不要仅用文字描述将要执行的操作而不调用 execute_command。】\n\n"
-        )
-        effective_instruction = prefix + user_instruction
+        effective_instruction = _asset_scope_prefix(tuple(asset_names)) + user_instruction
     else:
         # 用户未选资产且指令含「所有/全部」时，要求对 list_assets 返回的每台资产都执行，不要遗漏
-        if any(
-            k in (user_instruction or "")
-            for k in ("所有服务器", "全部服务器", "检查所有", "所有主机", "每台", "全部主机", "所有资产")
-        ):
-            prefix = (
-                "【用户要求检查/操作「所有」或「全部」服务器。请先 list_assets，然后对返回的**每一台**资产依次执行相应命令，不要遗漏任何一台，再输出 final 总结。】\n\n"
-            )
-            effective_instruction = prefix + user_instruction
+        if _ALL_SERVERS_RE.search(user_instruction or ""):
+            effective_instruction = _ALL_SERVERS_PREFIX + user_instruction
 
-    system_content = SYSTEM_PROMPT
-    if getattr(config.deepseek, "use_prompt_tools", False):
-        system_content = SYSTEM_PROMPT + PROMPT_TOOLS_INSTRUCTION
     if getattr(config.deepseek, "use_self_coded_fc", False):
         system_content = SELF_CODED_SYSTEM
+    elif getattr(config.deepseek, "use_prompt_tools", False):
+        system_content = PROMPT_TOOLS_SYSTEM
+    else:
+        system_content = SYSTEM_PROMPT
     if initial_messages:
         messages = list(initial_messages)
     else:
@@ -378,25 +538,28 @@ def run_instruction(
             {"role": "user", "content": effective_instruction},
         ]
 
-    def _write_interaction(path: Path, line: str) -> None:
+    # 交互日志在本次 run_instruction 内只打开一次、缓冲写入，结束时统一 flush 并关闭，避免每轮重复 open/close
+    log_fh = None
+
+    def _write_interaction(line: str) -> None:
+        if log_fh is None:
+            return
         try:
-            path.parent.mkdir(parents=True, exist_ok=True)
-            with path.open("a", encoding="utf-8") as f:
-                f.write(line)
+            log_fh.write(line)
         except Exception as e:
-            logger.warning("写入交互日志失败 path=%s err=%s", path, e)
+            logger.warning("写入交互日志失败 path=%s err=%s", interaction_log_path, e)
 
     on_turn = None
     if interaction_log_path:
         try:
             interaction_log_path.parent.mkdir(parents=True, exist_ok=True)
-            with interaction_log_path.open("w", encoding="utf-8") as f:
-                f.write(f"=== trace_id: {trace_id or '-'} ===\n")
-                f.write(f"=== 用户指令 ===\n{effective_instruction}\n\n")
-                f.write("--- system (前 500 字) ---\n")
-                f.write((system_content or "")[:500] + "\n\n")
-                f.write("--- user (首条) ---\n")
-                f.write(effective_instruction + "\n\n")
+            log_fh = interaction_log_path.open("w", encoding="utf-8", buffering=64 * 1024)
+            log_fh.write(f"=== trace_id: {trace_id or '-'} ===\n")
+            log_fh.write(f"=== 用户指令 ===\n{effective_instruction}\n\n")
+            log_fh.write("--- system (前 500 字) ---\n")
+            log_fh.write((system_content or "")[:500] + "\n\n")
+            log_fh.write("--- user (首条) ---\n")
+            log_fh.write(effective_instruction + "\n\n")
         except Exception as e:
             logger.warning("写入交互日志头失败 path=%s err=%s", interaction_log_path, e)
         else:
@@ -404,148 +567,185 @@ def run_instruction(
                 body = (content or "").strip()
                 if role == "assistant" and not body:
                     body = "(模型返回为空)"
-                _write_interaction(interaction_log_path, f"--- {role} ---\n{body or ''}\n\n")
+                _write_interaction(f"--- {role} ---\n{body or ''}\n\n")
 
-    if getattr(config.deepseek, "use_self_coded_fc", False):
-        use_mcp = getattr(config.deepseek, "use_mcp_for_tools", False)
-        mcp_url = (getattr(config.deepseek, "mcp_tool_url", None) or "").strip()
-        if use_mcp and mcp_url:
-            logger.info("%s使用自研 Agent + MCP 工具执行（%s）", (f"[{trace_id}] " if trace_id else ""), mcp_url)
-        else:
-            logger.info("%s使用自研 Agent（纯 JSON action 调度）", (f"[{trace_id}] " if trace_id else ""))
-
-        # 注入给模型的 tool_result 最大长度，避免 4w+ 字输出淹没上下文导致模型不输出 action（DeepSeek R1 等）
-        _TOOL_RESULT_MAX_CHARS = 12_000
-
-        def _wrap_tool_result(text: str, asset: str | None = None) -> str:
-            """用 <tool_result> 包裹；可选 asset 便于多机汇总时按资产区分，避免模型混淆。"""
-            s = text or "(无输出)"
-            if len(s) > _TOOL_RESULT_MAX_CHARS:
-                s = (
-                    s[:_TOOL_RESULT_MAX_CHARS]
-                    + f"\n\n(以上为命令输出前 {_TOOL_RESULT_MAX_CHARS} 字，已截断；完整共 {len(text)} 字。请根据上述信息输出下一个 action：继续执行命令或 final 总结。)"
-                )
-            if asset:
-                return f"<tool_result asset=\"{asset}\">\n{s}\n</tool_result>"
-            return f"<tool_result>\n{s}\n</tool_result>"
-
-        def dispatch(action: dict) -> tuple[str, bool]:
-            act = (action.get("action") or "").strip()
-            if act == "list_assets":
-                if use_mcp and mcp_url:
-                    result = _call_mcp_tool(mcp_url, "list_assets", {}, timeout=30)
-                    return _wrap_tool_result(result), False
-                return _wrap_tool_result(list_assets_display(config)), False
-            if act == "execute_command":
+    try:
+        if getattr(config.deepseek, "use_self_coded_fc", False):
+            use_mcp = getattr(config.deepseek, "use_mcp_for_tools", False)
+            mcp_url = (getattr(config.deepseek, "mcp_tool_url", None) or "").strip()
+            if use_mcp and mcp_url:
+                logger.info("%s使用自研 Agent + MCP 工具执行（%s）", (f"[{trace_id}] " if trace_id else ""), mcp_url)
+            else:
+                logger.info("%s使用自研 Agent（纯 JSON action 调度）", (f"[{trace_id}] " if trace_id else ""))
+
+            # 注入给模型的 tool_result 最大长度，避免 4w+ 字输出淹没上下文导致模型不输出 action（DeepSeek R1 等）
+            _TOOL_RESULT_MAX_CHARS = 12_000
+
+            def _wrap_tool_result(text: str, asset: str | None = None) -> str:
+                """用 <tool_result> 包裹；可选 asset 便于多机汇总时按资产区分，避免模型混淆。"""
+                s = text or "(无输出)"
+                if len(s) > _TOOL_RESULT_MAX_CHARS:
+                    s = (
+                        s[:_TOOL_RESULT_MAX_CHARS]
+                        + f"\n\n(以上为命令输出前 {_TOOL_RESULT_MAX_CHARS} 字，已截断；完整共 {len(text)} 字。请根据上述信息输出下一个 action：继续执行命令或 final 总结。)"
+                    )
+                if asset:
+                    return f"<tool_result asset=\"{asset}\">\n{s}\n</tool_result>"
+                return f"<tool_result>\n{s}\n</tool_result>"
+
+            def _run_command(asset_name: str, command: str) -> str:
+                """执行单条命令，返回 <tool_result> 包裹的结果或提示；批量 action 中各条在线程池里并发调用。"""
                 if cancel_event and cancel_event.is_set():
-                    return "已按用户请求停止。", True
-                asset_name = (action.get("asset") or "").strip()
-                command = (action.get("command") or "").strip()
+                    return _wrap_tool_result("已按用户请求停止。", asset=asset_name or None)
                 # 模型在 JSON 中用 \n 表示换行，解析后为字面量 \\n，需转为真实换行再执行
                 command = command.replace("\\n", "\n").replace("\\t", "\t")
                 if not asset_name or not command:
-                    return _wrap_tool_result("action execute_command 缺少 asset 或 command。"), False
+                    return _wrap_tool_result("action execute_command 缺少 asset 或 command。")
                 # 拦截占位符，避免首轮误发「资产名称」「shell 命令」导致未找到资产
                 if asset_name == "资产名称" or command.strip() == "shell 命令":
                     return _wrap_tool_result(
                         "请使用用户已选定的资产名称（如 linux_222）和具体命令（如 getent passwd），不要使用占位符「资产名称」「shell 命令」。"
-                    ), False
+                    )
                 # 拦截「echo 复述用户指令」类命令，避免会话延续时模型多轮无效执行
                 if _is_echo_restate_command(command):
                     logger.warning("%s拦截复述类 echo 命令 cmd=%r", (f"[{trace_id}] " if trace_id else ""), command[:80])
                     return _wrap_tool_result(
                         "请不要执行仅用于复述用户指令的 echo 命令。请直接执行实际运维命令（如 df -h、free、ps 等）完成用户需求，或若已具备足够信息则输出 {\"action\": \"final\", \"message\": \"总结\"} 结束。"
-                    ), False
-                if use_mcp and mcp_url:
-                    _asset = get_asset_by_name(config, asset_name)
-                    _host = getattr(_asset, "host", None) if _asset else None
-                    if on_command_start:
-                        on_command_start(asset_name, command, _host)
-                    result = _call_mcp_tool(
-                        mcp_url, "execute_command",
-                        {"asset_name": asset_name, "command": command},
-                        timeout=120,
                     )
-                    if on_command:
-                        on_command(asset_name, command, result, _host)
-                    return _wrap_tool_result(result or "(无输出)", asset=asset_name), False
                 asset = get_asset_by_name(config, asset_name)
-                if not asset:
-                    return _wrap_tool_result(f"未找到资产 '{asset_name}'。可用资产：\n{list_assets_display(config)}"), False
+                if not asset and not (use_mcp and mcp_url):
+                    return _wrap_tool_result(f"未找到资产 '{asset_name}'。可用资产：\n{list_assets_display(config)}")
+                host = getattr(asset, "host", None) if asset else None
+                cached = _probe_lookup(asset_name, command)
                 if on_command_start:
-                    on_command_start(asset_name, command, getattr(asset, "host", None))
-                result = execute_on_asset(asset, command)
+                    on_command_start(asset_name, command, host)
+                if cached is not None:
+                    logger.info("%s只读探测命中缓存 asset=%s cmd=%r", (f"[{trace_id}] " if trace_id else ""), asset_name, command)
+                    result = cached
+                else:
+                    if use_mcp and mcp_url:
+                        result = _call_mcp_tool(
+                            mcp_url, "execute_command",
+                            {"asset_name": asset_name, "command": command},
+                            timeout=120,
+                        )
+                    else:
+                        result = execute_on_asset(asset, command)
+                    _probe_store(asset_name, command, result)
                 if on_command:
-                    on_command(asset_name, command, result, getattr(asset, "host", None))
-                return _wrap_tool_result(result or "(无输出)", asset=asset_name), False
-            if act == "final":
-                return (action.get("message") or "").strip(), True
-            return _wrap_tool_result(f"未知 action: {act}，请输出 execute_command / list_assets / final 之一。"), False
-
-        final_reply = chat_with_self_coded_fc(
-            client,
-            config.deepseek.model,
-            messages,
-            dispatch,
-            trace_id=trace_id,
-            on_turn=on_turn,
-        )
-        logger.info("%srun_instruction 完成 reply_len=%s", (f"[{trace_id}] " if trace_id else ""), len(final_reply or ""))
-        if interaction_log_path:
-            _write_interaction(interaction_log_path, f"--- final_reply ---\n{final_reply or ''}\n")
-        return final_reply, messages
-
-    if getattr(config.deepseek, "use_prompt_tools", False):
-        logger.info("%s使用提示词函数调用（不依赖 API tool_calls）", (f"[{trace_id}] " if trace_id else ""))
-        default_asset = (asset_names[0] if asset_names and len(asset_names) == 1 else None)
-        final_reply, _ = chat_with_prompt_tools(
-            client,
-            config.deepseek.model,
-            messages,
-            tool_handlers,
-            trace_id=trace_id,
-            default_asset_name=default_asset,
-            on_turn=on_turn,
-        )
-        logger.info("%srun_instruction 完成 reply_len=%s", (f"[{trace_id}] " if trace_id else ""), len(final_reply or ""))
-        if interaction_log_path:
-            _write_interaction(interaction_log_path, f"--- final_reply ---\n{final_reply or ''}\n")
-        return final_reply, messages
+                    on_command(asset_name, command, result, host)
+                return _wrap_tool_result(result or "(无输出)", asset=asset_name)
+
+            def dispatch(action: dict) -> tuple[str, bool]:
+                act = (action.get("action") or "").strip()
+                if act == "list_assets":
+                    if use_mcp and mcp_url:
+                        result = _call_mcp_tool(mcp_url, "list_assets", {}, timeout=30)
+                        return _wrap_tool_result(result), False
+                    return _wrap_tool_result(list_assets_display(config)), False
+                if act == "execute_command":
+                    if cancel_event and cancel_event.is_set():
+                        return "已按用户请求停止。", True
+                    asset_name = (action.get("asset") or "").strip()
+                    command = (action.get("command") or "").strip()
+                    return _run_command(asset_name, command), False
+                if act == "execute_command_batch":
+                    if cancel_event and cancel_event.is_set():
+                        return "已按用户请求停止。", True
+                    pairs = [
+                        (str(it.get("asset") or "").strip(), str(it.get("command") or "").strip())
+                        for it in (action.get("items") or [])
+                        if isinstance(it, dict)
+                    ]
+                    if not pairs:
+                        return _wrap_tool_result(
+                            "action execute_command_batch 缺少 items，应为 [{\"asset\": \"资产名\", \"command\": \"命令\"}, ...]。"
+                        ), False
+                    # 不同资产上的命令并发执行（SSH 往返为主要耗时）；同一资产的多条仍按原顺序串行。结果按 items 原顺序拼接
+                    groups: dict[str, list[int]] = {}
+                    for i, (asset_name, _) in enumerate(pairs):
+                        groups.setdefault(asset_name, []).append(i)
+                    results = [""] * len(pairs)
+
+                    def run_group(idxs: list[int]) -> None:
+                        for i in idxs:
+                            results[i] = _run_command(*pairs[i])
+
+                    if len(groups) == 1:
+                        run_group(list(range(len(pairs))))
+                    else:
+                        list(_BATCH_POOL.map(run_group, groups.values()))
+                    return "\n".join(results), False
+                if act == "final":
+                    return (action.get("message") or "").strip(), True
+                return _wrap_tool_result(f"未知 action: {act}，请输出 execute_command / execute_command_batch / list_assets / final 之一。"), False
+
+            final_reply = chat_with_self_coded_fc(
+                client,
+                config.deepseek.model,
+                messages,
+                dispatch,
+                trace_id=trace_id,
+                on_turn=on_turn,
+            )
+            logger.info("%srun_instruction 完成 reply_len=%s", (f"[{trace_id}] " if trace_id else ""), len(final_reply or ""))
+            _write_interaction(f"--- final_reply ---\n{final_reply or ''}\n")
+            return final_reply, messages
+
+        if getattr(config.deepseek, "use_prompt_tools", False):
+            logger.info("%s使用提示词函数调用（不依赖 API tool_calls）", (f"[{trace_id}] " if trace_id else ""))
+            default_asset = (asset_names[0] if asset_names and len(asset_names) == 1 else None)
+            final_reply, _ = chat_with_prompt_tools(
+                client,
+                config.deepseek.model,
+                messages,
+                tool_handlers,
+                trace_id=trace_id,
+                default_asset_name=default_asset,
+                on_turn=on_turn,
+            )
+            logger.info("%srun_instruction 完成 reply_len=%s", (f"[{trace_id}] " if trace_id else ""), len(final_reply or ""))
+            _write_interaction(f"--- final_reply ---\n{final_reply or ''}\n")
+            return final_reply, messages
 
-    try:
-        final_reply, messages = chat_with_tools(
-            client,
-            config.deepseek.model,
-            messages,
-            tools,
-            tool_handlers,
-            trace_id=trace_id,
-            on_turn=on_turn,
-        )
-        logger.info("%srun_instruction 完成 reply_len=%s", (f"[{trace_id}] " if trace_id else ""), len(final_reply or ""))
-        if interaction_log_path:
-            _write_interaction(interaction_log_path, f"--- final_reply ---\n{final_reply or ''}\n")
-        return final_reply, messages
-    except Exception as e:
-        err_str = str(e)
-        # Ollama 部分模型会报 “does not support tools”；vLLM 会返回 400 “Extra inputs are not permitted” (tools/tool_choice)
-        tools_unsupported = (
-            "does not support tools" in err_str
-            or ("Extra inputs are not permitted" in err_str and "tool" in err_str.lower())
-        )
-        if tools_unsupported:
-            logger.warning("%s接口不支持 tools/tool_choice，降级为无工具模式", (f"[{trace_id}] " if trace_id else ""))
-            final_reply = _run_no_tools_mode(
+        try:
+            final_reply, messages = chat_with_tools(
                 client,
                 config.deepseek.model,
-                config,
-                effective_instruction,
-                on_command=on_command,
-                on_command_start=on_command_start,
-                on_model_reply=on_model_reply,
-                cancel_event=cancel_event,
+                messages,
+                tools,
+                tool_handlers,
+                trace_id=trace_id,
+                on_turn=on_turn,
+            )
+            logger.info("%srun_instruction 完成 reply_len=%s", (f"[{trace_id}] " if trace_id else ""), len(final_reply or ""))
+            _write_interaction(f"--- final_reply ---\n{final_reply or ''}\n")
+            return final_reply, messages
+        except Exception as e:
+            err_str = str(e)
+            # Ollama 部分模型会报 “does not support tools”；vLLM 会返回 400 “Extra inputs are not permitted” (tools/tool_choice)
+            tools_unsupported = (
+                "does not support tools" in err_str
+                or ("Extra inputs are not permitted" in err_str and "tool" in err_str.lower())
             )
-            if interaction_log_path:
-                _write_interaction(interaction_log_path, "--- final_reply (无工具模式) ---\n" + (final_reply or "") + "\n")
-            return final_reply, None
-        raise
+            if tools_unsupported:
+                logger.warning("%s接口不支持 tools/tool_choice，降级为无工具模式", (f"[{trace_id}] " if trace_id else ""))
+                final_reply = _run_no_tools_mode(
+                    client,
+                    config.deepseek.model,
+                    config,
+                    effective_instruction,
+                    on_command=on_command,
+                    on_command_start=on_command_start,
+                    on_model_reply=on_model_reply,
+                    cancel_event=cancel_event,
+                )
+                _write_interaction("--- final_reply (无工具模式) ---\n" + (final_reply or "") + "\n")
+                return final_reply, None
+            raise
+    finally:
+        if log_fh is not None:
+            try:
+                log_fh.close()
+            except Exception as e:
+                logger.warning("关闭交互日志失败 path=%s err=%s", interaction_log_path, e)
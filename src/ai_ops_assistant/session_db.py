@@ -1,7 +1,6 @@
-"""会话持久化：SQLite 存储会话列表与 messages（JSON）。"""
+"""会话持久化：SQLite 存储会话列表，messages 与 turns 按条存放（JSON）。"""
 from __future__ import annotations
 
-import json
 import logging
 import os
 import sqlite3
@@ -9,11 +8,17 @@ import threading
 from pathlib import Path
 from typing import Any, Optional
 
+from .jsonutil import dumps_bytes, loads as json_loads
+from .sqlite_util import open_connection
+
 logger = logging.getLogger("ai_ops_assistant.session_db")
 
 # 默认数据库路径：项目根目录 / data / sessions.db，可通过环境变量 AI_OPS_SESSION_DB 覆盖
 _DB_PATH: Optional[str] = None
 _lock = threading.Lock()
+_local = threading.local()
+# 会话表结构版本，记在库文件的 user_version 上（资产表不使用该字段）。1：messages / turns 按条存放于独立表
+_SCHEMA_VERSION = 1
 
 
 def _get_db_path() -> str:
@@ -25,8 +30,27 @@ def _get_db_path() -> str:
     return _DB_PATH
 
 
+_dir_ready = False
+
+
 def _ensure_dir() -> None:
+    """确保数据库所在目录存在；成功一次后不再重复 mkdir。"""
+    global _dir_ready
+    if _dir_ready:
+        return
     Path(_get_db_path()).parent.mkdir(parents=True, exist_ok=True)
+    _dir_ready = True
+
+
+def _conn() -> sqlite3.Connection:
+    """返回当前线程复用的连接；首次创建时设置 PRAGMA。读不加锁（WAL 下读写互不阻塞），写仍由 _lock 串行。"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        _ensure_dir()
+        conn = open_connection(_get_db_path())
+        conn.row_factory = sqlite3.Row
+        _local.conn = conn
+    return conn
 
 
 def _message_to_dict(m: Any) -> dict:
@@ -37,21 +61,54 @@ def _message_to_dict(m: Any) -> dict:
         out = m.model_dump()
     else:
         out = dict(m) if hasattr(m, "keys") else {"role": "unknown", "content": str(m)}
-    # 确保嵌套也可序列化（如 tool_calls 里的对象）
-    return json.loads(json.dumps(out, default=str, ensure_ascii=False))
+    return out
+
 
+def _message_payload(m: Any) -> str:
+    """单条 message 的存储文本；嵌套中无法序列化的对象（如 tool_calls 里的对象）以 str 写入。"""
+    return dumps_bytes(_message_to_dict(m), default=str).decode("utf-8")
 
-def _messages_to_json(messages: list[Any]) -> str:
-    """将 messages 列表转为 JSON 字符串存储。"""
-    return json.dumps([_message_to_dict(m) for m in messages], ensure_ascii=False)
+
+def _insert_messages(conn: sqlite3.Connection, session_id: str, messages: list[Any], start: int) -> None:
+    """把 messages[start:] 逐条写入 session_messages，seq 即其在 messages 中的下标。"""
+    conn.executemany(
+        "INSERT INTO session_messages (session_id, seq, payload) VALUES (?, ?, ?)",
+        (
+            (session_id, i, _message_payload(m))
+            for i, m in enumerate(messages[start:], start)
+        ),
+    )
+
+
+def _insert_turn(conn: sqlite3.Connection, session_id: str, turn: dict[str, Any]) -> None:
+    """在该会话 turns 末尾追加一轮。"""
+    conn.execute(
+        "INSERT INTO session_turns (session_id, seq, payload)"
+        " SELECT ?, COALESCE(MAX(seq), -1) + 1, ? FROM session_turns WHERE session_id = ?",
+        (session_id, dumps_bytes(turn, default=str).decode("utf-8"), session_id),
+    )
+
+
+def _load_rows_as_list(conn: sqlite3.Connection, table: str, session_id: str) -> list[Any]:
+    """按 seq 读出某会话在 session_messages / session_turns 中的各条，拼成一个 JSON 数组一次解析。"""
+    rows = conn.execute(
+        f"SELECT payload FROM {table} WHERE session_id = ? ORDER BY seq", (session_id,)
+    ).fetchall()
+    if not rows:
+        return []
+    return json_loads("[" + ",".join(r[0] for r in rows) + "]")
 
 
 def init_db() -> None:
     """创建会话表（若不存在），并确保有 turns 列（聊天式轮次）。"""
     _ensure_dir()
     with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        try:
+        conn = _conn()
+        # 切换日志模式不能在事务内进行，先于建表事务执行
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            # 显式开启事务：sqlite3 模块不会为 DDL 自动开启事务，否则建表与补列各自提交一次
+            conn.execute("BEGIN")
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS sessions (
@@ -69,61 +126,91 @@ def init_db() -> None:
             cols = [row[1] for row in cur.fetchall()]
             if "turns" not in cols:
                 conn.execute("ALTER TABLE sessions ADD COLUMN turns TEXT NOT NULL DEFAULT '[]'")
-            conn.commit()
-        finally:
-            conn.close()
+            # messages 与 turns 按条存放、只追加：每轮只写入新增的几条，不再整段重写会话的历史 JSON
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS session_messages (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                ) WITHOUT ROWID
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS session_turns (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                ) WITHOUT ROWID
+                """
+            )
+            # 兼容旧库：把 sessions.messages / sessions.turns 中的整段 JSON 拆成按条记录。只在升级后首次启动时执行一次
+            # （以 user_version 记录，与建表同一事务）；原列保持不动，回退到旧版本时仍能看到升级前的历史
+            if conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                for table, col in (("session_messages", "messages"), ("session_turns", "turns")):
+                    conn.execute(
+                        f"""
+                        INSERT OR IGNORE INTO {table} (session_id, seq, payload)
+                        SELECT s.id, j.key,
+                               CASE WHEN j.type IN ('object', 'array') THEN j.value ELSE json_quote(j.value) END
+                        FROM sessions s, json_each(CASE WHEN json_valid(s.{col}) THEN s.{col} ELSE '[]' END) j
+                        WHERE s.{col} <> '[]'
+                        """
+                    )
+                conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            # session_list 按 updated_at 倒序：有索引时按索引顺序读取，不必每次整表排序
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions(updated_at)")
     logger.info("会话数据库已初始化 path=%s", _get_db_path())
 
 
 def session_get(session_id: str) -> Optional[dict[str, Any]]:
     """按 id 获取会话，不存在返回 None。"""
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        conn.row_factory = sqlite3.Row
-        try:
-            row = conn.execute(
-                "SELECT id, title, created_at, updated_at, messages, turns FROM sessions WHERE id = ?",
-                (session_id,),
-            ).fetchone()
-            if row is None:
-                return None
-            messages = json.loads(row["messages"]) if row["messages"] else []
-            try:
-                turns = json.loads(row["turns"] or "[]")
-            except Exception:
-                turns = []
-            return {
-                "id": row["id"],
-                "title": row["title"] or "",
-                "created_at": row["created_at"],
-                "updated_at": row["updated_at"],
-                "messages": messages,
-                "turns": turns,
-            }
-        finally:
-            conn.close()
-
-
-def session_list() -> list[dict[str, Any]]:
-    """列出所有会话（不含 messages），按 updated_at 倒序。"""
-    with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        conn.row_factory = sqlite3.Row
-        try:
-            rows = conn.execute(
-                "SELECT id, title, created_at, updated_at FROM sessions ORDER BY updated_at DESC"
-            ).fetchall()
-            return [
-                {
-                    "id": r["id"],
-                    "title": r["title"] or "",
-                    "created_at": r["created_at"],
-                    "updated_at": r["updated_at"],
-                }
-                for r in rows
-            ]
-        finally:
-            conn.close()
+    conn = _conn()
+    row = conn.execute(
+        "SELECT id, title, created_at, updated_at FROM sessions WHERE id = ?",
+        (session_id,),
+    ).fetchone()
+    if row is None:
+        return None
+    messages = _load_rows_as_list(conn, "session_messages", session_id)
+    try:
+        turns = _load_rows_as_list(conn, "session_turns", session_id)
+    except Exception:
+        turns = []
+    return {
+        "id": row["id"],
+        "title": row["title"] or "",
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "messages": messages,
+        "turns": turns,
+    }
+
+
+def session_list(limit: Optional[int] = None) -> list[dict[str, Any]]:
+    """列出会话（不含 messages），按 updated_at 倒序；limit 为 None 时返回全部。"""
+    conn = _conn()
+    if limit is None:
+        rows = conn.execute(
+            "SELECT id, title, created_at, updated_at FROM sessions ORDER BY updated_at DESC"
+        ).fetchall()
+    else:
+        rows = conn.execute(
+            "SELECT id, title, created_at, updated_at FROM sessions ORDER BY updated_at DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+    return [
+        {
+            "id": r["id"],
+            "title": r["title"] or "",
+            "created_at": r["created_at"],
+            "updated_at": r["updated_at"],
+        }
+        for r in rows
+    ]
 
 
 def session_save(
@@ -135,45 +222,98 @@ def session_save(
     new_turn: Optional[dict[str, Any]] = None,
 ) -> None:
     """
-    插入或替换一条会话。
+    插入或替换一条会话：messages 整体替换，已有 turns 保留。
     new_turn: 可选，本轮聊天内容 { "user": "用户原始指令", "commands": [ { "asset_name", "command", "result" } ], "reply": "助手回复" }，会追加到 turns。
     """
     _ensure_dir()
-    messages_json = _messages_to_json(messages)
-    existing = session_get(session_id)
-    if new_turn is not None:
-        turns = list(existing["turns"]) if existing else []
-        turns.append(new_turn)
-        turns_json = json.dumps(turns, ensure_ascii=False)
-    else:
-        turns_json = json.dumps(existing.get("turns", []), ensure_ascii=False) if existing else "[]"
     with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        try:
+        conn = _conn()
+        with conn:
             conn.execute(
                 """
                 INSERT INTO sessions (id, title, created_at, updated_at, messages, turns)
-                VALUES (?, ?, ?, ?, ?, ?)
+                VALUES (?, ?, ?, ?, '[]', '[]')
                 ON CONFLICT(id) DO UPDATE SET
                     title = excluded.title,
-                    updated_at = excluded.updated_at,
-                    messages = excluded.messages,
-                    turns = excluded.turns
+                    updated_at = excluded.updated_at
                 """,
-                (session_id, title, created_at, updated_at, messages_json, turns_json),
+                (session_id, title, created_at, updated_at),
             )
-            conn.commit()
-        finally:
-            conn.close()
+            conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            _insert_messages(conn, session_id, messages, 0)
+            if new_turn is not None:
+                _insert_turn(conn, session_id, new_turn)
+
+
+def session_create(
+    session_id: str,
+    title: str,
+    created_at: str,
+    updated_at: str,
+    messages: list[Any],
+    new_turn: Optional[dict[str, Any]] = None,
+) -> bool:
+    """
+    新建一条会话并写入 messages 与可选的 new_turn（格式同 session_save）。
+    以普通 INSERT 写入：id 已存在时不覆盖已有会话，返回 False；新建成功返回 True。
+    """
+    _ensure_dir()
+    with _lock:
+        conn = _conn()
+        try:
+            with conn:
+                conn.execute(
+                    """
+                    INSERT INTO sessions (id, title, created_at, updated_at, messages, turns)
+                    VALUES (?, ?, ?, ?, '[]', '[]')
+                    """,
+                    (session_id, title, created_at, updated_at),
+                )
+                _insert_messages(conn, session_id, messages, 0)
+                if new_turn is not None:
+                    _insert_turn(conn, session_id, new_turn)
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+
+def session_append_turn(
+    session_id: str,
+    updated_at: str,
+    messages: list[Any],
+    new_turn: dict[str, Any],
+    base_len: int,
+) -> bool:
+    """
+    在已有会话上追加一轮：更新 updated_at，只写入 messages[base_len:]，并追加 new_turn。
+    base_len 为本轮开始时读到的历史条数（messages 以该历史为前缀）。若库中条数已不等于 base_len
+    （同一会话的另一轮先保存了），或 messages 比已保存的还短，则整体替换 messages，
+    避免把两轮的消息拼接成 tool 消息前缺少对应 tool_calls 的非法历史。
+    返回是否更新了记录；会话不存在时返回 False，由调用方改用 session_create 新建。
+    """
+    with _lock:
+        conn = _conn()
+        with conn:
+            cur = conn.execute("UPDATE sessions SET updated_at = ? WHERE id = ?", (updated_at, session_id))
+            if cur.rowcount == 0:
+                return False
+            saved = conn.execute(
+                "SELECT COALESCE(MAX(seq), -1) + 1 FROM session_messages WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            if saved != base_len or len(messages) < saved:
+                conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+                saved = 0
+            _insert_messages(conn, session_id, messages, saved)
+            _insert_turn(conn, session_id, new_turn)
+            return True
 
 
 def session_delete(session_id: str) -> bool:
     """删除会话，返回是否删除了记录。"""
     with _lock:
-        conn = sqlite3.connect(_get_db_path())
-        try:
+        conn = _conn()
+        with conn:
             cur = conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
-            conn.commit()
+            conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM session_turns WHERE session_id = ?", (session_id,))
             return cur.rowcount > 0
-        finally:
-            conn.close()
@@ -0,0 +1,45 @@
+"""SQLite 连接公共设置：asset_db 与 session_db 共用同一库文件，连接的创建、PRAGMA 与进程退出时的关闭集中在此。"""
+from __future__ import annotations
+
+import atexit
+import sqlite3
+import weakref
+
+# 连接级设置，每个连接创建时执行一次。journal_mode=WAL 持久化在库文件上，只在各模块的 init_db 中设置：
+# WAL 下读不阻塞写、写不阻塞读，synchronous=NORMAL 在 WAL 下仍保证崩溃一致性，且提交时少一次 fsync
+_PRAGMAS = """
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-10000;
+PRAGMA mmap_size=268435456;
+PRAGMA busy_timeout=5000;
+"""
+
+# 每个连接的预编译语句缓存容量（按 SQL 文本命中）；两个模块的常用语句均为模块级常量，按字段组合拼出的变体也不多
+_STATEMENT_CACHE_SIZE = 256
+
+
+class _Connection(sqlite3.Connection):
+    """sqlite3.Connection 本身不支持弱引用；子类化后可登记到 _open_conns。"""
+
+
+# 各线程创建的连接：线程退出后连接随 threading.local 释放并自动移出；进程退出时关闭仍存活的连接，
+# 最后一个连接关闭时 SQLite 会做 checkpoint 并清理 -wal 文件
+_open_conns: "weakref.WeakSet[_Connection]" = weakref.WeakSet()
+
+
+@atexit.register
+def _close_conns() -> None:
+    for conn in list(_open_conns):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+def open_connection(path: str) -> sqlite3.Connection:
+    """打开一个设置好连接级 PRAGMA 的连接（允许跨线程使用），并登记以便进程退出时关闭。"""
+    conn = sqlite3.connect(path, check_same_thread=False, factory=_Connection, cached_statements=_STATEMENT_CACHE_SIZE)
+    conn.executescript(_PRAGMAS)
+    _open_conns.add(conn)
+    return conn
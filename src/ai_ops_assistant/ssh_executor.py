@@ -1,30 +1,85 @@
 """在 Linux 资产上通过 SSH 执行命令。优先 paramiko，不可用时回退到系统 ssh 命令（如 Windows OpenSSH）。"""
+import atexit
 import logging
+import os
+import re
+import select
+import shutil
+import socket
+import stat
 import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Optional
 
 from .config import AssetConfig, AppConfig
 
 logger = logging.getLogger("ai_ops_assistant.ssh")
 
-_paramiko_available = False
+# paramiko 在首次需要 SSH 时才导入（见 _get_paramiko）；_paramiko_tried 之后 _paramiko 为模块或 None
 _paramiko = None
+_paramiko_tried = False
+_paramiko_lock = threading.Lock()
 
-try:
-    import paramiko as _paramiko
-    _paramiko_available = True
-except Exception:
-    # ImportError（缺库）或加载 cryptography 失败等，均回退到系统 ssh
-    pass
 
+def _get_paramiko():
+    """返回 paramiko 模块，不可用时返回 None。导入会连带加载 cryptography（数十毫秒），
+    只列资产、不连 SSH 的场景不必付这笔启动开销；进程内只尝试一次。"""
+    global _paramiko, _paramiko_tried
+    if not _paramiko_tried:
+        with _paramiko_lock:
+            if not _paramiko_tried:
+                try:
+                    import paramiko
 
+                    _paramiko = paramiko
+                except Exception:
+                    # ImportError（缺库）或加载 cryptography 失败等，均回退到系统 ssh
+                    pass
+                _paramiko_tried = True
+    return _paramiko
+
+
+# 流式上传每次读取的块大小与 SFTP 通道窗口：窗口与读块对齐，保证流水线写请求不被窗口卡住
+_UPLOAD_CHUNK = 4 * 1024 * 1024
+_SFTP_WINDOW_SIZE = 4 * 1024 * 1024
+_SFTP_MAX_PACKET_SIZE = 32768
+# exec 等通道的接收窗口（paramiko 默认 2 MiB）：高延迟链路上吞吐受「窗口 / RTT」限制，放大以免大输出被窗口卡住
+_SSH_WINDOW_SIZE = 64 * 1024 * 1024
+# 读取命令输出时每次 recv 的大小
+_RECV_SIZE = 64 * 1024
+# 日志里命令文本最多保留的字符数（长脚本只记开头）
+_LOG_CMD_MAX = 256
+
+
+@lru_cache(maxsize=256)
 def _resolve_key_path(path: str) -> Path:
+    """资产的私钥路径运行期不变，缓存 resolve() 结果，避免每次执行都逐级 stat。"""
     return Path(path).expanduser().resolve()
 
 
+# 已确认存在的私钥：path -> 解析后的绝对路径。只缓存存在的结果，之后补上的密钥文件下次调用即可生效
+_existing_keys: dict[str, str] = {}
+
+
+def _existing_key_path(path: str) -> Optional[str]:
+    """私钥文件存在时返回其绝对路径字符串，否则 None；供 ssh/scp 回退路径拼 -i 参数。"""
+    key_path = _existing_keys.get(path)
+    if key_path is None:
+        p = _resolve_key_path(path)
+        if not p.exists():
+            return None
+        key_path = _existing_keys[path] = str(p)
+    return key_path
+
+
+@lru_cache(maxsize=1)
 def _sshpass_available() -> bool:
-    """检查系统是否有 sshpass（用于密码认证）。"""
+    """检查系统是否有 sshpass（用于密码认证）。进程内只探测一次；安装 sshpass 后需重启服务或调用 cache_clear()。"""
     try:
         subprocess.run(
             ["sshpass", "-V"],
@@ -36,29 +91,208 @@ def _sshpass_available() -> bool:
         return False
 
 
+def _connect_paramiko(asset: AssetConfig, timeout: int):
+    """建立 paramiko SSH 连接并返回 SSHClient；资产未配置 password 或 private_key_path 时返回 None。
+    自建 socket 以关闭 Nagle（交互式的小包请求不再等待合并），并放大之后打开的通道窗口。"""
+    connect_kw: dict = {
+        "hostname": asset.host,
+        "port": asset.port,
+        "username": asset.username,
+        "timeout": timeout,
+    }
+    if asset.password:
+        connect_kw["password"] = asset.password
+    elif asset.private_key_path:
+        connect_kw["key_filename"] = str(_resolve_key_path(asset.private_key_path))
+    else:
+        return None
+    sock = socket.create_connection((asset.host, asset.port), timeout=timeout)
+    paramiko = _get_paramiko()
+    client = paramiko.SSHClient()
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client.connect(sock=sock, **connect_kw)
+    except BaseException:
+        client.close()
+        sock.close()
+        raise
+    # exec_command / open_sftp 打开的通道按此窗口申请，大输出时不必频繁等待窗口调整
+    client.get_transport().default_window_size = _SSH_WINDOW_SIZE
+    return client
+
+
+class _PooledClient:
+    """连接池中的一条 SSH 连接：users 为正在使用的调用数；retired 表示已移出连接池，最后一个使用者归还时关闭。"""
+
+    __slots__ = ("key", "client", "created", "users", "retired")
+
+    def __init__(self, key: tuple, client) -> None:
+        self.key = key
+        self.client = client
+        self.created = time.monotonic()
+        self.users = 0
+        self.retired = False
+
+
+# 按 (host, port, 用户, 认证信息) 复用已建立的 SSH 连接，省去每条命令的 TCP 握手、密钥交换与认证；
+# 同一连接上可并发打开多个通道。超过 _POOL_TTL 秒的连接不再复用，最多保留 _POOL_MAX 条（LRU 淘汰）
+_POOL_TTL = 300.0
+_POOL_MAX = 32
+_pool: "OrderedDict[tuple, _PooledClient]" = OrderedDict()
+_pool_lock = threading.Lock()
+# 同一 key 的建连串行化，避免并发命令同时为一台资产各建一条连接
+_connect_locks: dict[tuple, threading.Lock] = {}
+
+
+def _pool_key(asset: AssetConfig) -> tuple:
+    return (asset.host, asset.port, asset.username, asset.password or "", asset.private_key_path or "")
+
+
+def _retire(entry: _PooledClient, to_close: list) -> None:
+    """调用方须持有 _pool_lock。"""
+    entry.retired = True
+    if entry.users == 0:
+        to_close.append(entry.client)
+
+
+def _acquire_client(asset: AssetConfig, timeout: int) -> tuple[Optional[_PooledClient], bool]:
+    """取一条可用连接，返回 (连接, 是否复用)；资产未配置认证方式时返回 (None, False)。用完须 _release_client。"""
+    key = _pool_key(asset)
+    with _pool_lock:
+        connect_lock = _connect_locks.setdefault(key, threading.Lock())
+    with connect_lock:
+        to_close: list = []
+        with _pool_lock:
+            entry = _pool.get(key)
+            if entry is not None:
+                transport = entry.client.get_transport()
+                if transport is not None and transport.is_active() and time.monotonic() - entry.created < _POOL_TTL:
+                    entry.users += 1
+                    _pool.move_to_end(key)
+                    return entry, True
+                del _pool[key]
+                _retire(entry, to_close)
+        for c in to_close:
+            c.close()
+        client = _connect_paramiko(asset, timeout)
+        if client is None:
+            return None, False
+        entry = _PooledClient(key, client)
+        entry.users = 1
+        to_close = []
+        with _pool_lock:
+            _pool[key] = entry
+            while len(_pool) > _POOL_MAX:
+                _, old = _pool.popitem(last=False)
+                _retire(old, to_close)
+        for c in to_close:
+            c.close()
+        return entry, False
+
+
+def _release_client(entry: _PooledClient, broken: bool = False) -> None:
+    """归还连接；broken 为 True（执行中出现异常）时将其移出连接池，不再复用。"""
+    with _pool_lock:
+        entry.users -= 1
+        if broken and not entry.retired:
+            if _pool.get(entry.key) is entry:
+                del _pool[entry.key]
+            entry.retired = True
+        close = entry.retired and entry.users == 0
+    if close:
+        entry.client.close()
+
+
+def _open_on_pooled(asset: AssetConfig, timeout: int, open_fn):
+    """在池中连接上执行 open_fn(client)（打开通道），返回 (连接, open_fn 的结果)；未配置认证方式时返回 (None, None)。
+    复用的连接可能已被服务端断开：此时通道尚未打开、命令未执行，换一条新连接重试一次。"""
+    entry, reused = _acquire_client(asset, timeout)
+    if entry is None:
+        return None, None
+    try:
+        return entry, open_fn(entry.client)
+    except (_paramiko.SSHException, EOFError, OSError):
+        _release_client(entry, broken=True)
+        if not reused:
+            raise
+    entry, _ = _acquire_client(asset, timeout)
+    try:
+        return entry, open_fn(entry.client)
+    except BaseException:
+        _release_client(entry, broken=True)
+        raise
+
+
+@atexit.register
+def _close_pool() -> None:
+    with _pool_lock:
+        entries = list(_pool.values())
+        _pool.clear()
+    for e in entries:
+        try:
+            e.client.close()
+        except Exception:
+            pass
+
+
+def _drain_channel(chan, timeout: int) -> tuple[bytes, bytes]:
+    """交替读取通道的 stdout 与 stderr 直到命令结束，返回 (stdout, stderr)。
+    两路共用通道窗口，只读一路会让另一路的未读数据占满窗口、卡住远端；超过 timeout 秒无任何输出时抛出 socket.timeout。"""
+    out_parts: list[bytes] = []
+    err_parts: list[bytes] = []
+    deadline = time.monotonic() + timeout
+    while True:
+        got = False
+        if chan.recv_ready():
+            out_parts.append(chan.recv(_RECV_SIZE))
+            got = True
+        if chan.recv_stderr_ready():
+            err_parts.append(chan.recv_stderr(_RECV_SIZE))
+            got = True
+        if got:
+            deadline = time.monotonic() + timeout
+            continue
+        # 退出状态在全部输出之后到达，但可能恰好在上面两次检查之间连同最后一段数据一起到达：
+        # 确认结束后再把两路缓冲区读空，避免截掉末尾输出
+        if chan.exit_status_ready() or chan.closed:
+            while True:
+                got = False
+                if chan.recv_ready():
+                    out_parts.append(chan.recv(_RECV_SIZE))
+                    got = True
+                if chan.recv_stderr_ready():
+                    err_parts.append(chan.recv_stderr(_RECV_SIZE))
+                    got = True
+                if not got:
+                    break
+            break
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout(f"{timeout} 秒内无输出")
+        select.select([chan], [], [], min(remaining, 1.0))
+    return b"".join(out_parts), b"".join(err_parts)
+
+
 def _execute_paramiko(asset: AssetConfig, command: str, timeout: int) -> str:
-    """使用 paramiko 执行。"""
-    client = _paramiko.SSHClient()
-    client.set_missing_host_key_policy(_paramiko.AutoAddPolicy())
+    """使用 paramiko 执行；连接取自连接池，执行完归还以便下一条命令复用。"""
+    entry = None
+    broken = True
     try:
-        connect_kw: dict = {
-            "hostname": asset.host,
-            "port": asset.port,
-            "username": asset.username,
-            "timeout": timeout,
-        }
-        if asset.password:
-            connect_kw["password"] = asset.password
-        elif asset.private_key_path:
-            connect_kw["key_filename"] = str(_resolve_key_path(asset.private_key_path))
-        else:
+        entry, chan = _open_on_pooled(asset, timeout, lambda c: c.get_transport().open_session())
+        if entry is None:
             return "错误：该资产未配置 password 或 private_key_path，无法连接。"
-        client.connect(**connect_kw)
-        stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
-        out = stdout.read().decode("utf-8", errors="replace")
-        err = stderr.read().decode("utf-8", errors="replace")
+        try:
+            chan.settimeout(timeout)
+            chan.exec_command(command)
+            out_b, err_b = _drain_channel(chan, timeout)
+        finally:
+            chan.close()
+        broken = False
+        out = out_b.decode("utf-8", errors="replace")
+        err = err_b.decode("utf-8", errors="replace")
         if err.strip():
-            return out + "\n[stderr]\n" + err
+            return "".join((out, "\n[stderr]\n", err))
         return out
     except _paramiko.AuthenticationException as e:
         return f"SSH 认证失败: {e}"
@@ -67,16 +301,85 @@ def _execute_paramiko(asset: AssetConfig, command: str, timeout: int) -> str:
     except Exception as e:
         return f"执行失败: {type(e).__name__}: {e}"
     finally:
-        client.close()
+        if entry is not None:
+            _release_client(entry, broken)
+
+
+# 系统 ssh/scp 回退路径的连接复用（OpenSSH ControlMaster）：同一 user@host:port 的后续调用经本地 Unix socket
+# 挂到已建立的主连接上，免去握手与认证；主连接空闲 60 秒后自行退出。Windows 版 OpenSSH 不支持，不启用
+_CONTROL_PERSIST = "60s"
+_control_targets: set[tuple[str, int]] = set()
+_control_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _control_dir() -> Optional[str]:
+    """ControlPath 所在目录（仅当前用户可访问）；不支持、创建失败或已有目录不可信时返回 None。"""
+    if os.name == "nt":
+        return None
+    d = Path(tempfile.gettempdir()) / f"aiops-ssh-{os.getuid()}"
+    try:
+        d.mkdir(mode=0o700, exist_ok=True)
+        st = os.lstat(d)
+    except OSError as e:
+        logger.warning("创建 ssh ControlPath 目录失败，不启用连接复用 dir=%s err=%s", d, e)
+        return None
+    # 路径可预测：若是他人抢先创建的目录（或符号链接），里面的 socket 可能挂到别人的主连接上，不能使用
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) != 0o700:
+        logger.warning("ssh ControlPath 目录不是当前用户独占的目录，不启用连接复用 dir=%s", d)
+        return None
+    return str(d)
+
+
+# 回退路径 ssh/scp 的加密算法偏好：AES-GCM 在带 AES-NI 的 x86 上比默认首选的 chacha20-poly1305 快数倍，大文件 scp 受益明显。
+# 列表保留 chacha20 与 ctr 兜底，服务端不支持 GCM 时照常协商；需要恢复 ssh 默认顺序时置为 False
+FAST_CIPHERS = True
+_FAST_CIPHER_LIST = (
+    "aes128-gcm@openssh.com,aes256-gcm@openssh.com,chacha20-poly1305@openssh.com,aes128-ctr,aes192-ctr,aes256-ctr"
+)
+
+
+def _cipher_opts() -> list[str]:
+    return ["-o", f"Ciphers={_FAST_CIPHER_LIST}"] if FAST_CIPHERS else []
+
+
+def _control_opts(asset: AssetConfig) -> list[str]:
+    """返回启用 ControlMaster 的 -o 参数（ssh 与 scp 通用），并记下目标以便退出时关闭主连接。"""
+    d = _control_dir()
+    if d is None:
+        return []
+    with _control_lock:
+        _control_targets.add((f"{asset.username}@{asset.host}", asset.port))
+    # %C 为连接参数的哈希，路径短且固定，不会超过 Unix socket 路径长度限制
+    return [
+        "-o", "ControlMaster=auto",
+        "-o", f"ControlPath={d}/%C",
+        "-o", f"ControlPersist={_CONTROL_PERSIST}",
+    ]
+
+
+@atexit.register
+def _close_control_masters() -> None:
+    d = _control_dir()
+    if d is None:
+        return
+    with _control_lock:
+        targets = list(_control_targets)
+        _control_targets.clear()
+    for dest, port in targets:
+        try:
+            subprocess.run(
+                ["ssh", "-o", f"ControlPath={d}/%C", "-p", str(port), "-O", "exit", dest],
+                capture_output=True,
+                timeout=5,
+            )
+        except Exception:
+            pass
 
 
 def _execute_subprocess(asset: AssetConfig, command: str, timeout: int) -> str:
     """使用系统 ssh 执行。密钥认证直接 ssh；密码认证在 Linux 下可用 sshpass（需安装）。"""
-    key_path = None
-    if asset.private_key_path:
-        p = _resolve_key_path(asset.private_key_path)
-        if p.exists():
-            key_path = str(p)
+    key_path = _existing_key_path(asset.private_key_path) if asset.private_key_path else None
 
     use_sshpass = bool(asset.password and not key_path)
     if asset.password and not key_path and not _sshpass_available():
@@ -86,13 +389,19 @@ def _execute_subprocess(asset: AssetConfig, command: str, timeout: int) -> str:
             "  2) 或安装 sshpass 后使用密码：sudo apt install sshpass（Ubuntu/Debian）"
         )
 
-    # ssh -o StrictHostKeyChecking=no -o ConnectTimeout=10 -p port [-i key] user@host "cmd"
+    # ssh -T -o StrictHostKeyChecking=no -o ConnectTimeout=10 [-o BatchMode=yes] -p port [-i key] user@host "cmd"
+    # -T 不分配终端；不走 sshpass 时加 BatchMode=yes，缺少可用密钥时立即失败而不是卡在密码提示上
     args = [
         "ssh",
+        "-T",
         "-o", "StrictHostKeyChecking=no",
         "-o", "ConnectTimeout=10",
+        *_cipher_opts(),
+        *_control_opts(asset),
         "-p", str(asset.port),
     ]
+    if not use_sshpass:
+        args.extend(["-o", "BatchMode=yes"])
     if key_path:
         args.extend(["-i", key_path])
     args.append(f"{asset.username}@{asset.host}")
@@ -100,7 +409,8 @@ def _execute_subprocess(asset: AssetConfig, command: str, timeout: int) -> str:
 
     env = None
     if use_sshpass and asset.password:
-        env = {**__import__("os").environ, "SSHPASS": asset.password}
+        env = os.environ.copy()
+        env["SSHPASS"] = asset.password
         # 使用 sshpass -e，从环境变量 SSHPASS 读密码，避免出现在进程列表
         args = ["sshpass", "-e"] + args
 
@@ -116,7 +426,7 @@ def _execute_subprocess(asset: AssetConfig, command: str, timeout: int) -> str:
         )
         out = r.stdout or ""
         if r.stderr:
-            out = out + "\n[stderr]\n" + r.stderr
+            out = "".join((out, "\n[stderr]\n", r.stderr))
         if r.returncode != 0 and not out.strip():
             out = f"[exit code {r.returncode}]" + (("\n" + r.stderr) if r.stderr else "")
         return out
@@ -130,10 +440,13 @@ def _execute_subprocess(asset: AssetConfig, command: str, timeout: int) -> str:
         return f"执行失败: {type(e).__name__}: {e}"
 
 
+# 包管理类命令关键词，合成一个不区分大小写的正则，不必先复制出小写串再逐个查找
+_SLOW_CMD_RE = re.compile(r"apt-get|apt |apt-|dnf |yum |zypper ", re.IGNORECASE)
+
+
 def _command_timeout(command: str, default: int = 30) -> int:
     """包管理类命令可能较慢，给更长超时。"""
-    cmd_lower = (command or "").strip().lower()
-    if any(x in cmd_lower for x in ("apt-get", "apt ", "apt-", "dnf ", "yum ", "zypper ")):
+    if _SLOW_CMD_RE.search((command or "").strip()):
         return max(default, 120)
     return default
 
@@ -142,72 +455,52 @@ def execute_on_asset(asset: AssetConfig, command: str, timeout: int | None = Non
     """在单台资产上执行命令，返回 stdout+stderr 合并文本。"""
     if timeout is None:
         timeout = _command_timeout(command, default=60)
-    logger.info("execute_on_asset 开始 asset=%s host=%s port=%s cmd=%r timeout=%s", asset.name, asset.host, asset.port, command, timeout)
-    if _paramiko_available:
+    log_info = logger.isEnabledFor(logging.INFO)
+    if log_info:
+        logger.info("execute_on_asset 开始 asset=%s host=%s port=%s cmd=%r timeout=%s", asset.name, asset.host, asset.port, command[:_LOG_CMD_MAX], timeout)
+    if _get_paramiko() is not None:
         result = _execute_paramiko(asset, command, timeout)
     else:
         result = _execute_subprocess(asset, command, timeout)
-    logger.info("execute_on_asset 完成 asset=%s cmd=%r result_len=%s", asset.name, command, len(result or ""))
+    if log_info:
+        logger.info("execute_on_asset 完成 asset=%s cmd=%r result_len=%s", asset.name, command[:_LOG_CMD_MAX], len(result) if result else 0)
     return result
 
 
 def _upload_paramiko(asset: AssetConfig, local_path: str, remote_path: str, timeout: int = 60) -> str:
-    """使用 paramiko SFTP 上传文件。"""
-    client = _paramiko.SSHClient()
-    client.set_missing_host_key_policy(_paramiko.AutoAddPolicy())
+    """使用 paramiko SFTP 上传本地文件：复用 _upload_stream_paramiko 的大块读取、流水线写与放大的 SFTP 窗口，
+    并以本地文件大小校验远端结果。"""
     try:
-        connect_kw: dict = {
-            "hostname": asset.host,
-            "port": asset.port,
-            "username": asset.username,
-            "timeout": timeout,
-        }
-        if asset.password:
-            connect_kw["password"] = asset.password
-        elif asset.private_key_path:
-            connect_kw["key_filename"] = str(_resolve_key_path(asset.private_key_path))
-        else:
-            return "错误：该资产未配置 password 或 private_key_path，无法连接。"
-        client.connect(**connect_kw)
-        sftp = client.open_sftp()
-        try:
-            sftp.put(local_path, remote_path)
-            return f"已上传至 {remote_path}"
-        finally:
-            sftp.close()
-    except _paramiko.AuthenticationException as e:
-        return f"SSH 认证失败: {e}"
-    except _paramiko.SSHException as e:
-        return f"SSH 错误: {e}"
-    except Exception as e:
+        with open(local_path, "rb") as fl:
+            return _upload_stream_paramiko(asset, fl, remote_path, timeout, size_hint=os.fstat(fl.fileno()).st_size)
+    except OSError as e:
         return f"上传失败: {type(e).__name__}: {e}"
-    finally:
-        client.close()
 
 
 def _upload_subprocess(asset: AssetConfig, local_path: str, remote_path: str, timeout: int = 60) -> str:
     """使用 scp 上传文件。仅支持密钥认证或 sshpass。"""
     if asset.password and not asset.private_key_path and not _sshpass_available():
         return "错误：上传文件需安装 paramiko 或 sshpass 以支持密码认证。"
-    key_path = None
-    if asset.private_key_path:
-        p = _resolve_key_path(asset.private_key_path)
-        if p.exists():
-            key_path = str(p)
+    key_path = _existing_key_path(asset.private_key_path) if asset.private_key_path else None
     use_sshpass = bool(asset.password and not key_path)
     args = [
         "scp",
         "-o", "StrictHostKeyChecking=no",
         "-o", "ConnectTimeout=10",
+        *_cipher_opts(),
+        *_control_opts(asset),
         "-P", str(asset.port),
     ]
+    if not use_sshpass:
+        args.extend(["-o", "BatchMode=yes"])
     if key_path:
         args.extend(["-i", key_path])
     args.append(local_path)
     args.append(f"{asset.username}@{asset.host}:{remote_path}")
     env = None
     if use_sshpass and asset.password:
-        env = {**__import__("os").environ, "SSHPASS": asset.password}
+        env = os.environ.copy()
+        env["SSHPASS"] = asset.password
         args = ["sshpass", "-e"] + args
     try:
         r = subprocess.run(args, capture_output=True, text=True, timeout=timeout, env=env)
@@ -226,30 +519,110 @@ def upload_file_to_asset(
     asset: AssetConfig, local_path: str, remote_path: str, timeout: int = 60
 ) -> str:
     """将本地文件上传到资产上的指定路径。"""
-    if _paramiko_available:
+    if _get_paramiko() is not None:
         return _upload_paramiko(asset, local_path, remote_path, timeout)
     return _upload_subprocess(asset, local_path, remote_path, timeout)
 
 
+def _upload_stream_paramiko(
+    asset: AssetConfig, fileobj: BinaryIO, remote_path: str, timeout: int = 60, size_hint: Optional[int] = None
+) -> str:
+    """使用 paramiko SFTP 把文件对象直接写到远端，不经过本地临时文件；连接取自连接池。"""
+    entry = None
+    broken = True
+    try:
+        entry, sftp = _open_on_pooled(
+            asset,
+            timeout,
+            lambda c: _paramiko.SFTPClient.from_transport(
+                c.get_transport(),
+                window_size=_SFTP_WINDOW_SIZE,
+                max_packet_size=_SFTP_MAX_PACKET_SIZE,
+            ),
+        )
+        if entry is None:
+            return "错误：该资产未配置 password 或 private_key_path，无法连接。"
+        try:
+            size = 0
+            with sftp.open(remote_path, "wb") as fr:
+                # 流水线写：不逐包等待服务端确认，由关闭文件时统一收齐
+                fr.set_pipelined(True)
+                while True:
+                    chunk = fileobj.read(_UPLOAD_CHUNK)
+                    if not chunk:
+                        break
+                    fr.write(chunk)
+                    size += len(chunk)
+            broken = False
+            # 已知原始大小时先比对本地读取量，读取被截断的上传不再额外 stat 远端
+            if size_hint is not None and size != size_hint:
+                return f"上传失败: 读取的数据不完整（{size} != {size_hint}）"
+            remote_size = sftp.stat(remote_path).st_size
+            if remote_size != size:
+                return f"上传失败: 远端文件大小不一致（{remote_size} != {size}）"
+            return f"已上传至 {remote_path}"
+        finally:
+            sftp.close()
+    except _paramiko.AuthenticationException as e:
+        return f"SSH 认证失败: {e}"
+    except _paramiko.SSHException as e:
+        return f"SSH 错误: {e}"
+    except Exception as e:
+        return f"上传失败: {type(e).__name__}: {e}"
+    finally:
+        if entry is not None:
+            _release_client(entry, broken)
+
+
+def _upload_stream_subprocess(asset: AssetConfig, fileobj: BinaryIO, remote_path: str, timeout: int = 60) -> str:
+    """scp 只能读取本地路径：先落盘到临时文件，再复用 _upload_subprocess。"""
+    tmp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False) as tmp:
+            tmp_path = tmp.name
+            shutil.copyfileobj(fileobj, tmp, _UPLOAD_CHUNK)
+        return _upload_subprocess(asset, tmp_path, remote_path, timeout)
+    except Exception as e:
+        return f"上传失败: {type(e).__name__}: {e}"
+    finally:
+        if tmp_path:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
+def upload_stream_to_asset(
+    asset: AssetConfig,
+    fileobj: BinaryIO,
+    remote_path: str,
+    timeout: int = 60,
+    size_hint: Optional[int] = None,
+) -> str:
+    """将文件对象（从当前位置读到 EOF）上传到资产上的指定路径；paramiko 可用时直接写入 SFTP。
+    size_hint 为已知的文件大小（如 UploadFile.size），用于校验数据完整性。"""
+    if _get_paramiko() is not None:
+        return _upload_stream_paramiko(asset, fileobj, remote_path, timeout, size_hint)
+    return _upload_stream_subprocess(asset, fileobj, remote_path, timeout)
+
+
 def get_asset_by_name(config: AppConfig, name: str) -> Optional[AssetConfig]:
     """按资产名称或 host（IP）查找；用户输入 IP 时可直接匹配到对应资产。"""
     name = (name or "").strip()
     if not name:
         return None
-    for a in config.assets:
-        if (a.name or "").strip() == name:
-            return a
-    for a in config.assets:
-        if (a.host or "").strip() == name:
-            return a
-    return None
+    by_name, by_host = config.asset_index()
+    return by_name.get(name) or by_host.get(name)
 
 
 def list_assets_display(config: AppConfig) -> str:
     """返回供 AI 阅读的资产列表文本。"""
     if not config.assets:
         return "当前没有配置任何 Linux 资产，请在 config.yaml 的 assets 中添加。"
-    lines = []
-    for a in config.assets:
-        lines.append(f"- {a.name}: {a.username}@{a.host}:{a.port}")
-    return "\n".join(lines)
+    return _assets_display_text(tuple((a.name, a.username, a.host, a.port) for a in config.assets))
+
+
+@lru_cache(maxsize=4)
+def _assets_display_text(assets_key: tuple) -> str:
+    """按 (name, username, host, port) 元组缓存资产列表文本；每次工具调用都会列资产，配置不变时直接复用。"""
+    return "\n".join(f"- {n}: {u}@{h}:{p}" for n, u, h, p in assets_key)
@@ -0,0 +1,33 @@
+"""orchestrator 中只读探测判定的测试：被判为探测的命令会在短时间内直接返回缓存结果而不走 SSH。"""
+import pytest
+
+from ai_ops_assistant.orchestrator import _is_readonly_probe
+
+
+@pytest.mark.parametrize(
+    "command",
+    ["df -h", "free -m", "uptime", "uname -a", "id bob", "systemctl status nginx", "cat /proc/meminfo", "nproc"],
+)
+def test_single_line_probes_are_readonly(command):
+    assert _is_readonly_probe(command)
+
+
+@pytest.mark.parametrize(
+    "command",
+    [
+        "df\nsystemctl restart nginx",
+        "id\nuserdel bob",
+        "uptime\n\nreboot",
+        "df -h\rreboot",
+        "systemctl\nstatus nginx",
+        "cat\n/proc/meminfo",
+        "free -m\n",
+    ],
+)
+def test_multi_line_commands_are_never_probes(command):
+    assert not _is_readonly_probe(command)
+
+
+@pytest.mark.parametrize("command", ["df -h | sort", "df; reboot", "uptime && reboot", "id $(whoami)", "rm -rf /tmp/x"])
+def test_compound_or_mutating_commands_are_not_probes(command):
+    assert not _is_readonly_probe(command)